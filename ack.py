@@ -1,4 +1,4 @@
-from typing import NoReturn, Any
+from typing import Any
 from textual.widgets import Button, Static
 from textual.containers import VerticalGroup, Middle, Center, Horizontal
 from textual.app import ComposeResult
@@ -6,7 +6,16 @@ import uuid
 import asyncio
 import astrid
 import gobber
+import gothi
+import mulch
 import stoick
+from ruffnut import logger
+
+
+VIKINGS_PER_PAGE = 8
+
+# The background load started once the intro is first shown, see warm_up()
+warming: asyncio.Task | None = None
 
 
 class GameIntro(stoick.ScreenRider):
@@ -37,6 +46,17 @@ class GameIntro(stoick.ScreenRider):
                 yield Button("Start", id="start")
                 yield Button("Exit", id="exit")
     
+    def on_mount(self):
+        self.call_after_refresh(self.on_shown)
+
+    def on_shown(self):
+        global warming
+        if "intro" in mulch.startup:
+            return
+        mulch.mark("intro")
+        if stoick.FAST_START:
+            warming = asyncio.create_task(warm_up())
+
     async def mission(self, renderer):
         self.start_event.clear()
         
@@ -44,7 +64,7 @@ class GameIntro(stoick.ScreenRider):
 
         renderer.app_container.mount(self)
 
-        await self.start_event.wait()
+        await mulch.wait("GameIntro", self.start_event.wait())
         await self.remove()
 
 class VikingSelectCard(VerticalGroup):
@@ -63,13 +83,26 @@ class VikingSelectCard(VerticalGroup):
 
 
 class VikingSelect(stoick.ScreenRider):
+    BACK = -1
+    PREV_PAGE = -2
+    NEXT_PAGE = -3
+
     vikings: list[tuple[str, str, Any]] = []
     select_event: asyncio.Event = asyncio.Event()
     selected_viking: int = -1
 
-    def __init__(self, vikings: list[tuple[str, str, Any]], *args, **kwargs):
+    def __init__(
+        self,
+        vikings: list[tuple[str, str, Any]],
+        page: int = 0,
+        pages: int = 1,
+        *args,
+        **kwargs,
+    ):
         super().__init__(*args, **kwargs)
         self.vikings = vikings
+        self.page = page
+        self.pages = pages
 
     async def on_button_pressed(self, event: Button.Pressed):
         bid: str = event.button.id  # type: ignore
@@ -79,7 +112,15 @@ class VikingSelect(stoick.ScreenRider):
             self.select_event.set()
             event.stop()
         elif bid == "back":
-            self.selected_viking = -1
+            self.selected_viking = self.BACK
+            self.select_event.set()
+            event.stop()
+        elif bid == "prev_page":
+            self.selected_viking = self.PREV_PAGE
+            self.select_event.set()
+            event.stop()
+        elif bid == "next_page":
+            self.selected_viking = self.NEXT_PAGE
             self.select_event.set()
             event.stop()
         elif bid == "new_viking":
@@ -102,18 +143,70 @@ class VikingSelect(stoick.ScreenRider):
                     card = VikingSelectCard(short, full, idx)
                     yield card
 
+            if self.pages > 1:
+                with Center():
+                    yield Button("Previous", id="prev_page", disabled=self.page == 0)
+                    yield Static(f"Page {self.page + 1} of {self.pages}")
+                    yield Button(
+                        "Next", id="next_page", disabled=self.page == self.pages - 1
+                    )
+
             yield Button("New Viking", id=f"new_viking")
 
+    def choices(self):
+        choices = [self.BACK, *range(len(self.vikings)), len(self.vikings)]
+        if self.page > 0:
+            choices.append(self.PREV_PAGE)
+        if self.page < self.pages - 1:
+            choices.append(self.NEXT_PAGE)
+        return choices
+
+    def labels(self):
+        labels = ["Back", *(f"{short} ({full})" for short, full, _ in self.vikings)]
+        labels.append("New Viking")
+        if self.page > 0:
+            labels.append("Previous page")
+        if self.page < self.pages - 1:
+            labels.append("Next page")
+        return labels
+
     async def mission(self, renderer: stoick.TextualRenderer):
         self.select_event.clear()
         renderer.app_container.mount(self)
 
-        await self.select_event.wait()
+        await mulch.wait("VikingSelect", self.select_event.wait())
 
         await self.remove()
         return self.selected_viking
 
 
+def _warm_up():
+    stoick.banner("SELECT VIKING", "diet_cola")
+    gobber.entity_cache.get_index()
+    gobber.effect_evaluator.release(gobber.effect_evaluator.acquire())
+    gobber.load_viking_index()
+
+
+async def warm_up():
+    """
+    Loads what the screens after the intro need while the player reads it:
+    the viking select banner, the story index, an effect interpreter and
+    the list of vikings.
+    """
+    try:
+        await asyncio.to_thread(_warm_up)
+    except Exception:
+        # Only a head start; whatever failed is loaded again when needed
+        logger.exception("Warm-up failed")
+    mulch.mark("warm")
+
+
+async def warmed_up():
+    """Waits for warm_up() if it's still running."""
+    if warming is not None:
+        await warming
+
+
 async def handles_this(current_entity: gobber.EntityID):
     if current_entity[0] == "init":
         return True
@@ -121,57 +214,70 @@ async def handles_this(current_entity: gobber.EntityID):
     return False
 
 
-async def draw_this(current_entity: gobber.EntityID):
+async def draw_this(
+    session: gobber.GameSession, current_entity: gobber.EntityID
+) -> gobber.Directive:
+    renderer = session.renderer
+
     if current_entity[0] == "init" and current_entity[1] == "start_screen":
-        await stoick.renderer.clear_screen(ask=False)
-        await stoick.renderer.send_rider(GameIntro())
-        gobber.entity_stack.append(gobber.EntityID(("init", "viking_select")))
-        await render_state()
+        await renderer.clear_screen(ask=False)
+        await renderer.send_rider(GameIntro())
+        return gobber.Directive.push(gobber.EntityID(("init", "viking_select")))
     elif current_entity[0] == "init" and current_entity[1] == "viking_select":
-        await stoick.renderer.clear_screen(ask=False)
-        vikings_list = gobber.list_vikings()
-        viking_idx = await stoick.renderer.send_rider(VikingSelect(vikings_list))
+        await renderer.clear_screen(ask=False)
+        # Don't list vikings or load the story while the warm-up still is
+        await warmed_up()
+        # Scanned once for both the page count and the page
+        index = gobber.load_viking_index()
+        pages = max(1, -(-len(index) // VIKINGS_PER_PAGE))
+        session.viking_page = min(session.viking_page, pages - 1)
+        vikings_list = gobber.list_vikings(
+            session.viking_page * VIKINGS_PER_PAGE, VIKINGS_PER_PAGE, index
+        )
+        viking_idx = await renderer.send_rider(
+            VikingSelect(vikings_list, session.viking_page, pages)
+        )
 
-        if viking_idx == -1:
-            gobber.entity_stack.pop()
-            await render_state()
+        if viking_idx == VikingSelect.BACK:
+            return gobber.Directive.pop()
+        elif viking_idx == VikingSelect.PREV_PAGE:
+            session.viking_page -= 1
+            return gobber.Directive.stay()
+        elif viking_idx == VikingSelect.NEXT_PAGE:
+            session.viking_page += 1
+            return gobber.Directive.stay()
         elif viking_idx == len(vikings_list):
-            gobber.entity_stack.append(gobber.EntityID(("init", "viking_create")))
-            await render_state()
+            return gobber.Directive.push(gobber.EntityID(("init", "viking_create")))
         else:
-            gobber.set_player_file(vikings_list[viking_idx][2])
-            gobber.load_game_state()
-            gobber.preload_story_entities()
+            gobber.set_player_file(session, vikings_list[viking_idx][2])
+            gobber.load_game_state(session)
+            gobber.preload_story_entities(session)
             await asyncio.sleep(0)
-            await stoick.renderer.clear_screen(ask=False)
-            await render_state()
+            await renderer.clear_screen(ask=False)
+            # The loaded save brings its own entity stack
+            return gobber.Directive.stay()
     elif current_entity[0] == "init" and current_entity[1] == "viking_create":
-        go_ahead, viking_name, viking_fullname = (
-            await stoick.renderer.send_viking_create()
-        )
+        go_ahead, viking_name, viking_fullname = await renderer.send_viking_create()
 
         if not go_ahead:
-            gobber.entity_stack.pop()
-            await render_state()
-
-        if go_ahead:
-            filename = str(uuid.uuid4()) + ".json"
-            gobber.set_player_file(filename)
-            gobber.set_player_state(
-                {
-                    "name": viking_name,
-                    "fullname": viking_fullname,
-                    "states": gobber.get_player_data()["states"],
-                }
-            )
-            gobber.preload_story_entities()
-
-            await stoick.renderer.clear_screen(ask=False)
-
-            astrid.reveal_location(gobber.EntityID(("location", "berk_square")))
-            gobber.save_game_state()
-            await render_state()
-
-
-async def render_state() -> NoReturn:
-    raise Exception("ERROR: Render_state not defiend")
+            return gobber.Directive.pop()
+
+        filename = str(uuid.uuid4()) + ".json"
+        gobber.set_player_file(session, filename)
+        gobber.set_player_state(
+            session,
+            {
+                "name": viking_name,
+                "fullname": viking_fullname,
+                "states": gobber.get_player_data()["states"],
+            },
+        )
+        gobber.preload_story_entities(session)
+
+        await renderer.clear_screen(ask=False)
+
+        astrid.reveal_location(session, gobber.EntityID(("location", "berk_square")))
+        gothi.autosave(session)
+        return gobber.Directive.stay()
+
+    raise Exception(f"Unknown init screen: {current_entity}")
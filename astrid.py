@@ -1,61 +1,128 @@
 import random
-from typing import NoReturn, Any
+from typing import Any
 import random
 import asyncio
+import logging
+import time
+from collections import deque
 
-from ruffnut import logger
-from tuffnut import exit_game
+from ruffnut import payload_logger
+import eret
 import gobber
+import mulch
+import skullcrusher
 import stoick
 from textual.widgets import Static, Button
 from textual.widget import Widget
 from textual.app import ComposeResult
 from textual.containers import VerticalGroup, Horizontal, CenterMiddle
 
+# Story and dialogue widgets kept mounted; older ones become plain text
+LIVE_WIDGETS = 30
+# Lines of that text kept above them
+TRANSCRIPT_LINES = 500
+# Widgets over LIVE_WIDGETS let through before trimming, so the transcript
+# is rewritten once per batch rather than every step
+TRIM_BATCH = 10
+
+
 class AstridWidget(Widget):
     async def mission(self, rider: Any) -> Any: ...
 
+    def transcript(self) -> str | None:
+        """This widget as a line of text, or None to leave it out."""
+        return None
+
+
+class Transcript(Static):
+    """Everything that scrolled out of the live window, as one widget."""
+
 
 class Astrid(VerticalGroup, stoick.ScreenRider):
 
-    def __init__(self, *children: AstridWidget, **kwargs):
+    def __init__(
+        self,
+        *children: AstridWidget,
+        live_widgets: int | None = LIVE_WIDGETS,
+        transcript_lines: int = TRANSCRIPT_LINES,
+        **kwargs,
+    ):
+        """live_widgets=None keeps every widget mounted."""
         super().__init__(*children, **kwargs)
         self.to_mount: list[Widget] = []
         self.mounted = False
         self.center = CenterMiddle()
+
+        self.live_widgets = live_widgets
+        self.lines: deque[str] = deque(maxlen=transcript_lines)
+        self.history: Transcript | None = None
     
+    def reset(self):
+        """Forgets the transcript and anything waiting to be mounted."""
+        self.to_mount.clear()
+        self.lines.clear()
+
     async def leave(self):
         if self.mounted:
-            to_remove = list(self.children)
-
-            for child in to_remove:
-                self.to_mount.append(child)
-                await child.remove()
+            # What was on screen is kept as text for when it comes back
+            live = [child for child in self.children if child is not self.history]
+            self._keep(live)
 
-            await self.remove()
+            # Takes this rider and everything in it off the screen at once
             await self.center.remove()
 
             self.mounted = False
     
     async def assign(self, renderer: stoick.TextualRenderer):
         if not self.mounted:
-            renderer.app_container.mount(self.center)
-            self.center.mount(self)
+            self.history = Transcript("\n\n".join(self.lines), markup=False)
+            self.history.display = bool(self.lines)
+            with renderer.batch_update():
+                renderer.app_container.mount(self.center)
+                self.center.mount(self)
+                self.mount(self.history)
 
             self.mounted = True
 
-        for child in self.to_mount:
-            self.mount(child)
+    def _keep(self, widgets: list[Widget]):
+        for widget in widgets:
+            line = widget.transcript()  # type: ignore
+            if line is not None:
+                self.lines.append(line)
+        if self.history is not None:
+            self.history.update("\n\n".join(self.lines))
+            self.history.display = bool(self.lines)
+
+    def trim(self, renderer: stoick.TextualRenderer):
+        """
+        Turns the widgets before the last live_widgets into transcript text,
+        once TRIM_BATCH more than that have piled up. They are removed in
+        the background, with the next refresh.
+        """
+        if self.live_widgets is None:
+            return
+        live = [child for child in self.children if child is not self.history]
+        if len(live) < self.live_widgets + TRIM_BATCH:
+            return
+        old = live[: len(live) - self.live_widgets]
+        self._keep(old)
+        renderer.remove_batch(self, old)
 
     async def mission(self, renderer: stoick.TextualRenderer):
         await self.assign(renderer)
 
-        for candidate in self.to_mount:
-            self.mount(candidate)
+        if mulch.enabled:
+            start = time.perf_counter()
+            renderer.mount_batch(self, self.to_mount)
+            mulch.record("mount", type(self.children[-1]).__name__, time.perf_counter() - start)
+        else:
+            renderer.mount_batch(self, self.to_mount)
         
         self.to_mount.clear()
+        self.trim(renderer)
 
-        return await self.children[-1].mission(self)  # type: ignore
+        current = self.children[-1]
+        return await mulch.wait(type(current).__name__, current.mission(self))  # type: ignore
 
 
 
@@ -70,6 +137,9 @@ class Story(VerticalGroup, AstridWidget):
     async def mission(self, rider: Any):
         pass
 
+    def transcript(self) -> str | None:
+        return self.story
+
 class Dialogue(AstridWidget):
     def __init__(self, speaker: str, text: str, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -83,6 +153,9 @@ class Dialogue(AstridWidget):
     async def mission(self, rider: Any):
         pass
 
+    def transcript(self) -> str | None:
+        return f"{self.speaker}: {self.text}"
+
 
 class Option(VerticalGroup, AstridWidget):
     async def on_button_pressed(self, event: Button.Pressed):
@@ -116,53 +189,149 @@ class Option(VerticalGroup, AstridWidget):
 stormfly = Astrid()
 
 
-async def _send_story(story: str):
+async def _send_story(session: gobber.GameSession, story: str):
+    if session.renderer.headless:
+        return await session.renderer.send_story(story)
     stormfly.to_mount.append(Story(story))
-    return await stoick.renderer.send_rider(stormfly)
+    return await session.renderer.send_rider(stormfly)
 
 
-async def _send_dialogue(speaker: str, text: str):
+async def _send_dialogue(session: gobber.GameSession, speaker: str, text: str):
+    if session.renderer.headless:
+        return await session.renderer.send_dialogue(speaker, text)
     stormfly.to_mount.append(Dialogue(speaker, text))
-    return await stoick.renderer.send_rider(stormfly)
+    return await session.renderer.send_rider(stormfly)
 
 
-async def _send_option(options: list[str]):
+async def _send_option(session: gobber.GameSession, options: list[str]):
+    if session.renderer.headless:
+        return await session.renderer.send_option(options)
     stormfly.to_mount.append(Option(options))
-    return await stoick.renderer.send_rider(stormfly)
+    return await session.renderer.send_rider(stormfly)
+
+
+class Effect:
+    """
+    What picking a menu option does. Menus hold these as plain data and the
+    chosen one is applied directly, returning the scheduler's next directive.
+    """
+
+    def apply(self, session: gobber.GameSession) -> gobber.Directive: ...
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class StartQuest(Effect):
+    def __init__(self, quest: gobber.EntityID, start_state: str):
+        self.quest = quest
+        self.start_state = start_state
+
+    def apply(self, session):
+        state = session.entity_states[self.quest]
+        state.variables["status"] = "inprogress"
+        state.state = self.start_state
+        state.step = 0
+        return gobber.Directive.push(self.quest)
+
+    def __str__(self):
+        return f"StartQuest({self.quest}, {self.start_state})"
+
+
+class PushEntity(Effect):
+    """Opens an entity in one of its opening states, on top of the stack."""
+
+    def __init__(self, entity: gobber.EntityID):
+        self.entity = entity
+
+    def apply(self, session):
+        open_entity(session, self.entity)
+        return gobber.Directive.push(self.entity)
+
+    def __str__(self):
+        return f"PushEntity({self.entity})"
 
 
-def _character_talk_to_player(character_entity: gobber.EntityID):
+class Pop(Effect):
+    def apply(self, session):
+        return gobber.Directive.pop()
+
+    def __str__(self):
+        return "Pop()"
+
+
+class SetState(Effect):
+    def __init__(self, entity: gobber.EntityID, state: str):
+        self.entity = entity
+        self.state = state
+
+    def apply(self, session):
+        session.entity_states[self.entity].state = self.state
+        session.entity_states[self.entity].step = 0
+        return gobber.Directive.stay()
+
+    def __str__(self):
+        return f"SetState({self.entity}, {self.state})"
+
+
+class FastTravel(Effect):
+    """Goes straight to a location the player already knows the way to."""
+
+    def __init__(self, origin: gobber.EntityID, destination: gobber.EntityID):
+        self.origin = origin
+        self.destination = destination
+
+    def apply(self, session):
+        session.entity_states[self.origin].state = "__menu__"
+        open_entity(session, self.destination)
+        return gobber.Directive.replace(self.destination)
+
+    def __str__(self):
+        return f"FastTravel({self.origin}, {self.destination})"
+
+
+class Travel(Effect):
+    """Leaves the current location along a connection."""
+
+    def __init__(self, connection: gobber.EntityID):
+        self.connection = connection
+
+    def apply(self, session):
+        open_entity(session, self.connection)
+        return gobber.Directive.replace(self.connection)
+
+    def __str__(self):
+        return f"Travel({self.connection})"
+
+
+def _startable_quests(session: gobber.GameSession, trigger: gobber.EntityID):
+    options = []
+    for quest in session.quest_board.startable(trigger):
+        quest_data = gobber.get_entity_data(quest)
+        options.append(
+            {
+                "text": quest_data["start_line"],
+                "effect": StartQuest(quest, quest_data["start_state"]),
+            }
+        )
+    return options
+
+
+def _character_talk_to_player(
+    session: gobber.GameSession, character_entity: gobber.EntityID
+):
     char_data = gobber.get_entity_data(character_entity)
 
     def transition_state(option):
         # don't mutate original option objects in char files
         opt = option.copy()
-        opt["effect"] = (
-            f"gobber.entity_states[gobber.entity_stack[-1]].state = '{opt['state']}'; gobber.entity_stack[-1].step = 0"
-        )
+        opt["effect"] = SetState(character_entity, opt["state"])
         return opt
 
     options = list(map(transition_state, char_data.get("option_menus", [])))
 
     # Append quests that can start
-    for i, quest in enumerate(gobber.quest_triggers.get(str(character_entity), [])):
-        quest_data = gobber.get_entity_data(quest)
-        # check start_condition and quest status
-        if (
-            gobber.run_effect(quest_data["start_condition"], quest)
-            and gobber.entity_states[quest].variables.get("status") == "idle"
-        ):
-            options.append(
-                {
-                    "text": quest_data["start_line"],
-                    "effect": (
-                        f"gobber.entity_states[gobber.quest_triggers['{str(character_entity)}'][{i}]].variables['status']='inprogress'; "
-                        f"gobber.entity_states[gobber.quest_triggers['{str(character_entity)}'][{i}]].state='{quest_data['start_state']}'; "
-                        f"gobber.entity_states[gobber.quest_triggers['{str(character_entity)}'][{i}]].step = 0; "
-                        f"gobber.entity_stack.append(gobber.quest_triggers['{str(character_entity)}'][{i}])"
-                    ),
-                }
-            )
+    options += _startable_quests(session, character_entity)
 
     # Add farewell option
     player_farewell = random.choice(
@@ -171,88 +340,130 @@ def _character_talk_to_player(character_entity: gobber.EntityID):
     options.append(
         {
             "text": player_farewell.format(character_name=char_data["name"]),
-            "effect": "gobber.entity_stack.pop()",
+            "effect": Pop(),
         }
     )
 
     return options
 
 
-def _location_world_to_player(location_entity: gobber.EntityID):
+def _location_world_to_player(
+    session: gobber.GameSession, location_entity: gobber.EntityID
+):
     assert location_entity[0] == "location"
 
-    options = []
-
     # Append quests that can start
-    for i, quest in enumerate(gobber.quest_triggers.get(str(location_entity), [])):
-        quest_data = gobber.get_entity_data(quest)
-        # check start_condition and quest status
-        if (
-            gobber.run_effect(quest_data["start_condition"], quest)
-            and gobber.entity_states[quest].variables.get("status") == "idle"
-        ):
-            options.append(
-                {
-                    "text": quest_data["start_line"],
-                    "effect": (
-                        f"gobber.entity_states[gobber.quest_triggers['{str(location_entity)}'][{i}]].variables['status']='inprogress'; "
-                        f"gobber.entity_states[gobber.quest_triggers['{str(location_entity)}'][{i}]].state='{quest_data['start_state']}'; "
-                        f"gobber.entity_states[gobber.quest_triggers['{str(location_entity)}'][{i}]].step = 0; "
-                        f"gobber.entity_stack.append(gobber.quest_triggers['{str(location_entity)}'][{i}])"
-                    ),
-                }
-            )
+    options = _startable_quests(session, location_entity)
 
-    for i, character in enumerate(
-        gobber.character_locations.get(location_entity[1], [])
-    ):
+    for character in session.character_locations.get(location_entity[1], []):
         character_data = gobber.get_entity_data(character)
 
-        logger.info(gobber.run_effect("character_death_msg", character))
-        logger.info(gobber.run_effect("character_health", character))
-        logger.info(gobber.run_effect("character_name", character))
+        if payload_logger.isEnabledFor(logging.INFO):
+            for probe in ["character_death_msg", "character_health", "character_name"]:
+                payload_logger.info(
+                    "%s %s: %s",
+                    character[1],
+                    probe,
+                    gobber.run_condition(session, probe, character),
+                )
 
         options.append(
             {
                 "text": random.choice(
                     gobber.get_player_data()["dialogues"]["characters"]["interact"]
-                    if gobber.run_effect("len(character_death_msg) == 0", character)
+                    if gobber.run_condition(
+                        session, "len(character_death_msg) == 0", character
+                    )
                     else gobber.get_player_data()["dialogues"]["characters"][
                         "find_location"
                     ]
                 ).format(character_name=character_data["name"]),
-                "effect": f"introduce_character(gobber.character_locations.get('{location_entity[1]}', [])[{i}])",
+                "effect": PushEntity(character),
             }
         )
 
-    for connection in gobber.travel_paths[location_entity]:
+    for connection_id, _, action in skullcrusher.get_graph().edges(location_entity[1]):
+
+        options.append(
+            {
+                "text": action,
+                "effect": Travel(gobber.EntityID(("connection", connection_id))),
+            }
+        )
+
+    if len(_fast_travel_destinations(session, location_entity)):
+        options.append(
+            {
+                "text": random.choice(
+                    gobber.get_player_data()["dialogues"]["travel"]["fast_travel"]
+                ),
+                "effect": SetState(location_entity, "__fast_travel__"),
+            }
+        )
+
+    return options
+
 
+def _fast_travel_destinations(
+    session: gobber.GameSession, location_entity: gobber.EntityID
+):
+    """Known locations reachable from here, nearest first."""
+    graph = skullcrusher.get_graph()
+    routes = []
+    for known in skullcrusher.known_locations(session):
+        if known == location_entity[1]:
+            continue
+        route = graph.route(location_entity[1], known)
+        if route is not None:
+            routes.append((len(route), known))
+
+    return [gobber.EntityID(("location", known)) for _, known in sorted(routes)]
+
+
+def _fast_travel_to_player(
+    session: gobber.GameSession, location_entity: gobber.EntityID
+):
+    travel_lines = gobber.get_player_data()["dialogues"]["travel"]
+
+    options = []
+    for destination in _fast_travel_destinations(session, location_entity):
         options.append(
             {
-                "text": gobber.get_entity_data(connection)["action"],
-                "effect": f"gobber.entity_stack.pop(); tread_connection(gobber.EntityID(('connection', '{connection[1]}')))",
+                "text": random.choice(travel_lines["destination"]).format(
+                    location_name=gobber.get_entity_data(destination)["name"]
+                ),
+                "effect": FastTravel(location_entity, destination),
             }
         )
 
+    options.append(
+        {
+            "text": random.choice(travel_lines["stay"]),
+            "effect": SetState(location_entity, "__menu__"),
+        }
+    )
+
     return options
 
 
-async def _ask_player(options):
+async def _ask_player(session: gobber.GameSession, options):
     if options != None:
-        choice = await _send_option([option["text"] for option in options])
+        choice = await _send_option(session, [option["text"] for option in options])
         selected_choice = options[choice]
 
         if "retrospective" in selected_choice:
             ret = selected_choice["retrospective"]
             if ret["type"] == "story":
-                await _send_story(ret["line"])
+                await _send_story(session, ret["line"])
             elif ret["type"] == "dialogue":
-                await _send_dialogue(gobber.get_player_state()["name"], ret["line"])
+                await _send_dialogue(
+                    session, gobber.get_player_state(session)["name"], ret["line"]
+                )
             elif ret["type"] == "skip":
                 pass
         else:
             await _send_dialogue(
-                gobber.get_player_state()["name"], selected_choice["text"]
+                session, gobber.get_player_state(session)["name"], selected_choice["text"]
             )
 
         return selected_choice
@@ -260,45 +471,35 @@ async def _ask_player(options):
     return {}
 
 
-def load_entity(entity: gobber.EntityID):
+def open_entity(session: gobber.GameSession, entity: gobber.EntityID):
     opening_state = random.choice(
         gobber.get_entity_data(entity).get("opening_states", ["__menu__"])
     )
-    gobber.entity_states[entity].state = opening_state
-    gobber.entity_states[entity].step = 0
-    gobber.entity_stack.append(entity)
+    session.entity_states[entity].state = opening_state
+    session.entity_states[entity].step = 0
 
 
-def introduce_character(character: gobber.EntityID):
-    assert character[0] == "character"
+def load_entity(session: gobber.GameSession, entity: gobber.EntityID):
+    open_entity(session, entity)
+    session.entity_stack.append(entity)
 
-    return load_entity(character)
 
-    opening_state = random.choice(
-        gobber.get_entity_data(character).get("opening_states", ["__menu__"])
-    )
-    gobber.entity_states[character].state = opening_state
-    gobber.entity_states[character].step = 0
-    gobber.entity_stack.append(character)
+def introduce_character(session: gobber.GameSession, character: gobber.EntityID):
+    assert character[0] == "character"
 
+    return load_entity(session, character)
 
-def reveal_location(location: gobber.EntityID):
-    assert location[0] == "location"
 
-    return load_entity(location)
+def reveal_location(session: gobber.GameSession, location: gobber.EntityID):
+    assert location[0] == "location"
 
-    opening_state = random.choice(
-        gobber.get_entity_data(location).get("opening_states", ["__menu__"])
-    )
-    gobber.entity_states[location].state = opening_state
-    gobber.entity_states[location].step = 0
-    gobber.entity_stack.append(location)
+    return load_entity(session, location)
 
 
-def tread_connection(connection: gobber.EntityID):
+def tread_connection(session: gobber.GameSession, connection: gobber.EntityID):
     assert connection[0] == "connection"
 
-    return load_entity(connection)
+    return load_entity(session, connection)
 
 
 async def handles_this(current_entity: gobber.EntityID):
@@ -312,61 +513,64 @@ async def handles_this(current_entity: gobber.EntityID):
         return True
 
     await stormfly.leave()
-    stormfly.to_mount.clear()
+    stormfly.reset()
 
     return False
 
 
-async def draw_this(current_entity: gobber.EntityID) -> NoReturn:
-    state = gobber.entity_states[current_entity]
+async def draw_this(
+    session: gobber.GameSession, current_entity: gobber.EntityID
+) -> gobber.Directive:
+    state = session.entity_states[current_entity]
 
     # quick local cache for repeated reads
     entity_file = gobber.get_entity_data(current_entity)
 
     # We can never talk to a dead character
     if current_entity[0] == "character":
-        if gobber.run_effect("len(character_death_msg) != 0", current_entity):
+        if gobber.run_condition(
+            session, "len(character_death_msg) != 0", current_entity
+        ):
             await _send_story(
-                str(gobber.run_effect("character_death_msg", current_entity))
+                session,
+                str(gobber.run_effect(session, "character_death_msg", current_entity)),
             )
-            await _send_option(["Continue"])
-            gobber.entity_stack.pop()
-            await render_state()
+            await _send_option(session, ["Continue"])
+            return gobber.Directive.pop()
 
     if current_entity[0] == "character" and state.state == "__menu__":
         character_line = random.choice(entity_file["menu_lines"])
         character_name = entity_file["name"]
 
-        options = _character_talk_to_player(current_entity)
+        options = _character_talk_to_player(session, current_entity)
 
-        await _send_dialogue(character_name, character_line)
-        selected_choice = await _ask_player(options)
-        exec(selected_choice.get("effect", "None"), globals(), locals())
-        await render_state()
-        exit_game()
+        await _send_dialogue(session, character_name, character_line)
+        selected_choice = await _ask_player(session, options)
+        return selected_choice["effect"].apply(session)
 
     if current_entity[0] == "location" and state.state == "__menu__":
         location_ambient = random.choice(entity_file["ambient"])
 
-        options = _location_world_to_player(current_entity)
+        options = _location_world_to_player(session, current_entity)
 
-        await _send_story(location_ambient)
+        await _send_story(session, location_ambient)
 
-        logger.info(options)
+        payload_logger.info("Location options: %s", options)
 
-        selected_choice = await _ask_player(options)
+        selected_choice = await _ask_player(session, options)
 
-        exec(selected_choice.get("effect", "None"), globals(), locals())
-        await render_state()
-        exit_game()
+        return selected_choice["effect"].apply(session)
+
+    if current_entity[0] == "location" and state.state == "__fast_travel__":
+        options = _fast_travel_to_player(session, current_entity)
+        selected_choice = await _ask_player(session, options)
+
+        return selected_choice["effect"].apply(session)
 
     if current_entity[0] == "connection" and state.state == "__menu__":
-        gobber.entity_stack.pop()
-        reveal_location(
-            gobber.EntityID(("location", gobber.get_entity_data(current_entity)["to"]))
-        )
-        await render_state()
-        exit_game()
+        location = gobber.EntityID(("location", entity_file["to"]))
+        open_entity(session, location)
+        return gobber.Directive.replace(location)
 
     current_state = entity_file["states"][state.state]
     step = current_state["steps"][state.step]
@@ -374,49 +578,39 @@ async def draw_this(current_entity: gobber.EntityID) -> NoReturn:
 
     match step["type"]:
         case "story":
-            await _send_story(step["text"])
+            await _send_story(session, step["text"])
         case "dialogue":
             speaker = step["speaker"]
             speaker_name = gobber.get_entity_data(
                 gobber.EntityID(("character", speaker))
             )["name"]
 
-            await _send_dialogue(speaker_name, step["text"])
-            selected_choice = await _ask_player(step.get("choices", None))
-            gobber.run_effect(selected_choice.get("effect", "None"), current_entity)
+            await _send_dialogue(session, speaker_name, step["text"])
+            selected_choice = await _ask_player(session, step.get("choices", None))
+            gobber.run_effect(
+                session, selected_choice.get("effect", "None"), current_entity
+            )
         case "stateUpdate":
-            gobber.run_effect(step["update"], current_entity)
+            gobber.run_effect(session, step["update"], current_entity)
 
     if state.step < (steps - 1):
-        gobber.entity_states[current_entity].step += 1
-        await render_state()
-        asyncio.get_event_loop().stop()
-        return
-    else:
-        # quest completion cleanup
-        if current_entity[0] == "quest" and gobber.entity_states[
-            current_entity
-        ].variables.get("status") in ["completed", "failed"]:
-            gobber.entity_stack.pop()
-            if len(gobber.entity_stack):
-                await render_state()
-                asyncio.get_event_loop().stop()
-                return
-            else:
-                logger.debug("No more scenes to render!")
-                await exit_game()
-
-        # Move transition
-        for transition in current_state.get("transitions", []):
-            logger.info(transition["condition"])
-            if gobber.run_effect(transition["condition"], current_entity):
-                gobber.entity_states[current_entity].state = transition["target"]
-                gobber.entity_states[current_entity].step = 0
-                await render_state()
-                exit_game()
-
-        raise Exception("ERROR: OUT OF TRANSITION TARGETS!!!")
-
-
-async def render_state() -> NoReturn:
-    raise Exception("ERROR: Render_state not defiend")
+        session.entity_states[current_entity].step += 1
+        return gobber.Directive.stay()
+
+    # quest completion cleanup
+    if current_entity[0] == "quest" and session.entity_states[
+        current_entity
+    ].variables.get("status") in ["completed", "failed"]:
+        return gobber.Directive.pop()
+
+    # Move transition, skipping the ones eret found can never fire
+    for condition, target, always in eret.table(current_entity, entity_file).live(
+        state.state
+    ):
+        payload_logger.info("Checking transition: %s", condition)
+        if always or gobber.run_condition(session, condition, current_entity):
+            session.entity_states[current_entity].state = target
+            session.entity_states[current_entity].step = 0
+            return gobber.Directive.stay()
+
+    raise Exception("ERROR: OUT OF TRANSITION TARGETS!!!")
@@ -0,0 +1,210 @@
+"""
+Bork: the story bundle. Bork the Bold wrote everything worth knowing about
+dragons into one book, and this does the same for story/.
+
+compile_story() turns story/*/*.json into a single file: a header with an
+offset index and a manifest, followed by every entity pickled on its own. Connections get
+one entry each. Entities are unpickled from a memory map only when asked
+for, so opening a bundle costs the same however many story files there are.
+
+Run `python bork.py` to compile the story ahead of time. load_bundle()
+also recompiles whenever the story has changed since the last compile.
+"""
+
+import json
+import mmap
+import os
+import pickle
+import struct
+import sys
+from pathlib import Path
+from typing import Any
+
+from ruffnut import logger
+
+BUNDLE_FILE = "story.bundle"
+BUNDLE_MAGIC = b"BERKBOOK"
+BUNDLE_VERSION = 2
+
+# magic, format version, header length
+_PREAMBLE = struct.Struct("<8sIQ")
+
+
+def _dir_mtimes(base_dir: Path) -> dict[str, int]:
+    """Adding, removing or renaming a story file shows up in these."""
+    mtimes = {str(base_dir): base_dir.stat().st_mtime_ns}
+    for type_dir in base_dir.iterdir():
+        if type_dir.is_dir():
+            mtimes[str(type_dir)] = type_dir.stat().st_mtime_ns
+    return mtimes
+
+
+def summarize(entity_type: str, data: dict[str, Any]) -> str | None:
+    """
+    The one field the engine's indexes need from an entity, so they can be
+    built without loading it: where a quest starts, where a character
+    starts, and where a connection leads from.
+    """
+    if entity_type == "quest":
+        return data["start_entity"]
+    if entity_type == "character":
+        return data.get("variables", {}).get("location")
+    if entity_type == "connection":
+        return data["from"]
+    return None
+
+
+def compile_story(base_path="story", bundle_file=BUNDLE_FILE) -> "Bundle":
+    """
+    Compiles every story/<type>/<name>.json into bundle_file. Each entry
+    remembers its source file and that file's mtime at compile time.
+    """
+    base_dir = Path(base_path)
+    if not base_dir.exists():
+        raise FileNotFoundError(f"Story base path not found: {base_dir}")
+
+    entries: dict[str, tuple[int, int, str, int]] = {}
+    manifest: dict[str, dict[str, str | None]] = {}
+    blobs: list[bytes] = []
+    offset = 0
+
+    def add(key: str, data: Any, source: str, mtime: int):
+        nonlocal offset
+        blob = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+        entries[key] = (offset, len(blob), source, mtime)
+        blobs.append(blob)
+        offset += len(blob)
+
+    dir_mtimes = _dir_mtimes(base_dir)
+    for type_dir in sorted(base_dir.iterdir()):
+        if not type_dir.is_dir():
+            continue
+        for file_path in sorted(type_dir.glob("*.json")):
+            entity_type = type_dir.name
+            entity_name = file_path.stem
+            source = f"{base_path}/{entity_type}/{entity_name}.json"
+            mtime = file_path.stat().st_mtime_ns
+            with open(file_path, "r") as f:
+                data = json.load(f)
+
+            if entity_type == "location" and entity_name == "connections":
+                for id, connection in data.items():
+                    add(f"connection:{id}", connection, source, mtime)
+                    manifest.setdefault("connection", {})[id] = summarize(
+                        "connection", connection
+                    )
+            else:
+                add(f"{entity_type}:{entity_name}", data, source, mtime)
+                manifest.setdefault(entity_type, {})[entity_name] = summarize(
+                    entity_type, data
+                )
+
+    header = pickle.dumps(
+        {
+            "base_path": base_path,
+            "dirs": dir_mtimes,
+            "entries": entries,
+            "manifest": manifest,
+        },
+        pickle.HIGHEST_PROTOCOL,
+    )
+
+    temp_file = bundle_file + ".tmp"
+    with open(temp_file, "wb") as f:
+        f.write(_PREAMBLE.pack(BUNDLE_MAGIC, BUNDLE_VERSION, len(header)))
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(temp_file, bundle_file)
+
+    logger.info("Compiled %d story entities into %s", len(entries), bundle_file)
+    return Bundle(bundle_file)
+
+
+class Bundle:
+    def __init__(self, bundle_file=BUNDLE_FILE):
+        self.bundle_file = bundle_file
+        with open(bundle_file, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, header_length = _PREAMBLE.unpack_from(self.map)
+        if magic != BUNDLE_MAGIC or version != BUNDLE_VERSION:
+            raise Exception(f"Not a story bundle: {bundle_file}")
+
+        header = pickle.loads(
+            self.map[_PREAMBLE.size : _PREAMBLE.size + header_length]
+        )
+        self.data_start = _PREAMBLE.size + header_length
+        self.base_path: str = header["base_path"]
+        self.dirs: dict[str, int] = header["dirs"]
+        self.entries: dict[str, tuple[int, int, str, int]] = header["entries"]
+        # type -> name -> summarize()
+        self.manifest: dict[str, dict[str, str | None]] = header["manifest"]
+        # source file -> its mtime when compiled
+        self.sources = {entry[2]: entry[3] for entry in self.entries.values()}
+
+        # Set once a source file is found newer than its entry
+        self.stale = False
+
+    def is_current(self) -> bool:
+        """
+        Whether every story file is as it was compiled. The directories
+        show files added or removed; edits in place need a stat per file.
+        """
+        if self.stale:
+            return False
+        try:
+            if _dir_mtimes(Path(self.base_path)) != self.dirs:
+                return False
+            for source, mtime in self.sources.items():
+                if os.stat(source).st_mtime_ns != mtime:
+                    self.stale = True
+                    return False
+        except FileNotFoundError:
+            return False
+        return True
+
+    def source(self, key: str) -> str | None:
+        entry = self.entries.get(key)
+        return entry[2] if entry is not None else None
+
+    def get(self, key: str, mtime: int | None = None) -> Any | None:
+        """
+        Unpickles one entity. Returns None if it isn't in the bundle, or if
+        mtime is given and the source file has changed since compiling.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        offset, length, _, compiled_mtime = entry
+        if mtime is not None and mtime != compiled_mtime:
+            self.stale = True
+            return None
+
+        start = self.data_start + offset
+        return pickle.loads(self.map[start : start + length])
+
+    def close(self):
+        self.map.close()
+
+
+def load_bundle(base_path="story", bundle_file=BUNDLE_FILE) -> Bundle:
+    """Opens bundle_file, recompiling it first if the story has changed."""
+    try:
+        bundle = Bundle(bundle_file)
+        if bundle.base_path == base_path and bundle.is_current():
+            return bundle
+        bundle.close()
+    except (FileNotFoundError, ValueError, struct.error, pickle.UnpicklingError):
+        pass
+    except Exception as e:
+        logger.info("Ignoring unreadable story bundle: %s", e)
+
+    return compile_story(base_path, bundle_file)
+
+
+if __name__ == "__main__":
+    base_path = sys.argv[1] if len(sys.argv) > 1 else "story"
+    bundle = compile_story(base_path)
+    print(f"Compiled {len(bundle.entries)} story entities into {bundle.bundle_file}")
@@ -0,0 +1,252 @@
+"""
+Eret: the state charts. Eret, son of Eret, knew every trap and every way
+out of the archipelago, and this knows every way into and out of each
+story state.
+
+analyze() turns one entity's states into a graph and a transition table.
+For every state the table keeps, in order, only the transitions that can
+fire: a condition that is always false (like "False") is dropped, and so
+is everything after one that is always true, which is marked so it needs
+no evaluating. Along the way it finds:
+
+    missing      transition targets that aren't a state of the entity
+    unreachable  states no path from an opening state gets to
+    dead_ends    states with nothing left to fire, where draw_this would
+                 run out of transition targets; quest states that can set
+                 quest_status don't count, since they finish the quest
+
+It is one pass over the states and one breadth-first search, so linear in
+states and transitions. table() keeps the table for each loaded entity
+until its story data is reloaded, and analyze_story() charts every entity
+at once. Run `python eret.py [--json]` to print what it finds, or the whole
+table.
+"""
+
+import ast
+import json
+import re
+import sys
+from collections import deque
+from typing import Any
+
+import gobber
+
+# Targets the engine draws itself instead of a story state; quests have none
+BUILTIN_STATES = {"__menu__", "__fast_travel__"}
+
+# Nodes a condition can be made of and still read nothing
+_CONSTANT_NODES = (
+    ast.Expression,
+    ast.Constant,
+    ast.BoolOp,
+    ast.And,
+    ast.Or,
+    ast.UnaryOp,
+    ast.Not,
+    ast.USub,
+    ast.UAdd,
+    ast.Compare,
+    ast.Eq,
+    ast.NotEq,
+    ast.Lt,
+    ast.LtE,
+    ast.Gt,
+    ast.GtE,
+)
+
+_IDENTIFIER = re.compile(r"[A-Za-z_]\w*")
+_KEYWORDS = {"True", "False", "None", "and", "or", "not"}
+
+# condition -> constant(condition), for the ones that name nothing
+_constants: dict[str, bool | None] = {}
+
+
+def constant(condition: str) -> bool | None:
+    """
+    Whether a condition that reads nothing, like "True" or "1 > 2", always
+    holds. None if it depends on something.
+    """
+    # Anything naming a variable or function isn't, and most conditions do
+    if not _KEYWORDS.issuperset(_IDENTIFIER.findall(condition)):
+        return None
+    if condition in _constants:
+        return _constants[condition]
+    value = None
+    try:
+        tree = ast.parse(condition.strip(), mode="eval")
+        if all(isinstance(node, _CONSTANT_NODES) for node in ast.walk(tree)):
+            value = bool(eval(compile(tree, "<condition>", "eval"), {"__builtins__": {}}))
+    except Exception:
+        pass
+    _constants[condition] = value
+    return value
+
+
+def _may_finish(state: dict[str, Any]) -> bool:
+    for step in state.get("steps") or []:
+        if not isinstance(step, dict):
+            continue
+        effects = [step.get("update")]
+        effects += [
+            choice.get("effect")
+            for choice in step.get("choices") or []
+            if isinstance(choice, dict)
+        ]
+        for effect in effects:
+            if isinstance(effect, str):
+                if "quest_status" in gobber.effect_evaluator.compile(effect).writes:
+                    return True
+    return False
+
+
+class StateTable:
+    """One entity's transition table, and what's wrong with its states."""
+
+    __slots__ = (
+        "transitions",
+        "entries",
+        "impossible",
+        "missing",
+        "unreachable",
+        "dead_ends",
+    )
+
+    def __init__(self):
+        # state -> (condition, target, always true) for each transition that
+        # can fire, in order
+        self.transitions: dict[str, tuple[tuple[str, str, bool], ...]] = {}
+        # Opening states, where every path starts
+        self.entries: list[str] = []
+        # (state, transition index) that can never fire
+        self.impossible: list[tuple[str, int]] = []
+        # (state, transition index, target)
+        self.missing: list[tuple[str, int, str]] = []
+        self.unreachable: list[str] = []
+        self.dead_ends: list[str] = []
+
+    def live(self, state: str) -> tuple[tuple[str, str, bool], ...]:
+        return self.transitions.get(state, ())
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "transitions": {
+                state: [list(transition) for transition in live]
+                for state, live in self.transitions.items()
+            },
+            "entries": self.entries,
+            "impossible": self.impossible,
+            "missing": self.missing,
+            "unreachable": self.unreachable,
+            "dead_ends": self.dead_ends,
+        }
+
+
+def analyze(entity_type: str, data: Any) -> StateTable:
+    """Charts one entity's states. Malformed parts are skipped, see stormfly."""
+    table = StateTable()
+    states = data.get("states") if isinstance(data, dict) else None
+    if not isinstance(states, dict):
+        return table
+    builtin = set() if entity_type == "quest" else BUILTIN_STATES
+
+    if entity_type == "quest":
+        entries = [data.get("start_state")]
+    else:
+        entries = list(data.get("opening_states") or [])
+        entries += [
+            option.get("state")
+            for option in data.get("option_menus") or []
+            if isinstance(option, dict)
+        ]
+    table.entries = [entry for entry in dict.fromkeys(entries) if entry in states]
+
+    for name, state in states.items():
+        if not isinstance(state, dict):
+            continue
+        transitions = state.get("transitions") or []
+        live = []
+        for idx, transition in enumerate(transitions):
+            if not isinstance(transition, dict):
+                continue
+            condition = transition.get("condition")
+            target = transition.get("target")
+            if not isinstance(condition, str) or not isinstance(target, str):
+                continue
+            value = constant(condition)
+            if value is False:
+                table.impossible.append((name, idx))
+                continue
+            if target not in states and target not in builtin:
+                table.missing.append((name, idx, target))
+            live.append((condition, target, value is True))
+            if value is True:
+                table.impossible += [
+                    (name, later) for later in range(idx + 1, len(transitions))
+                ]
+                break
+        table.transitions[name] = tuple(live)
+        if not live and not (entity_type == "quest" and _may_finish(state)):
+            table.dead_ends.append(name)
+
+    reached = set(table.entries)
+    queue = deque(table.entries)
+    while queue:
+        for _, target, _ in table.live(queue.popleft()):
+            if target in states and target not in reached:
+                reached.add(target)
+                queue.append(target)
+    table.unreachable = [name for name in states if name not in reached]
+    return table
+
+
+# entity -> (the story data the table was built from, table)
+_tables: dict[gobber.EntityID, tuple[Any, StateTable]] = {}
+
+
+def table(entity: gobber.EntityID, data: Any = None) -> StateTable:
+    """
+    The table for an entity's current story data, built on first use and
+    again once the data is reloaded. Pass data if it's already at hand.
+    """
+    if data is None:
+        data = gobber.get_entity_data(entity)
+    cached = _tables.get(entity)
+    if cached is not None and cached[0] is data:
+        return cached[1]
+    charted = analyze(entity[0], data)
+    _tables[entity] = (data, charted)
+    return charted
+
+
+def analyze_story(base_path: str = "story") -> dict[str, StateTable]:
+    """A table for every entity in the story, keyed like "quest:name"."""
+    index = gobber.entity_cache.get_index(base_path)
+    tables = {}
+    for entity_type, names in index.summaries.items():
+        for name in names:
+            entity = gobber.EntityID((entity_type, name))
+            tables[str(entity)] = table(entity)
+    return tables
+
+
+def findings(tables: dict[str, StateTable]) -> list[str]:
+    """Everything analyze_story() found wrong, one line each."""
+    lines = []
+    for key, charted in tables.items():
+        for state, idx, target in charted.missing:
+            lines.append(f"{key}: {state} transition {idx} targets missing state '{target}'")
+        for state in charted.dead_ends:
+            lines.append(f"{key}: {state} is a dead end")
+        for state in charted.unreachable:
+            lines.append(f"{key}: {state} is unreachable")
+        for state, idx in charted.impossible:
+            lines.append(f"{key}: {state} transition {idx} can never fire")
+    return lines
+
+
+if __name__ == "__main__":
+    tables = analyze_story()
+    if "--json" in sys.argv:
+        print(json.dumps({key: charted.to_dict() for key, charted in tables.items()}))
+    else:
+        print("\n".join(findings(tables)) or "No problems found.")
@@ -1,24 +1,124 @@
-from typing import Any
-import asteval
+from typing import TYPE_CHECKING, Any, Callable
+import ast
+import bisect
+import copy
+import itertools
 import json
-from pathlib import Path
-from os import listdir
-from os.path import isfile, join
+import threading
+import weakref
+from os import replace, scandir, stat
+from os.path import basename, dirname, join, splitext
+from time import perf_counter, time
 
+import bork
+import mulch
 from ruffnut import logger
 
+if TYPE_CHECKING:
+    # Imported with the first interpreter, see EffectEvaluator.acquire
+    import asteval
+
 SAVEGAME_FOLDER = "savegames"
+SAVEGAME_INDEX = "index"
+SAVE_FORMAT = 2  # 1: every entity state, 2: only what differs from the story
+CONNECTIONS_FILE = "story/location/connections.json"
+PLAYER_FILE = "story/player.json"
+# A cached story file's mtime is checked again at most this often
+RECHECK_INTERVAL = 1.0  # seconds
+
+
+_versions = itertools.count(1)
+
+
+class Variables(dict[str, Any]):
+    """
+    An entity's variables. Every change takes a new version number from one
+    counter shared by all entities, so anything computed from them can tell
+    whether they changed since, even if the entity state was replaced.
+    Changes to a single variable are versioned by name, see version_of.
+
+    There is one of these per entity, so they hold as little as they can:
+    versions is the version of the last change that could touch every
+    variable, until one is changed alone; then it becomes a dict of that
+    version under None and each variable changed alone since.
+    """
+
+    __slots__ = ("versions", "entity", "owner")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.versions: int | dict[str | None, int] = next(_versions)
+        # Set once the variables are put in a session's entity_states, whose
+        # on_change then hears about every change
+        self.entity: EntityID | None = None
+        self.owner: EntityStates | None = None
+
+    def __reduce__(self):
+        # Copies are detached: a new version and no owning entity
+        return (Variables, (dict(self),))
+
+    def touch(self, key: str | None = None):
+        """Marks key, or with no key every variable, as changed."""
+        version = next(_versions)
+        if key is None:
+            self.versions = version
+        elif type(self.versions) is int:
+            self.versions = {None: self.versions, key: version}
+        else:
+            self.versions[key] = version  # type: ignore
+        if self.owner is not None and self.owner.on_change is not None:
+            self.owner.on_change(self.entity)  # type: ignore
+
+    def version_of(self, key: str) -> int:
+        """The version of the last change that could have touched key."""
+        versions = self.versions
+        if type(versions) is int:
+            return versions  # type: ignore
+        return versions.get(key, versions[None])  # type: ignore
+
+    def __setitem__(self, key: str, value: Any):
+        super().__setitem__(key, value)
+        self.touch(key)
+
+    def __delitem__(self, key: str):
+        super().__delitem__(key)
+        self.touch(key)
+
+    def setdefault(self, key: str, default: Any = None) -> Any:
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.touch()
+
+    def pop(self, *args) -> Any:
+        value = super().pop(*args)
+        self.touch()
+        return value
+
+    def popitem(self) -> tuple[str, Any]:
+        item = super().popitem()
+        self.touch()
+        return item
+
+    def clear(self):
+        super().clear()
+        self.touch()
 
 
 class EntityState:
-    variables: dict[str, Any]
+    __slots__ = ("state", "step", "variables")
+
+    variables: Variables
     state: str
     step: int
 
     def __init__(self, state: str, variables: dict[str, Any] | None = None):
         self.state = state
         self.step = 0
-        self.variables = variables if variables is not None else {}
+        self.variables = Variables(variables if variables is not None else {})
 
     def __str__(self):
         return f"EntityState(state={self.state}, step={self.step}, variables={self.variables})"
@@ -28,232 +128,1134 @@ class EntityState:
 
 
 class EntityID(tuple[str, str]):
+    """
+    A (type, name) pair. Equality and hashing are the plain tuple ones.
+    """
+
+    __slots__ = ()
+
     def get_file(self) -> str:
         return f"story/{self[0]}/{self[1]}.json"
 
     def __new__(cls, tup: tuple[str, str]):
         return super(EntityID, cls).__new__(cls, tup)
 
-    def __eq__(self, other):
-        if not isinstance(other, EntityID):
-            return False
-        return self[0] == other[0] and self[1] == other[1]
+    def __str__(self):
+        return f"{self[0]}:{self[1]}"
+
+    def __repr__(self):
+        return self.__str__()
+
+class Directive:
+    """
+    What a scene handler wants done to the entity stack once it returns.
+
+    The scheduler in main.py applies it and dispatches whatever ends up on
+    top, so handlers never recurse into each other.
+    """
+
+    PUSH = "push"
+    POP = "pop"
+    REPLACE = "replace"
+    STAY = "stay"
+
+    def __init__(self, action: str, entity: EntityID | None = None):
+        self.action = action
+        self.entity = entity
+
+    @classmethod
+    def push(cls, entity: EntityID):
+        return cls(cls.PUSH, entity)
+
+    @classmethod
+    def pop(cls):
+        return cls(cls.POP)
+
+    @classmethod
+    def replace(cls, entity: EntityID):
+        return cls(cls.REPLACE, entity)
 
-    def __hash__(self):
-        return hash((self[0], self[1]))
+    @classmethod
+    def stay(cls):
+        """Redraw whatever is on top of the stack now."""
+        return cls(cls.STAY)
 
     def __str__(self):
-        return f"{self[0]}:{self[1]}"
+        return f"Directive(action={self.action}, entity={self.entity})"
 
     def __repr__(self):
         return self.__str__()
 
-def list_vikings():
-    save_files = [
-        f for f in listdir(SAVEGAME_FOLDER) if isfile(join(SAVEGAME_FOLDER, f))
-    ]
 
-    vikings_list = []
+def apply_directive(session: "GameSession", directive: Directive):
+    entity_stack = session.entity_stack
+    match directive.action:
+        case Directive.PUSH:
+            entity_stack.append(directive.entity)  # type: ignore
+        case Directive.POP:
+            entity_stack.pop()
+        case Directive.REPLACE:
+            entity_stack[-1] = directive.entity  # type: ignore
+        case Directive.STAY:
+            pass
+        case _:
+            raise Exception(f"Unknown directive: {directive}")
 
-    for save_file in save_files:
-        state = get_player_state(SAVEGAME_FOLDER + "/" + save_file)
-        name = state["name"]
-        fullname = state["fullname"]
-        vikings_list.append((name, fullname, save_file))
 
-    return vikings_list
+def _read_viking_index() -> dict[str, dict[str, Any]]:
+    try:
+        with open(join(SAVEGAME_FOLDER, SAVEGAME_INDEX), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
 
 
-def get_entity_data(entity: EntityID):
-    file = entity.get_file()
-    if entity[0] == "connection":
-        file = EntityID(("location", "connections")).get_file()
-    with open(file, "r") as f:
-        if entity[0] == "connection":
-            return json.load(f)[entity[1]]
+def _write_viking_index(index: dict[str, dict[str, Any]]):
+    write_json_atomic(join(SAVEGAME_FOLDER, SAVEGAME_INDEX), index)
 
-        return json.load(f)
 
+def write_json_atomic(filename: str, obj: Any):
+    """
+    Writes obj next to filename and renames it into place, so a crash
+    mid-write leaves the old file intact instead of a truncated one.
+    """
+    temp_file = filename + ".tmp"
+    with open(temp_file, "w") as f:
+        json.dump(obj, f)
+    replace(temp_file, filename)
 
-def get_player_data():
-    with open("story/player.json", "r") as f:
-        return json.load(f)
 
+def _index_entry(save_file: str, obj: dict[str, Any]) -> dict[str, Any]:
+    st = stat(join(SAVEGAME_FOLDER, save_file))
+    return {
+        "name": obj["name"],
+        "fullname": obj["fullname"],
+        # Saves from before last_played was kept were last played when
+        # they were last written
+        "last_played": obj.get("last_played", st.st_mtime),
+        "size": st.st_size,
+        "mtime": st.st_mtime_ns,
+    }
 
-def get_player_state(filename=None):
-    if filename == None:
-        filename = viking_file
 
-    if filename == None:
-        raise Exception("No file to open!")
+def load_viking_index() -> dict[str, dict[str, Any]]:
+    """
+    Returns the savegame index, keyed by save file name.
 
-    with open(filename, "r") as f:  # type: ignore
-        return json.load(f)
+    Only saves that are missing from the index, or whose mtime or size no
+    longer match it, are parsed. The index is rewritten if anything changed.
+    """
+    # Held throughout: the warm-up thread may be scanning too, and the
+    # autosave worker rewrites the index
+    with savegame_lock:
+        return _load_viking_index()
 
 
-def set_player_file(filename):
-    global viking_file
-    viking_file = SAVEGAME_FOLDER + "/" + filename
+def _load_viking_index() -> dict[str, dict[str, Any]]:
+    index = _read_viking_index()
+    fresh: dict[str, dict[str, Any]] = {}
+    changed = False
 
+    for entry in scandir(SAVEGAME_FOLDER):
+        if not entry.is_file() or not entry.name.endswith(".json"):
+            continue
 
-def set_player_state(obj):
-    with open(viking_file, "w") as f:
-        return json.dump(obj, f)
+        st = entry.stat()
+        known = index.get(entry.name)
+        if (
+            known is not None
+            and known["mtime"] == st.st_mtime_ns
+            and known["size"] == st.st_size
+        ):
+            fresh[entry.name] = known
+            continue
+
+        fresh[entry.name] = _index_entry(entry.name, read_player_state(entry.path))
+        changed = True
+
+    if changed or len(fresh) != len(index):
+        _write_viking_index(fresh)
 
+    return fresh
 
-def load_entity(entity: EntityID):
-    global entity_states, quest_triggers, character_locations
-    character_data = get_entity_data(entity)
-    if entity not in entity_states:
-        entity_states[entity] = EntityState("idle", character_data.get("variables", {}))
+
+def list_vikings(
+    offset: int = 0,
+    limit: int | None = None,
+    index: dict[str, dict[str, Any]] | None = None,
+):
+    """
+    Lists (name, fullname, save_file) from the savegame index, most recently
+    played first. Pass index if it was just loaded.
+    """
+    if index is None:
+        index = load_viking_index()
+    save_files = sorted(index, key=lambda f: index[f]["last_played"], reverse=True)
+    if limit is not None:
+        save_files = save_files[offset : offset + limit]
     else:
-        for k, v in character_data.get("variables", {}).items():
-            entity_states[entity].variables.setdefault(k, v)
+        save_files = save_files[offset:]
 
-    if entity[0] == "quest":
-        entity_states[entity].variables.setdefault("status", "idle")
-        quest_triggers[get_entity_data(entity)["start_entity"]] = (
-            quest_triggers.get(get_entity_data(entity)["start_entity"], [])
-        )
+    return [(index[f]["name"], index[f]["fullname"], f) for f in save_files]
+
+
+class EntityCache:
+    """
+    Process-wide cache of story entities.
+
+    Entities come from the story bundle (see bork) while their source file
+    is unchanged since it was compiled, and are parsed from JSON otherwise.
+    Either way they are kept until the file's mtime changes, or, while a
+    story watcher is running (see mildew), until it reports the file
+    changed. The mtime is checked at most once per RECHECK_INTERVAL, so an
+    edit can take that long to show. Returned data is shared: callers must
+    copy before mutating it.
+    """
+
+    def __init__(self):
+        # key -> (mtime, data, when the mtime was last checked)
+        self.entities: dict[str, tuple[int, Any, float]] = {}
+        self.files: dict[str, tuple[int, Any, float]] = {}
+        self.bundle: bork.Bundle | None = None
+        self.index: StoryIndex | None = None
+        # Bumped whenever cached story data is thrown away
+        self.generation = 0
+        # Set while a watcher reloads every changed story file, so cached
+        # entries are used without checking their mtime
+        self.watched = False
+        self.hits = 0
+        self.misses = 0
+        # Held while the bundle or index is opened, rebuilt or read from,
+        # since the warm-up thread may do the same as the game loop
+        self.lock = threading.RLock()
+
+    def get_bundle(self, base_path="story") -> bork.Bundle:
+        with self.lock:
+            if self.bundle is None:
+                self.bundle = bork.load_bundle(base_path)
+            return self.bundle
+
+    def refresh_bundle(self, base_path="story") -> bork.Bundle:
+        """Recompiles the bundle if the story changed since it was opened."""
+        with self.lock:
+            if self.bundle is not None and (
+                self.bundle.base_path != base_path or not self.bundle.is_current()
+            ):
+                self.bundle.close()
+                self.bundle = None
+            return self.get_bundle(base_path)
+
+    def get_index(self, base_path="story") -> "StoryIndex":
+        """
+        The story's indexes, built once per bundle and shared by every
+        session. While watched, the watcher keeps them current instead.
+        """
+        if self.watched and self.index is not None:
+            return self.index
+        with self.lock:
+            bundle = self.refresh_bundle(base_path)
+            if self.index is None or self.index.bundle is not bundle:
+                self.index = StoryIndex(bundle)
+            return self.index
+
+    def get_file(self, file: str, mtime: int | None = None) -> Any:
+        """
+        The parsed file. Pass mtime if it was just statted, so the cached
+        parse is only used if it is of that version.
+        """
+        cached = self.files.get(file)
+        now = perf_counter()
         if (
-            entity
-            not in quest_triggers[get_entity_data(entity)["start_entity"]]
+            cached is not None
+            and mtime is None
+            and (self.watched or now - cached[2] < RECHECK_INTERVAL)
         ):
-            quest_triggers[get_entity_data(entity)["start_entity"]].append(
-                entity
-            )
+            self.hits += 1
+            return cached[1]
+        if mtime is None:
+            mtime = stat(file).st_mtime_ns
+        if cached is not None and cached[0] == mtime:
+            self.hits += 1
+            self.files[file] = (mtime, cached[1], now)
+            return cached[1]
+
+        self.misses += 1
+        with open(file, "r") as f:
+            data = json.load(f)
+        self.files[file] = (mtime, data, perf_counter())
+        return data
+
+    def get(self, entity: "EntityID") -> Any:
+        key = str(entity)
+        cached = self.entities.get(key)
+        if cached is not None:
+            now = perf_counter()
+            if self.watched or now - cached[2] < RECHECK_INTERVAL:
+                self.hits += 1
+                return cached[1]
+        file = CONNECTIONS_FILE if entity[0] == "connection" else entity.get_file()
+        mtime = stat(file).st_mtime_ns
+        if cached is not None and cached[0] == mtime:
+            self.hits += 1
+            self.entities[key] = (mtime, cached[1], now)
+            return cached[1]
+
+        self.misses += 1
+        with self.lock:
+            data = self.get_bundle().get(key, mtime)
+        if data is None:
+            # Not compiled yet, or edited since: connections.json is parsed
+            # once and indexed by connection id
+            data = self.get_file(file, mtime)
+            if entity[0] == "connection":
+                data = data[entity[1]]
+        self.entities[key] = (mtime, data, perf_counter())
+        return data
+
+    def forget(self, entity: "EntityID"):
+        """Drops one entity, so it is read again on next use."""
+        self.entities.pop(str(entity), None)
+
+    def forget_file(self, file: str):
+        self.files.pop(file, None)
+
+    def invalidate(self):
+        self.entities.clear()
+        self.files.clear()
+        with self.lock:
+            if self.bundle is not None:
+                self.bundle.close()
+                self.bundle = None
+            self.index = None
+        # Cached conditions know which characters a quest had
+        self.generation += 1
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entities": len(self.entities),
+        }
+
+
+def get_entity_data(entity: EntityID):
+    if not mulch.enabled:
+        return entity_cache.get(entity)
+    start = perf_counter()
+    data = entity_cache.get(entity)
+    mulch.record("entity_data", entity[0], perf_counter() - start)
+    return data
+
+
+def get_player_data():
+    return entity_cache.get_file(PLAYER_FILE)
+
+
+def get_player_state(session: "GameSession"):
+    if session.viking_file == None:
+        raise Exception("No file to open!")
+
+    # The current viking's name, fullname and stats are only read once;
+    # after that set_player_state keeps them in sync. The saved entity
+    # states are left out: load_game_state reads those from the file.
+    if session.player_state is None:
+        session.player_state = _player_header(read_player_state(session.viking_file))
+    return session.player_state
 
+
+def read_player_state(filename: str) -> dict[str, Any]:
+    with open(filename, "r") as f:
+        return json.load(f)
+
+
+def _player_header(obj: dict[str, Any]) -> dict[str, Any]:
+    return {
+        k: v for k, v in obj.items() if k not in ["entity_states", "entity_stack"]
+    }
+
+
+def set_player_file(session: "GameSession", filename):
+    session.viking_file = SAVEGAME_FOLDER + "/" + filename
+    session.player_state = None
+
+
+def set_player_state(session: "GameSession", obj):
+    obj["last_played"] = time()
+    session.player_state = _player_header(obj)
+    write_player_state(session.viking_file, obj)
+
+
+def write_player_state(filename: str, obj: dict[str, Any]):
+    """
+    Atomically writes a savegame and updates its index entry. Safe to call
+    from a worker thread, as long as obj is not shared with the game loop.
+    """
+    with savegame_lock:
+        write_json_atomic(filename, obj)
+
+        save_file = basename(filename)
+        index = _read_viking_index()
+        index[save_file] = _index_entry(save_file, obj)
+        _write_viking_index(index)
+
+
+def _story_variables(entity: EntityID) -> dict[str, Any]:
+    # Shares values with the entity cache: never mutate what this returns
+    variables = dict(get_entity_data(entity).get("variables", {}))
+    if entity[0] == "quest":
+        variables.setdefault("status", "idle")
     if entity[0] == "character":
-        entity_states[entity].variables.setdefault("death_msg", "")
-        character_locations[entity_states[entity].variables["location"]] = (
-            character_locations.get(entity_states[entity].variables["location"], [])
-        )
-        if (
+        variables.setdefault("death_msg", "")
+    return variables
+
+
+def default_variables(entity: EntityID) -> dict[str, Any]:
+    """
+    The variables an entity starts with: its story file's `variables`, plus
+    the ones the engine adds for quests and characters.
+    """
+    return copy.deepcopy(_story_variables(entity))
+
+
+class EntityStates(dict[EntityID, EntityState]):
+    """
+    Entity states, materialized lazily: an entity gets its state from its
+    story defaults the first time it is looked up. `in` and iteration only
+    see entities that have been looked up or loaded from a save.
+
+    on_change is called with an entity whenever its variables change.
+    """
+
+    def __init__(self, on_change: Callable[[EntityID], None] | None = None):
+        super().__init__()
+        self.on_change = on_change
+
+    def __missing__(self, entity: EntityID) -> EntityState:
+        state = EntityState("idle", default_variables(entity))
+        self[entity] = state
+        return state
+
+    def __setitem__(self, entity: EntityID, state: EntityState):
+        super().__setitem__(entity, state)
+        state.variables.entity = entity
+        state.variables.owner = self
+        state.variables.touch()
+
+
+class QuestBoard:
+    """
+    The quests that can be started from each trigger entity, kept up to
+    date as variables change instead of checked on every menu.
+
+    A quest is startable while its status is idle and its start_condition
+    holds. A trigger's quests are checked the first time it is looked up.
+    From then on each quest watches itself and the entities its
+    start_condition can read; a change to one of those marks it for a
+    recheck, which happens at the next lookup. A start_condition that calls
+    functions or reads anything but story variables can change without
+    them, so its quest is rechecked on every lookup of its trigger.
+    """
+
+    def __init__(self, session: "GameSession"):
+        self.session = session
+        # trigger -> startable quests in quest_triggers order, and each
+        # quest's place there
+        self.available: dict[str, list[EntityID]] = {}
+        self.order: dict[EntityID, int] = {}
+        self.triggers: dict[EntityID, str] = {}
+        # entity -> quests whose availability depends on its variables
+        self.watchers: dict[EntityID, set[EntityID]] = {}
+        # trigger -> quests whose start_condition isn't pure
+        self.volatile: dict[str, list[EntityID]] = {}
+        self.changed: set[EntityID] = set()
+        self.states: EntityStates | None = None
+        self.rechecks = 0
+
+    def invalidate(self):
+        """Rebuild at the next lookup, e.g. after quest_triggers changed."""
+        self.states = None
+
+    def on_change(self, entity: EntityID):
+        if self.states is not None:
+            self.changed.add(entity)
+
+    def reset(self):
+        self.available.clear()
+        self.order.clear()
+        self.triggers.clear()
+        self.watchers.clear()
+        self.volatile.clear()
+        self.changed.clear()
+        self.states = self.session.entity_states
+
+    def build(self, trigger: str):
+        """Checks every quest on trigger once and starts watching them."""
+        self.available[trigger] = []
+        self.volatile[trigger] = []
+        for i, quest in enumerate(self.session.quest_triggers.get(trigger, [])):
+            self.order[quest] = i
+            self.triggers[quest] = trigger
+            condition = get_entity_data(quest)["start_condition"]
+            if not effect_evaluator.compile(condition).pure:
+                self.volatile[trigger].append(quest)
+            for eid in {quest, *effect_evaluator.dependencies(condition, quest)}:
+                self.watchers.setdefault(eid, set()).add(quest)
+            # In order, so each one that holds goes on the end
+            if self.holds(quest, condition):
+                self.available[trigger].append(quest)
+
+    def holds(self, quest: EntityID, condition: str) -> bool:
+        self.rechecks += 1
+        # The board is the cache, so no need for run_condition()'s
+        return self.session.entity_states[quest].variables.get(
+            "status"
+        ) == "idle" and bool(run_effect(self.session, condition, quest))
+
+    def recheck(self, quest: EntityID):
+        available = self.available[self.triggers[quest]]
+        listed = bisect.bisect_left(available, self.order[quest], key=self.order.__getitem__)
+        if self.holds(quest, get_entity_data(quest)["start_condition"]):
+            if listed == len(available) or available[listed] != quest:
+                available.insert(listed, quest)
+        elif listed < len(available) and available[listed] == quest:
+            del available[listed]
+
+    def startable(self, trigger: EntityID) -> list[EntityID]:
+        """Startable quests for trigger, in quest_triggers order."""
+        if self.states is not self.session.entity_states:
+            self.reset()
+        while self.changed:
+            for quest in self.watchers.get(self.changed.pop(), ()):
+                self.recheck(quest)
+
+        key = str(trigger)
+        if key not in self.available:
+            self.build(key)
+            # Materializing the quests it checked is not a change
+            self.changed.clear()
+        else:
+            for quest in self.volatile[key]:
+                self.recheck(quest)
+        return list(self.available[key])
+
+
+class StoryIndex:
+    """
+    Where each quest starts, where each character starts and which
+    connections lead from each location, for one story bundle. Sessions
+    share it, so only refile() changes it once built.
+    """
+
+    def __init__(self, bundle: bork.Bundle):
+        self.bundle = bundle
+        self.quest_triggers: dict[str, list[EntityID]] = {}
+        self.character_locations: dict[str, list[EntityID]] = {}
+        self.travel_paths: dict[EntityID, list[EntityID]] = {}
+        # type -> name -> bork.summarize(), starting from the manifest
+        self.summaries = {
+            entity_type: dict(summaries)
+            for entity_type, summaries in bundle.manifest.items()
+        }
+        # Bumped whenever a connection is refiled, see skullcrusher
+        self.connection_revision = 0
+
+        self.count = 0
+        for entity_type, summaries in self.summaries.items():
+            for entity_name, summary in summaries.items():
+                index_entity(self, EntityID((entity_type, entity_name)), summary)
+                self.count += 1
+
+    def refile(self, entity: EntityID, summary: str | None, exists: bool = True):
+        """
+        Files entity under its new summary, or drops it if it no longer
+        exists. An entity whose summary didn't change keeps its place.
+        """
+        summaries = self.summaries.setdefault(entity[0], {})
+        if entity[1] in summaries:
+            old = summaries[entity[1]]
+            if exists and old == summary:
+                return
+            del summaries[entity[1]]
+            self.count -= 1
+            if entity[0] == "quest":
+                filed = self.quest_triggers.get(old, [])  # type: ignore
+            elif entity[0] == "character":
+                filed = self.character_locations.get(old, [])  # type: ignore
+            elif entity[0] == "connection":
+                filed = self.travel_paths.get(EntityID(("location", old)), [])  # type: ignore
+            else:
+                filed = []
+            if entity in filed:
+                filed.remove(entity)
+
+        if exists:
+            summaries[entity[1]] = summary
+            index_entity(self, entity, summary)
+            self.count += 1
+        if entity[0] == "connection":
+            self.connection_revision += 1
+
+
+def index_entity(
+    index: "StoryIndex | GameSession", entity: EntityID, summary: str | None
+):
+    """
+    Files an entity under quest_triggers, character_locations or
+    travel_paths. summary is what bork.summarize() gives for the entity.
+    """
+    if entity[0] == "quest":
+        triggered = index.quest_triggers.setdefault(summary, [])  # type: ignore
+        if entity not in triggered:
+            triggered.append(entity)
+
+    if entity[0] == "character":
+        located = index.character_locations.setdefault(summary, [])  # type: ignore
+        if entity not in located:
+            located.append(entity)
+
+    if entity[0] == "connection":
+        index.travel_paths.setdefault(EntityID(("location", summary)), []).append(
             entity
-            not in character_locations[entity_states[entity].variables["location"]]
-        ):
-            character_locations[entity_states[entity].variables["location"]].append(
-                entity
-            )
+        )
 
-def load_connections(file: str):
-    with open(file, "r") as f:
-        connections = json.load(f)
-        for id, data in connections.items():
-            entity = EntityID(("connection", id))
-            load_entity(entity)
 
-            travel_paths[EntityID(("location", data["from"]))] = travel_paths.get(EntityID(("location", data["from"])), [])
-            travel_paths[EntityID(("location", data["from"]))].append(entity)
+def move_character(
+    session: "GameSession", character: EntityID, previous: str | None = None
+):
+    """
+    Refiles a character in character_locations under its location variable.
+    Pass the location it was filed under if known, so only that one is
+    searched; a character with no starting location isn't filed anywhere.
+    """
+    location = session.entity_states[character].variables.get("location")
+    if previous is not None:
+        places = [session.character_locations.get(previous, [])]
+    else:
+        places = list(session.character_locations.values())
+    for located in places:
+        if character in located:
+            located.remove(character)
+    located = session.character_locations.setdefault(location, [])  # type: ignore
+    if character not in located:
+        located.append(character)
 
 
-def load_game_state():
+def load_game_state(session: "GameSession"):
     """
-    Replace current entity_states and entity_stack with data parsed from JSON string s.
+    Replace the session's entity_states and entity_stack with the ones in its save file.
+
+    Saves only hold what differs from the story (see save_game_state), so
+    each saved entry is applied over its story defaults. Entities that are
+    not in the save are left to be materialized on first use.
     """
-    global entity_states, entity_stack
-    obj = get_player_state()
-    logger.info(obj)
-    new_states: dict[EntityID, EntityState] = {}
+    obj = read_player_state(session.viking_file)
+    session.player_state = _player_header(obj)
+    logger.info(
+        "Loading %d entity states from %s",
+        len(obj.get("entity_states", [])),
+        session.viking_file,
+    )
+    new_states = EntityStates(session.quest_board.on_change)
     for entry in obj.get("entity_states", []):
         eid = EntityID((entry["type"], entry["name"]))
-        est = EntityState(entry.get("state", "idle"), entry.get("variables", {}))
+        try:
+            variables = default_variables(eid)
+        except (FileNotFoundError, KeyError):
+            # No longer in the story
+            variables = {}
+        variables.update(copy.deepcopy(entry.get("variables", {})))
+        est = EntityState(entry.get("state", "idle"), variables)
         est.step = int(entry.get("step", 0))
         new_states[eid] = est
 
-    entity_states = new_states
-    entity_stack = [
+    session.entity_states = new_states
+    session.entity_stack = [
         EntityID((e["type"], e["name"])) for e in obj.get("entity_stack", [])
     ]
 
 
-def save_game_state():
+def state_delta(entity: EntityID, state: EntityState) -> dict[str, Any] | None:
     """
-    Saves current entity_states and entity_stack into game save file.
+    The savegame entry for an entity, holding only the variables that differ
+    from its story defaults. None if the entity is entirely at its defaults.
     """
-    obj = get_player_state()
+    try:
+        defaults = _story_variables(entity)
+    except (FileNotFoundError, KeyError):
+        # No longer in the story, so there is nothing to diff against
+        defaults = {}
 
-    obj["entity_states"] = [
-        {
-            "type": eid[0],
-            "name": eid[1],
-            "state": est.state,
-            "step": est.step,
-            "variables": est.variables,
-        }
-        for eid, est in entity_states.items()
-    ]
+    variables = {
+        var: value
+        for var, value in state.variables.items()
+        if var not in defaults or defaults[var] != value
+    }
 
-    obj["entity_stack"] = [{"type": e[0], "name": e[1]} for e in entity_stack]
+    if state.state == "idle" and state.step == 0 and not variables:
+        return None
 
-    logger.info(obj)
+    return {
+        "type": entity[0],
+        "name": entity[1],
+        "state": state.state,
+        "step": state.step,
+        "variables": variables,
+    }
 
-    set_player_state(obj)
 
+def delta_states(states: dict[EntityID, EntityState]) -> list[dict[str, Any]]:
+    entries = []
+    for eid, est in states.items():
+        entry = state_delta(eid, est)
+        if entry is not None:
+            entries.append(entry)
+    return entries
 
-def preload_story_entities(base_path="story", report=load_entity):
+
+def snapshot_game_state(session: "GameSession") -> tuple[str, dict[str, Any]]:
     """
-    Preload all entities from story/*/*.json using load_entity().
-    The base_path is relative to the current working directory by default.
+    Captures the save file name and the savegame object for the session's
+    entity_states and entity_stack. Nothing in the snapshot is shared with
+    live state, so it can be written from another thread.
+
+    Only entities and variables that differ from the story defaults are
+    included, so save size follows the player's progress, not the story size.
     """
-    base_dir = Path(base_path)
-    if not base_dir.exists():
-        raise FileNotFoundError(f"Story base path not found: {base_dir}")
+    obj = copy.deepcopy(_player_header(get_player_state(session)))
+
+    obj["save_format"] = SAVE_FORMAT
+    obj["last_played"] = time()
+    obj["entity_states"] = copy.deepcopy(delta_states(session.entity_states))
+    obj["entity_stack"] = [{"type": e[0], "name": e[1]} for e in session.entity_stack]
+
+    return session.viking_file, obj
+
+
+def save_game_state(session: "GameSession"):
+    """
+    Saves the session's entity_states and entity_stack into its save file.
+    """
+    start = perf_counter()
+    filename, obj = snapshot_game_state(session)
+    write_player_state(filename, obj)
+    if mulch.enabled:
+        mulch.record("save", "sync", perf_counter() - start)
+
+    logger.info("Saved %d entity states to %s", len(obj["entity_states"]), filename)
+
+
+def migrate_savegame(filename: str) -> bool:
+    """
+    Rewrites a savegame from the old full-dump format into the delta format.
+    Old saves also load as they are; this just shrinks them ahead of time.
+    Returns whether the save was rewritten.
+    """
+    obj = read_player_state(filename)
+
+    if obj.get("save_format", 1) >= SAVE_FORMAT:
+        return False
+
+    states: dict[EntityID, EntityState] = {}
+    for entry in obj.get("entity_states", []):
+        est = EntityState(entry.get("state", "idle"), entry.get("variables", {}))
+        est.step = int(entry.get("step", 0))
+        states[EntityID((entry["type"], entry["name"]))] = est
+
+    obj["save_format"] = SAVE_FORMAT
+    obj["entity_states"] = delta_states(states)
+    # Rewriting it isn't playing it
+    obj.setdefault("last_played", stat(filename).st_mtime)
 
-    count = 0
-    for type_dir in base_dir.iterdir():
-        if not type_dir.is_dir():
+    write_player_state(filename, obj)
+    return True
+
+
+def migrate_savegames() -> int:
+    """Migrates every save in SAVEGAME_FOLDER. Returns how many were rewritten."""
+    return sum(
+        migrate_savegame(join(SAVEGAME_FOLDER, save_file))
+        for save_file in load_viking_index()
+    )
+
+
+def preload_story_entities(session: "GameSession", base_path="story"):
+    """
+    Gives the session quest_triggers, character_locations and travel_paths
+    for every entity in story/*/*.json. The base_path is relative to the
+    current working directory by default.
+
+    The indexes come from the story bundle's manifest and are shared by all
+    sessions, so no entity is loaded and no state is created here;
+    entity_states fills in as the player gets to things. Only
+    character_locations is the session's own, since characters the player
+    has met may have moved on. The bundle is recompiled first if it is out
+    of date.
+    """
+    index = entity_cache.get_index(base_path)
+
+    session.quest_triggers = index.quest_triggers
+    session.travel_paths = index.travel_paths
+    session.character_locations = {
+        location: list(characters)
+        for location, characters in index.character_locations.items()
+    }
+    session.quest_board.invalidate()
+
+    starts = index.summaries.get("character", {})
+    for entity, state in session.entity_states.items():
+        if entity[0] != "character" or entity[1] not in starts:
             continue
-        for file_path in type_dir.glob("*.json"):
-            entity_type = type_dir.name
-            entity_name = file_path.stem  # filename without .json
-            if entity_type == "location" and entity_name == "connections":
-                load_connections(EntityID((entity_type, entity_name)).get_file())
-            else:
-                report(EntityID((entity_type, entity_name)))
-                count += 1
+        location = state.variables.get("location")
+        if location != starts[entity[1]]:
+            move_character(session, entity, starts[entity[1]])
+
+    logger.info("Indexed %d story entities from '%s'.", index.count, base_path)
+
 
-    logger.info(f"Preloaded {count} story entities from '{base_path}'.")
+def reload_story_file(path: str, base_path="story") -> list[EntityID]:
+    """
+    Brings one changed, added or removed story/<type>/<name>.json into the
+    entity cache, the shared story index and every live session, whose
+    entity_states and entity_stack are kept. Returns the entities in it.
+    """
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        data = None
+    # Read again on next use; while watched, a cached parse is never checked
+    entity_cache.forget_file(path)
 
+    if path == PLAYER_FILE:
+        return []
+
+    index = entity_cache.get_index(base_path)
+    entity_type = basename(dirname(path))
+    name = splitext(basename(path))[0]
+    if entity_type == "location" and name == "connections":
+        found = data or {}
+        known = index.summaries.get("connection", {})
+        datas = {EntityID(("connection", id)): found.get(id) for id in {*known, *found}}
+        entity_type = "connection"
+    else:
+        datas = {EntityID((entity_type, name)): data}
 
-def run_effect(effect: str, entity: EntityID):
-    aeval = asteval.Interpreter()
+    # entity -> (summary before, summary now, whether it still exists)
+    changes: dict[EntityID, tuple[str | None, str | None, bool]] = {}
+    summaries = index.summaries.get(entity_type, {})
+    for entity, entity_data in datas.items():
+        exists = entity_data is not None
+        summary = bork.summarize(entity_type, entity_data) if exists else None
+        changes[entity] = (summaries.get(entity[1]), summary, exists)
+        entity_cache.forget(entity)
+        index.refile(entity, summary, exists)
 
-    # Self entity state
-    for var, value in entity_states[entity].variables.items():
-        aeval.symtable[f"{entity[0]}_{var}"] = value
+    for session in list(sessions):
+        if session.quest_triggers is index.quest_triggers:
+            _reload_in_session(session, changes)
+    return list(changes)
 
-    # Referenced character states
-    for character_name in (
-        get_entity_data(entity).get("characters", {}).keys()
-    ):
-        character_entity = EntityID(("character", character_name))
-        for var, value in entity_states[character_entity].variables.items():
-            aeval.symtable[f"{character_name}_{var}"] = value
 
-    result = aeval(effect)
+def _reload_in_session(
+    session: "GameSession",
+    changes: dict[EntityID, tuple[str | None, str | None, bool]],
+):
+    states = session.entity_states
+    for entity, (old, new, exists) in changes.items():
+        if entity in states:
+            if exists:
+                # Story variables added since the state was made
+                for k, v in default_variables(entity).items():
+                    states[entity].variables.setdefault(k, v)
+        elif entity[0] == "character" and old != new:
+            # Not met yet, so still wherever the story starts them
+            located = session.character_locations.get(old, [])  # type: ignore
+            if entity in located:
+                located.remove(entity)
+            if exists:
+                session.character_locations.setdefault(new, []).append(entity)  # type: ignore
 
-    # Self entity state
-    for var, value in entity_states[entity].variables.items():
-        entity_states[entity].variables[var] = aeval.symtable[f"{entity[0]}_{var}"]
+    # Cached conditions know which characters the entity had
+    stale = [key for key in session.conditions if key[1] in changes]
+    for key in stale:
+        del session.conditions[key]
+    if any(entity[0] == "quest" for entity in changes):
+        session.quest_board.invalidate()
 
-    # Referenced character states
-    for character_name in (
-        get_entity_data(entity).get("characters", {}).keys()
-    ):
-        character_entity = EntityID(("character", character_name))
-        for var, value in entity_states[character_entity].variables.items():
-            entity_states[character_entity].variables[var] = aeval.symtable[
-                f"{character_name}_{var}"
-            ]
 
+# Builtins a condition may call and still be cached
+PURE_FUNCTIONS = {
+    "abs", "all", "any", "bool", "float", "int", "len", "max", "min", "round", "str"
+}
+
+
+class CompiledEffect:
+    """
+    An effect or condition string parsed once into an asteval-ready AST,
+    together with the symbols it reads and writes.
+    """
+
+    def __init__(self, effect: str, node: ast.Module | None):
+        self.effect = effect
+        self.node = node
+        self.names: set[str] = set()
+        self.writes: set[str] = set()
+        # Changes a value in place, e.g. `quest_items.append(x)`
+        self.mutates = False
+        # Reads only its symbols, so the same inputs give the same result
+        self.pure = node is not None
+
+        for sub in ast.walk(node) if node is not None else ():
+            if isinstance(sub, ast.Name):
+                self.names.add(sub.id)
+                if isinstance(sub.ctx, (ast.Store, ast.Del)):
+                    self.writes.add(sub.id)
+            elif isinstance(sub, (ast.Attribute, ast.Subscript)):
+                if isinstance(sub.ctx, (ast.Store, ast.Del)):
+                    self.mutates = True
+            elif isinstance(sub, ast.Call):
+                if not (
+                    isinstance(sub.func, ast.Name) and sub.func.id in PURE_FUNCTIONS
+                ):
+                    self.mutates = True
+                    self.pure = False
+            elif isinstance(sub, (ast.stmt, ast.NamedExpr)) and not isinstance(
+                sub, ast.Expr
+            ):
+                self.pure = False
+
+        if self.writes:
+            self.pure = False
+
+
+class CachedCondition:
+    def __init__(self, deps: list[tuple[EntityID, str]], versions: tuple, result: Any):
+        self.deps = deps
+        self.versions = versions
+        self.result = result
+
+
+class EffectEvaluator:
+    """
+    Evaluates story effects and conditions with pooled asteval interpreters.
+
+    Each distinct string is parsed once. Only the `<entity>_<var>` symbols an
+    expression names are bound into the symtable, and only the ones it
+    assigns are written back into the session's entity_states. Parsed
+    expressions and interpreters are shared by every session.
+    """
+
+    def __init__(self):
+        self.compiled: dict[str, CompiledEffect] = {}
+        self.pool: list["asteval.Interpreter"] = []
+        self.base_symbols: set[str] = set()
+        self.runs = 0
+        self.condition_hits = 0
+        self.condition_misses = 0
+
+    def compile(self, effect: str) -> CompiledEffect:
+        compiled = self.compiled.get(effect)
+        if compiled is None:
+            try:
+                node = ast.fix_missing_locations(ast.parse(effect))
+            except SyntaxError:
+                # Let asteval report it on every run, as it always has
+                node = None
+            compiled = CompiledEffect(effect, node)
+            self.compiled[effect] = compiled
+        return compiled
+
+    def acquire(self) -> "asteval.Interpreter":
+        if self.pool:
+            return self.pool.pop()
+        import asteval
+
+        aeval = asteval.Interpreter()
+        self.base_symbols = set(aeval.symtable)
+        return aeval
+
+    def release(self, aeval: "asteval.Interpreter"):
+        self.pool.append(aeval)
+
+    def bind(self, session: "GameSession", compiled: CompiledEffect, entity: EntityID):
+        """
+        Resolve the names used by an expression to (variables, var) slots.
+        Referenced characters shadow the entity's own variables, matching
+        the order they used to be copied into the symtable.
+        """
+        slots: dict[str, tuple[dict[str, Any], str]] = {}
+        scopes = self.scopes(entity)
+        for name in compiled.names:
+            for prefix, eid in reversed(scopes):
+                variables = session.entity_states[eid].variables
+                var = name[len(prefix) + 1 :]
+                if name.startswith(prefix + "_") and var in variables:
+                    slots[name] = (variables, var)
+                    break
+        return slots
+
+    def scopes(self, entity: EntityID) -> list[tuple[str, EntityID]]:
+        """(symbol prefix, entity) for every entity an expression can read."""
+        scopes = [(entity[0], entity)]
+        for character_name in get_entity_data(entity).get("characters", {}).keys():
+            scopes.append((character_name, EntityID(("character", character_name))))
+        return scopes
+
+    def run(self, session: "GameSession", effect: str, entity: EntityID):
+        compiled = self.compile(effect)
+        slots = self.bind(session, compiled, entity)
+        self.runs += 1
+
+        aeval = self.acquire()
+        symtable = aeval.symtable
+        try:
+            for name, (variables, var) in slots.items():
+                symtable[name] = variables[var]
+
+            result = aeval.eval(compiled.node if compiled.node is not None else effect)
+
+            for name in compiled.writes:
+                if name in slots and name in symtable:
+                    variables, var = slots[name]
+                    previous = variables[var]
+                    variables[var] = symtable[name]
+                    if (
+                        var == "location"
+                        and variables.entity is not None
+                        and variables.entity[0] == "character"
+                        and previous != variables[var]
+                    ):
+                        # Location menus list characters by where they are
+                        move_character(session, variables.entity, previous)
+            if compiled.mutates:
+                for variables, var in slots.values():
+                    variables.touch(var)
+        finally:
+            # Leave the pooled interpreter as clean as a fresh one
+            for name in compiled.names:
+                if name not in self.base_symbols:
+                    symtable.pop(name, None)
+            aeval.code_text.clear()
+            if not compiled.writes & self.base_symbols:
+                self.release(aeval)
+
+        return result
+
+    def dependencies(self, effect: str, entity: EntityID) -> list[EntityID]:
+        """
+        The entities whose variables an expression can read. Any of their
+        variables could be, since one could be added and then read.
+        """
+        names = self.compile(effect).names
+        return [
+            eid
+            for prefix, eid in self.scopes(entity)
+            if any(name.startswith(prefix + "_") for name in names)
+        ]
+
+    def symbols(self, effect: str, entity: EntityID) -> list[tuple[EntityID, str]]:
+        """
+        The (entity, variable) an expression can read for each `<entity>_<var>`
+        symbol it names, whether or not the variable exists yet.
+        """
+        names = self.compile(effect).names
+        return [
+            (eid, name[len(prefix) + 1 :])
+            for prefix, eid in self.scopes(entity)
+            for name in names
+            if name.startswith(prefix + "_")
+        ]
+
+    def run_condition(self, session: "GameSession", condition: str, entity: EntityID):
+        """
+        Like run(), but remembers the result of a condition that only reads
+        its symbols, per session. It is evaluated again only once one of
+        the variables its symbols name has changed.
+        """
+        compiled = self.compile(condition)
+        if not compiled.pure:
+            return self.run(session, condition, entity)
+
+        if session.story_generation != entity_cache.generation:
+            # Cached conditions know which characters a quest had
+            session.conditions.clear()
+            session.story_generation = entity_cache.generation
+
+        states = session.entity_states
+        key = (condition, entity)
+        cached = session.conditions.get(key)
+        if cached is not None:
+            deps = cached.deps
+            versions = tuple(states[eid].variables.version_of(var) for eid, var in deps)
+            if cached.versions == versions:
+                self.condition_hits += 1
+                return cached.result
+        else:
+            deps = self.symbols(condition, entity)
+            versions = tuple(states[eid].variables.version_of(var) for eid, var in deps)
+
+        # Pure, so running it changes none of the versions
+        self.condition_misses += 1
+        result = self.run(session, condition, entity)
+        session.conditions[key] = CachedCondition(deps, versions, result)
+        return result
+
+
+def run_effect(session: "GameSession", effect: str, entity: EntityID):
+    if not mulch.enabled:
+        return effect_evaluator.run(session, effect, entity)
+    start = perf_counter()
+    result = effect_evaluator.run(session, effect, entity)
+    mulch.record("effect", effect, perf_counter() - start)
     return result
 
 
-entity_states: dict[EntityID, EntityState] = {}
-entity_stack: list[EntityID] = []
-quest_triggers: dict[str, list[EntityID]] = {}
-character_locations: dict[str, list[EntityID]] = {}
-travel_paths: dict[EntityID, list[EntityID]] = {}
+def run_condition(session: "GameSession", condition: str, entity: EntityID):
+    if not mulch.enabled:
+        return effect_evaluator.run_condition(session, condition, entity)
+    start = perf_counter()
+    result = effect_evaluator.run_condition(session, condition, entity)
+    mulch.record("condition", condition, perf_counter() - start)
+    return result
+
+
+class GameSession:
+    """
+    One player's game: their save file, entity states and stack, and the
+    indexes built for them. Everything read from the story (entity data,
+    compiled effects, the story index, the connection graph) is shared
+    between sessions, so one process can run many players at once.
+
+    Pass a session to every handler and effect; nothing else in the engine
+    holds game state.
+    """
+
+    def __init__(self, renderer: Any = None):
+        # stoick.TextualRenderer or stoick.HeadlessRenderer
+        self.renderer = renderer
+        self.viking_file: str | None = None
+        self.player_state: dict[str, Any] | None = None
+        # ack's page in the viking select screen
+        self.viking_page = 0
+
+        self.quest_board = QuestBoard(self)
+        self.entity_states = EntityStates(self.quest_board.on_change)
+        self.entity_stack: list[EntityID] = []
+        # Filled in by preload_story_entities. quest_triggers and
+        # travel_paths are the shared story index's: never change them
+        self.quest_triggers: dict[str, list[EntityID]] = {}
+        self.character_locations: dict[str, list[EntityID]] = {}
+        self.travel_paths: dict[EntityID, list[EntityID]] = {}
+
+        # (condition, entity) -> the result and the variables it came from
+        self.conditions: dict[tuple[str, EntityID], CachedCondition] = {}
+        self.story_generation = entity_cache.generation
+
+        sessions.add(self)
+
 
-viking_file: str = None  # type: ignore
+entity_cache = EntityCache()
+effect_evaluator = EffectEvaluator()
+savegame_lock = threading.Lock()
+# Every live session, so story reloads reach them
+sessions: "weakref.WeakSet[GameSession]" = weakref.WeakSet()
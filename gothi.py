@@ -0,0 +1,146 @@
+"""
+Gothi: autosave. She doesn't say much, but she writes everything down.
+
+autosave() can be called as often as you like. A session's requests within
+DEBOUNCE seconds of each other share one snapshot, taken on the game loop.
+The snapshot is serialized and written on a worker thread, so the loop
+never waits on the disk. One worker serves every session.
+"""
+
+import asyncio
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any
+
+import gobber
+import mulch
+from ruffnut import logger
+
+DEBOUNCE = 0.5
+
+
+class Autosaver:
+    def __init__(self, debounce: float = DEBOUNCE):
+        self.debounce = debounce
+        self.snapshots: queue.Queue[tuple[float, str, dict[str, Any]]] = queue.Queue()
+        self.worker: threading.Thread | None = None
+        # Sessions with a save requested but not snapshotted yet
+        self.timers: dict[gobber.GameSession, asyncio.TimerHandle] = {}
+        self.first_requests: dict[gobber.GameSession, float] = {}
+        self.done = threading.Condition()
+        self.pending = 0
+
+        self.requests = 0
+        self.writes = 0
+        self.latencies: deque[float] = deque(maxlen=100)
+        self.snapshot_times: deque[float] = deque(maxlen=100)
+
+    def request(self, session: gobber.GameSession):
+        """Asks for a save of session soon. Bursts of requests are written once."""
+        if not session.viking_file:
+            return
+
+        self.requests += 1
+        self.first_requests.setdefault(session, time.perf_counter())
+        if session in self.timers:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.snapshot(session)
+            return
+        self.timers[session] = loop.call_later(self.debounce, self.snapshot, session)
+
+    def snapshot(self, session: gobber.GameSession):
+        """Captures the session's game state now and hands it to the worker."""
+        timer = self.timers.pop(session, None)
+        if timer is not None:
+            timer.cancel()
+        first_request = self.first_requests.pop(session, None)
+        if first_request is None:
+            return
+
+        start = time.perf_counter()
+        filename, obj = gobber.snapshot_game_state(session)
+        self.snapshot_times.append(time.perf_counter() - start)
+        if mulch.enabled:
+            mulch.record("save", "snapshot", self.snapshot_times[-1])
+        with self.done:
+            self.pending += 1
+        self.snapshots.put((first_request, filename, obj))
+
+        if self.worker is None or not self.worker.is_alive():
+            self.worker = threading.Thread(
+                target=self._write_loop, name="autosave", daemon=True
+            )
+            self.worker.start()
+
+    def _write_loop(self):
+        while True:
+            requested, filename, obj = self.snapshots.get()
+            latest = {filename: (requested, obj)}
+            taken = 1
+
+            # Only the newest snapshot of each save matters
+            while True:
+                try:
+                    requested, filename, obj = self.snapshots.get_nowait()
+                except queue.Empty:
+                    break
+                latest[filename] = (latest.get(filename, (requested,))[0], obj)
+                taken += 1
+
+            for filename, (requested, obj) in latest.items():
+                try:
+                    start = time.perf_counter()
+                    gobber.write_player_state(filename, obj)
+                    if mulch.enabled:
+                        mulch.record("save", "write", time.perf_counter() - start)
+                    self.writes += 1
+                    self.latencies.append(time.perf_counter() - requested)
+                except Exception:
+                    logger.exception("Autosave to %s failed", filename)
+
+            with self.done:
+                self.pending -= taken
+                self.done.notify_all()
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """
+        Writes every pending request now and waits for the worker to finish.
+        Returns False if the timeout ran out first.
+        """
+        for session in list(self.first_requests):
+            self.snapshot(session)
+        with self.done:
+            return self.done.wait_for(lambda: self.pending == 0, timeout)
+
+    def queue_depth(self) -> int:
+        return self.pending + len(self.first_requests)
+
+    def stats(self) -> dict[str, Any]:
+        """Save latency is from the first request of a burst to its write."""
+        return {
+            "requests": self.requests,
+            "writes": self.writes,
+            "queue_depth": self.queue_depth(),
+            "last_latency_ms": self.latencies[-1] * 1e3 if self.latencies else None,
+            "max_latency_ms": max(self.latencies) * 1e3 if self.latencies else None,
+            "max_snapshot_ms": (
+                max(self.snapshot_times) * 1e3 if self.snapshot_times else None
+            ),
+        }
+
+
+def autosave(session: gobber.GameSession):
+    autosaver.request(session)
+
+
+def flush(timeout: float | None = None) -> bool:
+    return autosaver.flush(timeout)
+
+
+autosaver = Autosaver()
@@ -0,0 +1,297 @@
+"""
+Hookfang: the game server. Snotlout's dragon will carry anyone who climbs
+on, and this carries the game to anyone with a TCP connection.
+
+Every connection plays its own gobber.GameSession through the same scene
+handlers as the Textual app, rendered as plain lines of text:
+
+    The square is busy today.
+    ASTRID: You're late.
+      [0] Talk to Astrid
+      [1] Walk to the docks.
+    ? 2
+
+A line starting with "? " asks the player for one line back: "? n" wants a
+number from 0 to n - 1, anything else (like "? name") wants free text.
+Answering "quit" ends the game.
+
+Output goes through a bounded queue per connection. A player who stops
+reading fills it up, which pauses only their game. Anyone who neither
+answers nor reads for IDLE_TIMEOUT seconds is disconnected.
+
+Players aren't told apart: anyone who connects sees every viking in the
+savegame folder and can load, play and overwrite any of them. Only serve
+on localhost or a network whose players are trusted with each other's
+saves.
+
+Run `python hookfang.py [port]` to serve on localhost, and
+`python hookfang.py load [clients] [port]` to point the load generator at a
+running server.
+"""
+
+import asyncio
+import random
+import sys
+import time
+from typing import Any
+
+import gobber
+import gothi
+import main
+import mildew
+import mulch
+import stoick
+from ruffnut import logger
+
+HOST = "127.0.0.1"
+PORT = 4242
+OUTPUT_QUEUE_SIZE = 256  # lines
+IDLE_TIMEOUT = 300.0  # seconds
+
+
+class Disconnected(Exception):
+    """The player left, went idle or stopped reading."""
+
+
+class LineRenderer:
+    """A headless renderer that plays over one connection's lines."""
+
+    headless = True
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        queue_size: int = OUTPUT_QUEUE_SIZE,
+        idle_timeout: float = IDLE_TIMEOUT,
+    ):
+        self.reader = reader
+        self.writer = writer
+        self.output: asyncio.Queue[str | None] = asyncio.Queue(queue_size)
+        self.idle_timeout = idle_timeout
+
+    async def pump(self):
+        """Writes queued lines to the socket until a None comes through."""
+        while True:
+            line = await self.output.get()
+            if line is None:
+                return
+            self.writer.write(line.encode() + b"\n")
+            await self.writer.drain()
+
+    async def _write(self, line: str):
+        try:
+            await asyncio.wait_for(self.output.put(line), self.idle_timeout)
+        except asyncio.TimeoutError:
+            raise Disconnected("stopped reading")
+
+    async def _ask(self, prompt: str) -> str:
+        await self._write(f"? {prompt}")
+        try:
+            line = await mulch.wait(
+                "prompt", asyncio.wait_for(self.reader.readline(), self.idle_timeout)
+            )
+        except asyncio.TimeoutError:
+            raise Disconnected("idle")
+        if not line:
+            raise Disconnected("closed")
+
+        answer = line.decode(errors="replace").strip()
+        if answer == "quit":
+            raise Disconnected("quit")
+        return answer
+
+    async def _choose(self, labels: list[str]) -> int:
+        for idx, label in enumerate(labels):
+            await self._write(f"  [{idx}] {label}")
+        while True:
+            answer = await self._ask(str(len(labels)))
+            if answer.isdigit() and int(answer) < len(labels):
+                return int(answer)
+            await self._write(f"Pick a number from 0 to {len(labels) - 1}.")
+
+    async def send_rider(self, rider: stoick.ScreenRider):
+        choices = rider.choices()
+        return choices[await self._choose(rider.labels())]
+
+    async def send_viking_create(self):
+        name = await self._ask("name")
+        fullname = await self._ask("fullname")
+        return (bool(name), name, fullname or name)
+
+    async def send_story(self, story: str):
+        await self._write(story)
+
+    async def send_dialogue(self, speaker: str, text: str):
+        await self._write(f"{speaker.upper()}: {text}")
+
+    async def send_option(self, options: list[str]) -> int:
+        return await self._choose(options)
+
+    async def clear_screen(self, ask=True):
+        await self._write("")
+
+
+class GameServer:
+    def __init__(
+        self,
+        queue_size: int = OUTPUT_QUEUE_SIZE,
+        idle_timeout: float = IDLE_TIMEOUT,
+    ):
+        self.queue_size = queue_size
+        self.idle_timeout = idle_timeout
+        self.sessions: set[gobber.GameSession] = set()
+        self.connections = 0
+        self.server: asyncio.Server | None = None
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        renderer = LineRenderer(reader, writer, self.queue_size, self.idle_timeout)
+        session = gobber.GameSession(renderer)
+        session.entity_stack = [gobber.EntityID(("init", "start_screen"))]
+        peer = writer.get_extra_info("peername")
+
+        self.connections += 1
+        self.sessions.add(session)
+        pump = asyncio.create_task(renderer.pump())
+        try:
+            # Other players share the loop, so an empty stack just ends this game
+            await main.render_state(session, on_exit=None)
+        except Disconnected as e:
+            logger.info("Player %s disconnected: %s", peer, e)
+        except ConnectionError:
+            logger.info("Player %s dropped", peer)
+        except Exception:
+            logger.exception("Game for %s failed", peer)
+        finally:
+            self.sessions.discard(session)
+            gothi.autosave(session)
+
+            # Let what's already queued go out, unless they aren't reading
+            try:
+                await asyncio.wait_for(renderer.output.put(None), 1)
+                await asyncio.wait_for(pump, self.idle_timeout)
+            except (asyncio.TimeoutError, ConnectionError):
+                pump.cancel()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def start(self, host: str = HOST, port: int = PORT) -> asyncio.Server:
+        """Starts listening. Port 0 picks a free port; see port()."""
+        self.server = await asyncio.start_server(self.handle, host, port)
+        logger.info("Serving on %s:%d", host, self.port())
+        return self.server
+
+    def port(self) -> int:
+        return self.server.sockets[0].getsockname()[1]  # type: ignore
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        gothi.flush()
+
+    def stats(self) -> dict[str, Any]:
+        return {"connections": self.connections, "playing": len(self.sessions)}
+
+
+async def simulated_client(
+    host: str,
+    port: int,
+    answers: int,
+    rng: random.Random,
+    latencies: list[float],
+) -> int:
+    """
+    One player answering random choices. Latency is from sending an answer
+    to the next prompt arriving. Returns how many answers were sent.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    sent = 0
+    sent_at = None
+    try:
+        while sent < answers:
+            line = await reader.readline()
+            if not line:
+                break
+            if not line.startswith(b"? "):
+                continue
+            if sent_at is not None:
+                latencies.append(time.perf_counter() - sent_at)
+
+            prompt = line[2:].strip()
+            if prompt.isdigit():
+                answer = str(rng.randrange(int(prompt)))
+            else:
+                answer = f"Load{rng.randrange(10000)}"
+            sent_at = time.perf_counter()
+            writer.write(answer.encode() + b"\n")
+            await writer.drain()
+            sent += 1
+
+        writer.write(b"quit\n")
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+    return sent
+
+
+async def load_test(
+    clients: int,
+    answers: int = 200,
+    host: str = HOST,
+    port: int = PORT,
+    seed: int = 0,
+) -> dict[str, Any]:
+    """Opens `clients` simulated players at once and reports how they fared."""
+    latencies: list[float] = []
+    start = time.perf_counter()
+    sent = await asyncio.gather(
+        *(
+            simulated_client(host, port, answers, random.Random(seed + i), latencies)
+            for i in range(clients)
+        )
+    )
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+
+    def percentile(pct: float) -> float:
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(len(latencies) * pct / 100))] * 1e3
+
+    return {
+        "clients": clients,
+        "answers": sum(sent),
+        "answers_per_sec": sum(sent) / elapsed,
+        "p50_ms": percentile(50),
+        "p99_ms": percentile(99),
+        "max_ms": latencies[-1] * 1e3 if latencies else 0.0,
+    }
+
+
+async def serve_forever(host: str = HOST, port: int = PORT):
+    server = GameServer()
+    await server.start(host, port)
+    print(f"Serving Berk on {host}:{server.port()}")
+    if mildew.WATCH:
+        mildew.watch()
+    try:
+        await server.server.serve_forever()  # type: ignore
+    finally:
+        await server.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "load":
+        clients = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+        port = int(sys.argv[3]) if len(sys.argv) > 3 else PORT
+        print(asyncio.run(load_test(clients, port=port)))
+    else:
+        port = int(sys.argv[1]) if len(sys.argv) > 1 else PORT
+        asyncio.run(serve_forever(HOST, port))
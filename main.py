@@ -1,36 +1,136 @@
-print("RPG Game Main Module")
-print("Work in progress...")
-print("Except jittery experiences")
+# First, so the startup profile counts every import after it
+import mulch
 
-from typing import NoReturn
+from typing import Any, Awaitable, Callable, NoReturn
 import stoick
 import asyncio
+import functools
+import json
+import sys
+import time
 
 from ruffnut import logger
 from tuffnut import exit_game
 import astrid
 import gobber
+import gothi
 import ack
+import mildew
 
+mulch.mark("imports")
 
-async def render_state() -> NoReturn:
-    global entity_states, entity_stack, quest_triggers
 
-    await asyncio.sleep(0)  # Yield to event loop
-
-    if len(gobber.entity_stack) == 0:
-        await exit_game()
-
-    current_entity = gobber.entity_stack[-1]
+async def draw_scene(
+    session: gobber.GameSession, current_entity: gobber.EntityID
+) -> gobber.Directive:
+    if mulch.enabled:
+        return await _draw_scene_timed(session, current_entity)
 
     if await astrid.handles_this(current_entity):
-        await astrid.draw_this(current_entity)
+        return await astrid.draw_this(session, current_entity)
     elif await ack.handles_this(current_entity):
-        await ack.draw_this(current_entity)
+        return await ack.draw_this(session, current_entity)
 
     raise Exception("Current state not implemented!")
 
 
+async def _draw_scene_timed(
+    session: gobber.GameSession, current_entity: gobber.EntityID
+) -> gobber.Directive:
+    state = session.entity_states.get(current_entity)
+    label = f"{current_entity[0]}:{state.state if state is not None else '-'}"
+
+    for handler in [astrid, ack]:
+        start = time.perf_counter()
+        handles = await handler.handles_this(current_entity)
+        mulch.record("handles", handler.__name__, time.perf_counter() - start)
+        if handles:
+            start = time.perf_counter()
+            directive = await handler.draw_this(session, current_entity)
+            mulch.record("draw", label, time.perf_counter() - start)
+            return directive
+
+    raise Exception("Current state not implemented!")
+
+
+async def render_state(
+    session: gobber.GameSession,
+    max_steps: int | None = None,
+    on_step: Callable[[gobber.Directive], None] | None = None,
+    on_exit: Callable[[gobber.GameSession], Awaitable[Any]] | None = exit_game,
+) -> NoReturn:
+    """
+    Scene scheduler for one session. Draws the entity on top of its stack
+    and applies the directive its handler returns, in a loop, so a long
+    session never builds up coroutine frames. Any number of sessions can
+    run on one event loop.
+
+    max_steps and on_step are for headless runs: the loop returns after
+    max_steps scenes, and on_step sees every applied directive. on_exit
+    runs once the stack is empty; the default exit_game stops the whole
+    event loop, so pass None when other sessions share it.
+    """
+    steps = 0
+    while len(session.entity_stack):
+        if max_steps is not None and steps >= max_steps:
+            return  # type: ignore
+        steps += 1
+
+        await asyncio.sleep(0)  # Yield to event loop
+
+        timed = mulch.enabled
+        if timed:
+            entity = session.entity_stack[-1]
+            start, waited = time.perf_counter(), mulch.waited()
+
+        directive = await draw_scene(session, session.entity_stack[-1])
+        gobber.apply_directive(session, directive)
+        gothi.autosave(session)
+
+        if timed:
+            busy = time.perf_counter() - start - (mulch.waited() - waited)
+            mulch.record("step", entity[0], busy)
+            mulch.count("directive", directive.action)
+        if on_step is not None:
+            on_step(directive)
+
+    if on_exit is not None:
+        await on_exit(session)
+
+
+async def play(session: gobber.GameSession) -> NoReturn:
+    """render_state, reloading story edits as they are saved with BERK_WATCH_STORY."""
+    if mildew.WATCH:
+        mildew.watch()
+    await render_state(session)
+
+
+def new_app(session: gobber.GameSession) -> stoick.TextualRenderer:
+    """The Textual app playing session, which starts at the start screen."""
+    session.entity_stack = [gobber.EntityID(("init", "start_screen"))]
+    renderer = stoick.TextualRenderer(
+        functools.partial(exit_game, session), functools.partial(play, session)
+    )
+    session.renderer = renderer
+    mulch.mark("app")
+    return renderer
+
+
+async def profile_startup(timeout: float = 10.0) -> dict[str, float]:
+    """
+    Starts the app headless and waits for the intro screen, and with
+    FAST_START for the warm-up after it. Returns the milliseconds each
+    startup phase took, in order.
+    """
+    app = new_app(gobber.GameSession())
+    last_phase = "warm" if stoick.FAST_START else "intro"
+    async with app.run_test(headless=True) as pilot:
+        deadline = time.perf_counter() + timeout
+        while last_phase not in mulch.startup and time.perf_counter() < deadline:
+            await pilot.pause(0.001)
+    return mulch.startup_phases()
+
+
 # def print(*args, **kwargs):
 #     raise Exception("Non-rendering systems must use interfaced I/O methods")
 
@@ -38,9 +138,19 @@ async def render_state() -> NoReturn:
 def input(*args, **kwargs):
     raise Exception("Non-rendering systems must use interfaced I/O methods")
 
-gobber.entity_stack = [gobber.EntityID(("init", "start_screen"))]
-astrid.render_state = render_state
-ack.render_state = render_state
+if __name__ == "__main__":
+    if "--profile-startup" in sys.argv:
+        # Time to the intro screen by phase, as one line of JSON
+        print(json.dumps(asyncio.run(profile_startup())))
+        sys.exit()
+    if "--migrate-saves" in sys.argv:
+        # Shrink old full-dump saves into the delta format ahead of time
+        print(f"Migrated {gobber.migrate_savegames()} savegames")
+        sys.exit()
+
+    print("RPG Game Main Module")
+    print("Work in progress...")
+    print("Except jittery experiences")
 
-stoick.renderer = stoick.TextualRenderer(exit_game, render_state)
-stoick.renderer.run()
+    stoick.renderer = new_app(gobber.GameSession())
+    stoick.renderer.run()
@@ -0,0 +1,215 @@
+"""
+Mildew: the story watcher. Nothing changes on Berk without Mildew noticing,
+and this notices every edit to story/ while the game is running.
+
+Changed, added and removed story files are reloaded one by one through
+gobber.reload_story_file(), so the shared index, the entity cache and every
+live session pick them up without a restart or a full re-index. While it
+runs, the entity cache stops checking mtimes on every read.
+
+Where libc has inotify (Linux) the watcher sleeps until something changes.
+Anywhere else it polls every POLL_INTERVAL seconds. Set BERK_WATCH_STORY=1
+to watch while playing.
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+import gobber
+from ruffnut import logger
+
+WATCH = os.environ.get("BERK_WATCH_STORY", "0") != "0"
+POLL_INTERVAL = 0.5  # seconds
+# An editor's save often comes as several events; wait this long for the rest
+SETTLE = 0.05  # seconds
+
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_ISDIR = 0x40000000
+_IN_MASK = (
+    _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+)
+# wd, mask, cookie, name length
+_EVENT = struct.Struct("iIII")
+
+
+def _libc_inotify() -> ctypes.CDLL | None:
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, TypeError, AttributeError):
+        return None
+    return libc
+
+
+class StoryWatcher:
+    def __init__(
+        self,
+        base_path: str = "story",
+        interval: float = POLL_INTERVAL,
+        use_inotify: bool = True,
+    ):
+        self.base_path = base_path
+        self.interval = interval
+        self.libc = _libc_inotify() if use_inotify else None
+        self.fd: int | None = None
+        # watch descriptor -> the directory it watches
+        self.dirs: dict[int, str] = {}
+        # path -> mtime, for polling
+        self.mtimes: dict[str, int] = {}
+        self.closed = False
+        # While run() has a thread waiting on fd, close() leaves fd to it
+        self.running = False
+
+        self.reloads = 0
+        self.last_reload_ms: float | None = None
+
+    def _watch_dir(self, path: str):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), _IN_MASK)  # type: ignore
+        if wd >= 0:
+            self.dirs[wd] = path
+
+    def _scan(self) -> dict[str, int]:
+        mtimes = {}
+        with os.scandir(self.base_path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    with os.scandir(entry.path) as files:
+                        for file in files:
+                            if file.name.endswith(".json"):
+                                mtimes[f"{entry.path}/{file.name}"] = file.stat().st_mtime_ns
+                elif entry.name.endswith(".json"):
+                    mtimes[entry.path] = entry.stat().st_mtime_ns
+        return mtimes
+
+    def start(self):
+        if self.libc is not None:
+            fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd >= 0:
+                self.fd = fd
+                self._watch_dir(self.base_path)
+                for entry in os.scandir(self.base_path):
+                    if entry.is_dir():
+                        self._watch_dir(entry.path)
+        if self.fd is None:
+            self.mtimes = self._scan()
+        gobber.entity_cache.watched = True
+        logger.info(
+            "Watching '%s' for story edits (%s)",
+            self.base_path,
+            "inotify" if self.fd is not None else f"polling every {self.interval}s",
+        )
+
+    def _read_events(self) -> set[str]:
+        changed = set()
+        try:
+            buffer = os.read(self.fd, 65536)  # type: ignore
+        except BlockingIOError:
+            return changed
+
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = _EVENT.unpack_from(buffer, offset)
+            offset += _EVENT.size
+            name = buffer[offset : offset + length].rstrip(b"\0").decode()
+            offset += length
+
+            directory = self.dirs.get(wd)
+            if directory is None or not name:
+                continue
+            path = f"{directory}/{name}"
+            if mask & _IN_ISDIR:
+                if mask & (_IN_CREATE | _IN_MOVED_TO):
+                    # A new entity type; its files arrive as their own events
+                    self._watch_dir(path)
+                    changed.update(
+                        f"{path}/{file}" for file in os.listdir(path) if file.endswith(".json")
+                    )
+            elif name.endswith(".json"):
+                changed.add(path)
+        return changed
+
+    def changes(self, timeout: float) -> set[str]:
+        """
+        Waits up to timeout seconds for story files to change and returns
+        their paths, or an empty set.
+        """
+        if self.fd is None:
+            time.sleep(timeout)
+            mtimes = self._scan()
+            changed = {
+                path
+                for path in self.mtimes.keys() | mtimes.keys()
+                if self.mtimes.get(path) != mtimes.get(path)
+            }
+            self.mtimes = mtimes
+            return changed
+
+        changed: set[str] = set()
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        while readable:
+            changed |= self._read_events()
+            readable, _, _ = select.select([self.fd], [], [], SETTLE)
+        return changed
+
+    def apply(self, paths: set[str]) -> list[gobber.EntityID]:
+        """Reloads paths on the game's thread. Returns the entities reloaded."""
+        start = time.perf_counter()
+        entities = []
+        for path in sorted(paths):
+            try:
+                entities += gobber.reload_story_file(path, self.base_path)
+            except Exception:
+                # Most likely saved halfway; the next save brings it back
+                logger.exception("Can't reload %s", path)
+        self.reloads += 1
+        self.last_reload_ms = (time.perf_counter() - start) * 1e3
+        logger.info(
+            "Reloaded %d story files (%d entities) in %.1f ms",
+            len(paths),
+            len(entities),
+            self.last_reload_ms,
+        )
+        return entities
+
+    async def run(self):
+        self.start()
+        self.running = True
+        try:
+            while not self.closed:
+                paths = await asyncio.to_thread(self.changes, self.interval)
+                if paths and not self.closed:
+                    self.apply(paths)
+        finally:
+            self.running = False
+            self.close()
+
+    def close(self):
+        """Stops watching; a running run() returns within interval seconds."""
+        self.closed = True
+        gobber.entity_cache.watched = False
+        if self.fd is not None and not self.running:
+            os.close(self.fd)
+            self.fd = None
+
+
+def watch(base_path: str = "story") -> StoryWatcher:
+    """Starts watching base_path on the running event loop, once."""
+    global watcher, watch_task
+    if watcher is None or watcher.closed:
+        watcher = StoryWatcher(base_path)
+        watch_task = asyncio.get_running_loop().create_task(watcher.run())
+    return watcher
+
+
+watcher: StoryWatcher | None = None
+watch_task: asyncio.Task | None = None
@@ -0,0 +1,212 @@
+"""
+Mulch: instrumentation. Mulch counts every fish that comes off the boats,
+and this counts where the time goes between one frame and the next.
+
+It is off unless BERK_INSTRUMENT is set or enable() is called. Every call
+site checks `mulch.enabled` before reading the clock, so switched off it
+costs one attribute lookup per site.
+
+Timings are kept per (kind, label) in histograms with power-of-two
+microsecond buckets:
+
+    step         entity type         one render_state scene, minus waits
+    handles      handler module      handles_this checks
+    draw         entity type:state   draw_this, waits included
+    wait         what was asked      waiting on the player
+    effect       expression          run_effect
+    condition    expression          run_condition
+    entity_data  entity type         get_entity_data
+    mount        last widget class   mounting a batch in Astrid.mission
+    save         sync/snapshot/write saves and autosaves
+
+Startup is profiled whether or not the rest is on: mark() records how long
+after this module was imported each phase was first reached. main imports
+it before anything else, so the first phase counts every other import.
+
+On exit everything is written to BERK_INSTRUMENT if it names a .json file,
+or to logs/instrument_<time>.json otherwise, and the labels that took the
+most time are summarized in the log.
+"""
+
+import atexit
+import json
+import os
+from contextvars import ContextVar
+from datetime import datetime
+from time import perf_counter
+from typing import Any, Awaitable, TypeVar
+
+from ruffnut import LOG_DIR, logger
+
+STARTED = perf_counter()
+
+enabled = bool(os.environ.get("BERK_INSTRUMENT"))
+
+T = TypeVar("T")
+
+
+class Histogram:
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        # buckets[b] counts samples under 2**b microseconds, and at least
+        # 2**(b - 1) of them
+        self.buckets: list[int] = []
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+        bucket = int(seconds * 1e6).bit_length()
+        if bucket >= len(self.buckets):
+            self.buckets.extend([0] * (bucket + 1 - len(self.buckets)))
+        self.buckets[bucket] += 1
+
+    def percentile(self, pct: float) -> float:
+        """An upper bound on the pct-th percentile, in seconds."""
+        rank = self.count * pct / 100
+        seen = 0
+        for bucket, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(self.max, (1 << bucket) / 1e6)
+        return self.max
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "total_ms": self.total * 1e3,
+            "mean_us": self.total / self.count * 1e6 if self.count else 0.0,
+            "p50_us": self.percentile(50) * 1e6,
+            "p99_us": self.percentile(99) * 1e6,
+            "max_us": self.max * 1e6,
+            "buckets_us": {
+                str(1 << bucket): n for bucket, n in enumerate(self.buckets) if n
+            },
+        }
+
+
+# (kind, label) -> samples
+timings: dict[tuple[str, str], Histogram] = {}
+counters: dict[tuple[str, str], int] = {}
+
+# phase -> seconds after STARTED, in the order reached
+startup: dict[str, float] = {}
+
+# Seconds spent waiting on the player in the current task, so each game's
+# steps can leave out its own waits
+_waited: ContextVar[float] = ContextVar("waited", default=0.0)
+
+
+def record(kind: str, label: str, seconds: float):
+    histogram = timings.get((kind, label))
+    if histogram is None:
+        histogram = timings[(kind, label)] = Histogram()
+    histogram.add(seconds)
+
+
+def count(kind: str, label: str, n: int = 1):
+    counters[(kind, label)] = counters.get((kind, label), 0) + n
+
+
+def record_wait(label: str, seconds: float):
+    record("wait", label, seconds)
+    _waited.set(_waited.get() + seconds)
+
+
+async def wait(label: str, awaitable: Awaitable[T]) -> T:
+    """Awaits something the player has to do, recording how long it took."""
+    if not enabled:
+        return await awaitable
+    start = perf_counter()
+    try:
+        return await awaitable
+    finally:
+        record_wait(label, perf_counter() - start)
+
+
+def waited() -> float:
+    """Total seconds this task has waited on the player so far."""
+    return _waited.get()
+
+
+def mark(phase: str):
+    """Records that startup reached phase, the first time it does."""
+    if phase not in startup:
+        startup[phase] = perf_counter() - STARTED
+
+
+def startup_phases() -> dict[str, float]:
+    """Milliseconds spent in each startup phase, since the one before it."""
+    phases = {}
+    last = 0.0
+    for phase, at in startup.items():
+        phases[phase] = (at - last) * 1e3
+        last = at
+    return phases
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    timings.clear()
+    counters.clear()
+
+
+def export() -> dict[str, Any]:
+    """kind -> label -> histogram, kind -> label -> count, and startup phases."""
+    result: dict[str, Any] = {
+        "timings": {},
+        "counters": {},
+        "startup_ms": startup_phases(),
+    }
+    for (kind, label), histogram in sorted(timings.items()):
+        result["timings"].setdefault(kind, {})[label] = histogram.to_dict()
+    for (kind, label), n in sorted(counters.items()):
+        result["counters"].setdefault(kind, {})[label] = n
+    return result
+
+
+def write(filename: str | None = None) -> str:
+    if filename is None:
+        filename = f"{LOG_DIR}/instrument_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(filename, "w") as f:
+        json.dump(export(), f, indent=2)
+    return filename
+
+
+def summary(top: int = 10) -> str:
+    """The labels with the most total time, one line each."""
+    lines = []
+    ranked = sorted(timings.items(), key=lambda item: item[1].total, reverse=True)
+    for (kind, label), histogram in ranked[:top]:
+        lines.append(
+            f"{kind:<12} {label[:40]:<40} n={histogram.count} "
+            f"total_ms={histogram.total * 1e3:.1f} "
+            f"p99_us={histogram.percentile(99) * 1e6:.0f}"
+        )
+    return "\n".join(lines)
+
+
+def _write_on_exit():
+    if not timings and not counters:
+        return
+    target = os.environ.get("BERK_INSTRUMENT", "")
+    filename = write(target if target.endswith(".json") else None)
+    logger.info("Instrumentation written to %s\n%s", filename, summary())
+
+
+atexit.register(_write_on_exit)
@@ -1,14 +1,146 @@
+"""
+Ruffnut: logging. She takes notes on everything that happens in the village,
+but writes them up later so nobody has to wait for her.
+
+Logging a record only puts it on a queue. A listener thread formats it and
+writes it to logs/, rotating the file once it reaches LOG_MAX_BYTES. Use
+%-style arguments (`logger.info("Saved %d states", n)`) so the formatting
+happens on that thread, or not at all when the level is off.
+
+Bulk payloads, like whole menus and probes, go to payload_logger. It is off
+unless BERK_LOG_PAYLOADS is set to the fraction of them worth keeping.
+
+Environment:
+    BERK_LOG_LEVEL     INFO by default
+    BERK_LOG_JSON      1 to write one JSON object per line
+    BERK_LOG_MAX_MB    rotate after this many megabytes, 10 by default
+    BERK_LOG_PAYLOADS  fraction of payload records kept, 0 by default
+"""
+
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import random
 from datetime import datetime
+from typing import Any
+
+LOG_DIR = "logs"
+LOG_LEVEL = os.environ.get("BERK_LOG_LEVEL", "INFO").upper()
+JSON_LINES = os.environ.get("BERK_LOG_JSON", "0") not in ("", "0")
+LOG_MAX_BYTES = int(float(os.environ.get("BERK_LOG_MAX_MB", "10")) * 1024 * 1024)
+LOG_BACKUPS = 3
+PAYLOAD_SAMPLE = float(os.environ.get("BERK_LOG_PAYLOADS", "0"))
+
+LOG_FORMAT = "[%(asctime)s] %(levelname)s: %(message)s"
+LOG_DATEFMT = "%H:%M:%S"
+
+# Arguments of these types can't change before the listener formats them
+_IMMUTABLE = (str, int, float, bool, bytes, type(None))
+
+# Everything a bare LogRecord has; the rest came in through `extra`
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+def _immutable(args: tuple) -> bool:
+    return all(
+        isinstance(arg, _IMMUTABLE) or (isinstance(arg, tuple) and _immutable(arg))
+        for arg in args
+    )
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records unformatted. Only records whose message or arguments
+    could change before the listener gets to them, like a list of options,
+    are formatted here first.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if not isinstance(record.msg, str) or (
+            record.args
+            and not (isinstance(record.args, tuple) and _immutable(record.args))
+        ):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
 
-log_file = f"logs/game_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
 
-logging.basicConfig(
-    filename=log_file,
-    filemode="w",
-    level=logging.INFO,
-    format="[%(asctime)s] %(levelname)s: %(message)s",
-    datefmt="%H:%M:%S",
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with any `extra` fields alongside."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: dict[str, Any] = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SampleFilter(logging.Filter):
+    """Keeps about `rate` of the records it sees."""
+
+    def __init__(self, rate: float, rng: random.Random | None = None):
+        super().__init__()
+        self.rate = rate
+        self.rng = rng or random.Random()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return self.rng.random() < self.rate
+
+
+def file_handler(filename: str, json_lines: bool = JSON_LINES) -> logging.Handler:
+    handler = logging.handlers.RotatingFileHandler(
+        filename,
+        maxBytes=LOG_MAX_BYTES,
+        backupCount=LOG_BACKUPS,
+        encoding="utf-8",
+        delay=True,
+    )
+    if json_lines:
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATEFMT))
+    return handler
+
+
+def set_payload_sample(rate: float):
+    """Keep `rate` of payload records: 0 turns them off, 1 keeps them all."""
+    for f in list(payload_logger.filters):
+        payload_logger.removeFilter(f)
+    if rate <= 0:
+        # Above every level, so isEnabledFor() is a cached False
+        payload_logger.setLevel(logging.CRITICAL + 1)
+        return
+    payload_logger.setLevel(logging.NOTSET)
+    if rate < 1:
+        payload_logger.addFilter(SampleFilter(rate))
+
+
+os.makedirs(LOG_DIR, exist_ok=True)
+log_file = (
+    f"{LOG_DIR}/game_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    f".{'jsonl' if JSON_LINES else 'log'}"
+)
+
+log_queue: queue.SimpleQueue = queue.SimpleQueue()
+listener = logging.handlers.QueueListener(
+    log_queue, file_handler(log_file), respect_handler_level=True
 )
+logging.basicConfig(level=LOG_LEVEL, handlers=[LazyQueueHandler(log_queue)])
+listener.start()
+# Stopping drains whatever is still queued
+atexit.register(listener.stop)
 
-logger = logging.getLogger("GameLogger")
\ No newline at end of file
+logger = logging.getLogger("GameLogger")
+payload_logger = logging.getLogger("GameLogger.payload")
+set_payload_sample(PAYLOAD_SAMPLE)
@@ -0,0 +1,151 @@
+"""
+Skullcrusher: the connection graph. Stoick's Rumblehorn can track anyone
+anywhere on the island, and this knows every way from one place to another.
+
+The graph is built once per story index from every connection, and again
+whenever a connection is reloaded. It is kept in compressed sparse rows:
+the connections leaving location i are edges offsets[i] to
+offsets[i + 1] - 1, each with its endpoints, connection id and action text
+stored alongside. Routes come from breadth-first search
+trees, cached per starting location, so a repeated route query only walks
+the path itself.
+"""
+
+import os
+from array import array
+from collections import OrderedDict, deque
+
+import gobber
+
+ROUTE_CACHE_SIZE = 64
+
+
+class ConnectionGraph:
+    def __init__(self, connections: list[tuple[str, str, str, str]]):
+        """connections holds (id, from, to, action) for every connection."""
+        self.locations: list[str] = []
+        self.index: dict[str, int] = {}
+        for _, src, dst, _ in connections:
+            for location in (src, dst):
+                if location not in self.index:
+                    self.index[location] = len(self.locations)
+                    self.locations.append(location)
+
+        connections = sorted(connections, key=lambda c: self.index[c[1]])
+        self.offsets = array("i", [0] * (len(self.locations) + 1))
+        for _, src, _, _ in connections:
+            self.offsets[self.index[src] + 1] += 1
+        for i in range(len(self.locations)):
+            self.offsets[i + 1] += self.offsets[i]
+
+        self.sources = array("i", (self.index[c[1]] for c in connections))
+        self.targets = array("i", (self.index[c[2]] for c in connections))
+        self.connection_ids: list[str] = [c[0] for c in connections]
+        self.actions: list[str] = [c[3] for c in connections]
+
+        # start location index -> edge index used to reach each location
+        self.trees: OrderedDict[int, array] = OrderedDict()
+
+    def edges(self, location: str) -> list[tuple[str, str, str]]:
+        """(connection id, destination, action) for each way out of location."""
+        i = self.index.get(location)
+        if i is None:
+            return []
+        return [
+            (self.connection_ids[e], self.locations[self.targets[e]], self.actions[e])
+            for e in range(self.offsets[i], self.offsets[i + 1])
+        ]
+
+    def _tree(self, start: int) -> array:
+        tree = self.trees.get(start)
+        if tree is not None:
+            self.trees.move_to_end(start)
+            return tree
+
+        tree = array("i", [-1] * len(self.locations))
+        seen = bytearray(len(self.locations))
+        seen[start] = 1
+        queue = deque([start])
+        offsets, targets = self.offsets, self.targets
+        while queue:
+            here = queue.popleft()
+            for e in range(offsets[here], offsets[here + 1]):
+                there = targets[e]
+                if not seen[there]:
+                    seen[there] = 1
+                    tree[there] = e
+                    queue.append(there)
+
+        self.trees[start] = tree
+        if len(self.trees) > ROUTE_CACHE_SIZE:
+            self.trees.popitem(last=False)
+        return tree
+
+    def route(self, src: str, dst: str) -> list[str] | None:
+        """
+        Connection ids along a shortest route from src to dst, [] if they
+        are the same place, or None if dst can't be reached.
+        """
+        if src not in self.index or dst not in self.index:
+            return None
+        start, here = self.index[src], self.index[dst]
+        if start == here:
+            return []
+
+        tree = self._tree(start)
+        path = []
+        while here != start:
+            e = tree[here]
+            if e < 0:
+                return None
+            path.append(self.connection_ids[e])
+            here = self.sources[e]
+        path.reverse()
+        return path
+
+    def reachable(self, src: str) -> set[str]:
+        if src not in self.index:
+            return set()
+        start = self.index[src]
+        tree = self._tree(start)
+        return {self.locations[i] for i, e in enumerate(tree) if e >= 0 or i == start}
+
+
+def build_graph(index: gobber.StoryIndex) -> ConnectionGraph:
+    # Every connection shares one source file, so one stat covers them all
+    mtime = os.stat(gobber.CONNECTIONS_FILE).st_mtime_ns
+    bundle = index.bundle
+
+    connections = []
+    for id in index.summaries.get("connection", {}):
+        data = bundle.get(f"connection:{id}", mtime)
+        if data is None:
+            data = gobber.get_entity_data(gobber.EntityID(("connection", id)))
+        connections.append((id, data["from"], data["to"], data["action"]))
+    return ConnectionGraph(connections)
+
+
+def get_graph() -> ConnectionGraph:
+    """The graph for the current story index, built on first use."""
+    global graph, graph_version
+
+    index = gobber.entity_cache.index or gobber.entity_cache.get_index()
+    version = (index, index.connection_revision)
+    if graph is None or graph_version != version:
+        graph = build_graph(index)
+        graph_version = version
+    return graph
+
+
+def known_locations(session: gobber.GameSession) -> list[str]:
+    """Locations the player has been to, which are the ones with a state."""
+    return [
+        entity[1]
+        for entity, state in session.entity_states.items()
+        if entity[0] == "location" and state.state != "idle"
+    ]
+
+
+graph: ConnectionGraph | None = None
+# The index and connection revision the graph was built from
+graph_version: tuple[gobber.StoryIndex, int] | None = None
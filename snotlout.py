@@ -0,0 +1,1240 @@
+"""
+Snotlout: benchmarks. He will tell you how fast everything is, loudly.
+
+Run all benchmarks with `python snotlout.py`, or pick some by name with
+`python snotlout.py run_effect ...`.
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import logging.handlers
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Iterator
+
+import asteval
+
+import astrid
+import bork
+import eret
+import gobber
+import gothi
+import hookfang
+import skullcrusher
+import main
+import mildew
+import mulch
+import ruffnut
+import stoick
+from ruffnut import logger
+from utils import stormfly
+
+BENCHMARKS: dict[str, Callable[[], None]] = {}
+
+# Time from the first import to the intro screen that counts as a regression
+STARTUP_BUDGET_MS = 500.0
+
+# main.py --profile-startup, with savegames somewhere harmless
+STARTUP_SCRIPT = """
+import sys
+import mulch
+import gobber
+import runpy
+
+gobber.SAVEGAME_FOLDER = sys.argv.pop(1)
+runpy.run_path("main.py", run_name="__main__")
+"""
+
+# The session benchmarks play in; see reset_game()
+session: gobber.GameSession = None  # type: ignore
+
+
+def benchmark(name: str):
+    def register(fn: Callable[[], None]):
+        BENCHMARKS[name] = fn
+        return fn
+
+    return register
+
+
+def timeit(fn: Callable[[], Any], number: int) -> float:
+    """Returns the mean seconds per call of fn over `number` calls."""
+    start = time.perf_counter()
+    for _ in range(number):
+        fn()
+    return (time.perf_counter() - start) / number
+
+
+def report(label: str, **fields: Any):
+    columns = []
+    for key, value in fields.items():
+        if isinstance(value, float):
+            value = f"{value:.3f}"
+        columns.append(f"{key}={value}")
+    print(f"  {label:<32} " + " ".join(columns))
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def rss_mb() -> float:
+    """Current resident set size, from /proc on Linux."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def reset_game() -> gobber.GameSession:
+    """Starts the benchmarks' session over, at the start screen."""
+    global session
+    session = gobber.GameSession()
+    session.entity_stack = [gobber.EntityID(("init", "start_screen"))]
+    return session
+
+
+def make_story(
+    root: str,
+    locations: int,
+    characters: int = 0,
+    quests: int = 0,
+    seed: int = 0,
+):
+    """
+    Writes a synthetic story tree under root/story, shaped like the real one.
+    Locations form a ring with extra random paths; characters are scattered
+    over locations, and quests hang off random characters.
+    """
+    rng = random.Random(seed)
+    story = os.path.join(root, "story")
+    for entity_type in ["character", "location", "quest"]:
+        os.makedirs(os.path.join(story, entity_type), exist_ok=True)
+    shutil.copy("story/player.json", os.path.join(story, "player.json"))
+
+    def write(entity_type: str, name: str, data: dict[str, Any]):
+        with open(os.path.join(story, entity_type, f"{name}.json"), "w") as f:
+            json.dump(data, f)
+
+    for i in range(locations):
+        write(
+            "location",
+            f"loc_{i}",
+            {"name": f"Location {i}", "id": f"loc_{i}", "ambient": [f"Quiet at {i}."]},
+        )
+
+    connections = {}
+    edges = [(i, (i + 1) % locations) for i in range(locations)]
+    edges += [(rng.randrange(locations), rng.randrange(locations)) for _ in range(locations)]
+    for src, dst in edges:
+        for a, b in [(src, dst), (dst, src)]:
+            connections[f"path_{len(connections)}"] = {
+                "from": f"loc_{a}",
+                "to": f"loc_{b}",
+                "action": f"Walk from {a} to {b}.",
+                "variables": {},
+                "opening_states": ["path"],
+                "states": {
+                    "path": {
+                        "steps": [{"type": "story", "text": f"The road to {b}."}],
+                        "transitions": [{"condition": "True", "target": "__menu__"}],
+                    }
+                },
+            }
+    write("location", "connections", connections)
+
+    for i in range(characters):
+        write(
+            "character",
+            f"char_{i}",
+            {
+                "name": f"Viking {i}",
+                "id": f"char_{i}",
+                "menu_lines": ["Hm?"],
+                "option_menus": [],
+                "states": {},
+                "variables": {"location": f"loc_{rng.randrange(locations)}", "health": 100},
+            },
+        )
+
+    for i in range(quests):
+        trigger = f"char_{rng.randrange(characters)}" if characters else None
+        write(
+            "quest",
+            f"quest_{i}",
+            {
+                "id": f"quest_{i}",
+                "variables": {"progress": 0},
+                "characters": {trigger: {}} if trigger else {},
+                "start_entity": f"character:{trigger}" if trigger else f"location:loc_{i % locations}",
+                "start_line": f"Need a hand with job {i}?",
+                "start_condition": f"{trigger}_health > {i % 100}" if trigger else "True",
+                "start_state": "work",
+                "states": {
+                    "work": {
+                        "steps": [
+                            {"type": "story", "text": f"Job {i} gets done."},
+                            {"type": "stateUpdate", "update": "quest_progress += 1\nquest_status = 'completed'"},
+                        ],
+                        "transitions": [{"condition": "True", "target": "work"}],
+                    }
+                },
+            },
+        )
+
+
+@contextlib.contextmanager
+def in_story(**shape: Any) -> Iterator[str]:
+    """Runs the block from a temporary directory holding a synthetic story."""
+    cwd = os.getcwd()
+    savegame_folder = gobber.SAVEGAME_FOLDER
+    with tempfile.TemporaryDirectory() as root:
+        make_story(root, **shape)
+        os.makedirs(os.path.join(root, "savegames"))
+        os.chdir(root)
+        gobber.SAVEGAME_FOLDER = "savegames"
+        gobber.entity_cache.invalidate()
+        reset_game()
+        try:
+            yield root
+        finally:
+            os.chdir(cwd)
+            gobber.SAVEGAME_FOLDER = savegame_folder
+            gobber.entity_cache.invalidate()
+            reset_game()
+
+
+def _legacy_run_effect(effect: str, entity: gobber.EntityID):
+    """run_effect as it was before the evaluator cache: a fresh interpreter per call."""
+    aeval = asteval.Interpreter()
+
+    for var, value in session.entity_states[entity].variables.items():
+        aeval.symtable[f"{entity[0]}_{var}"] = value
+
+    for character_name in gobber.get_entity_data(entity).get("characters", {}).keys():
+        character_entity = gobber.EntityID(("character", character_name))
+        for var, value in session.entity_states[character_entity].variables.items():
+            aeval.symtable[f"{character_name}_{var}"] = value
+
+    result = aeval(effect)
+
+    for var, value in session.entity_states[entity].variables.items():
+        session.entity_states[entity].variables[var] = aeval.symtable[f"{entity[0]}_{var}"]
+
+    for character_name in gobber.get_entity_data(entity).get("characters", {}).keys():
+        character_entity = gobber.EntityID(("character", character_name))
+        for var, value in session.entity_states[character_entity].variables.items():
+            session.entity_states[character_entity].variables[var] = aeval.symtable[
+                f"{character_name}_{var}"
+            ]
+
+    return result
+
+
+@benchmark("run_effect")
+def bench_run_effect():
+    gobber.preload_story_entities(session)
+
+    character = gobber.EntityID(("character", "hiccup"))
+    quest = gobber.EntityID(("quest", "rescue_hiccup_toothless"))
+    cases = [
+        ("character menu probe", "len(character_death_msg) == 0", character),
+        ("quest condition", "hiccup_health > 0 and quest_target == ''", quest),
+        ("quest effect", "astrid_trust = astrid_trust + 0", quest),
+    ]
+
+    for label, effect, entity in cases:
+        number = 2000
+        legacy = timeit(lambda: _legacy_run_effect(effect, entity), number)
+        cached = timeit(lambda: gobber.run_effect(session, effect, entity), number)
+        report(
+            label,
+            legacy_us=legacy * 1e6,
+            cached_us=cached * 1e6,
+            speedup=legacy / cached,
+        )
+
+
+def _legacy_startable_quests(trigger: gobber.EntityID):
+    """astrid._startable_quests as it was, checking every quest on the trigger."""
+    options = []
+    for quest in session.quest_triggers.get(str(trigger), []):
+        quest_data = gobber.get_entity_data(quest)
+        if (
+            gobber.run_effect(session, quest_data["start_condition"], quest)
+            and session.entity_states[quest].variables.get("status") == "idle"
+        ):
+            options.append(quest_data["start_line"])
+    return options
+
+
+@benchmark("startup")
+def bench_startup(runs: int = 5):
+    """Fresh processes started up to the intro screen, median of each phase."""
+    with tempfile.TemporaryDirectory() as savegames:
+        for fast in [False, True]:
+            env = {**os.environ, "BERK_FAST_START": "1" if fast else "0"}
+            profiles = []
+            walls = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                out = subprocess.run(
+                    [sys.executable, "-c", STARTUP_SCRIPT, savegames, "--profile-startup"],
+                    env=env,
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                ).stdout
+                walls.append(time.perf_counter() - start)
+                profiles.append(json.loads(out.splitlines()[-1]))
+
+            phases = {
+                phase: percentile([p[phase] for p in profiles], 50)
+                for phase in profiles[0]
+            }
+            to_intro = sum(ms for phase, ms in phases.items() if phase != "warm")
+            report(
+                f"fast start {'on' if fast else 'off'}",
+                **{f"{phase}_ms": ms for phase, ms in phases.items()},
+                to_intro_ms=to_intro,
+                process_ms=percentile(walls, 50) * 1e3,
+                within_budget=to_intro <= STARTUP_BUDGET_MS,
+            )
+
+
+@benchmark("banners")
+def bench_banners(number: int = 200):
+    """Rendering the menu banners, as going back and forth between menus does."""
+    banners = [("DRAGON", "diet_cola"), ("SELECT VIKING", "diet_cola")]
+
+    def legacy():
+        import pyfiglet
+
+        for text, font in banners:
+            pyfiglet.figlet_format(text, font=font, width=120)
+
+    def cached():
+        for text, font in banners:
+            stoick.banner(text, font)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache_file = stoick.BANNER_CACHE_FILE
+        stoick.BANNER_CACHE_FILE = f"{cache_dir}/banner.cache"
+        try:
+            legacy_s = timeit(legacy, number // 10)
+
+            stoick._banners.clear()
+            stoick._figlets.clear()
+            stoick._disk_banners = None
+            start = time.perf_counter()
+            cached()
+            first_s = time.perf_counter() - start
+            hit_s = timeit(cached, number)
+
+            # A new run: nothing in memory, fonts not loaded
+            stoick._banners.clear()
+            stoick._figlets.clear()
+            stoick._disk_banners = None
+            start = time.perf_counter()
+            cached()
+            disk_s = time.perf_counter() - start
+        finally:
+            stoick.BANNER_CACHE_FILE = cache_file
+
+    report(
+        f"{len(banners)} banners",
+        figlet_format_ms=legacy_s * 1e3,
+        first_ms=first_s * 1e3,
+        memory_us=hit_s * 1e6,
+        next_run_ms=disk_s * 1e3,
+    )
+
+
+@benchmark("transcript")
+def bench_transcript(steps: int = 150, window: int = 30):
+    """Dialogue lines sent through Astrid in a headless app, a frame each."""
+
+    async def idle(*args):
+        pass
+
+    async def play(live_widgets: int | None) -> list[float]:
+        rider = astrid.Astrid(live_widgets=live_widgets)
+        app = stoick.TextualRenderer(idle, idle)
+        frames = []
+        async with app.run_test(headless=True, size=(100, 40)) as pilot:
+            for i in range(steps):
+                line = f"Line {i}: you're late, and Stormfly knows it."
+                rider.to_mount.append(astrid.Dialogue("Astrid", line))
+                start = time.perf_counter()
+                await rider.mission(app)
+                await pilot.pause()
+                frames.append(time.perf_counter() - start)
+        return frames
+
+    for live_widgets in [None, astrid.LIVE_WIDGETS]:
+        frames = asyncio.run(play(live_widgets))
+        report(
+            f"{steps} lines, {live_widgets or 'all'} live",
+            first_ms=sum(frames[:window]) / window * 1e3,
+            last_ms=sum(frames[-window:]) / window * 1e3,
+            p99_ms=percentile(frames, 99) * 1e3,
+        )
+
+
+@benchmark("scene")
+def bench_scene(lines: int = 200, runs: int = 5):
+    """Showing and clearing a scene of dialogue and options, a frame each."""
+
+    async def idle(*args):
+        pass
+
+    def scene() -> list[Any]:
+        widgets: list[Any] = []
+        for i in range(lines):
+            if i % 5 == 4:
+                widgets.append(astrid.Option([f"Ask about line {i}", "Walk away"]))
+            else:
+                widgets.append(astrid.Dialogue("Astrid", f"Line {i} of the scene."))
+        return widgets
+
+    async def play(batched: bool) -> tuple[list[float], list[float]]:
+        app = stoick.TextualRenderer(idle, idle)
+        shows, clears = [], []
+        async with app.run_test(headless=True, size=(100, 40)) as pilot:
+            container = app.app_container
+            for _ in range(runs):
+                widgets = scene()
+                start = time.perf_counter()
+                if batched:
+                    app.mount_batch(container, widgets)
+                else:
+                    for widget in widgets:
+                        container.mount(widget)
+                await pilot.pause()
+                shows.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                if batched:
+                    await app.remove_batch(container)
+                else:
+                    for child in list(container.children):
+                        await child.remove()
+                await pilot.pause()
+                clears.append(time.perf_counter() - start)
+        return shows, clears
+
+    for batched in [False, True]:
+        shows, clears = asyncio.run(play(batched))
+        report(
+            f"{lines} lines, {'batched' if batched else 'one by one'}",
+            show_ms=percentile(shows, 50) * 1e3,
+            clear_ms=percentile(clears, 50) * 1e3,
+        )
+
+
+@benchmark("conditions")
+def bench_conditions(quests: int = 2000):
+    """Every start_condition on one character: evaluated against cached results."""
+    with in_story(locations=100, characters=10, quests=quests):
+        gobber.preload_story_entities(session)
+        trigger = gobber.EntityID(("character", "char_0"))
+        health = session.entity_states[trigger].variables
+        conditions = [
+            (gobber.get_entity_data(quest)["start_condition"], quest)
+            for quest in session.quest_triggers.get(str(trigger), [])
+        ]
+
+        def evaluate():
+            for condition, quest in conditions:
+                gobber.run_effect(session, condition, quest)
+
+        def cached():
+            for condition, quest in conditions:
+                gobber.run_condition(session, condition, quest)
+
+        def after_write():
+            # An input every condition here reads changes
+            health["health"] = health["health"]
+            cached()
+
+        def after_other_write():
+            # The same character moves, which none of them read
+            health["location"] = health["location"]
+            cached()
+
+        cached()
+        number = 50
+        report(
+            f"{len(conditions)} conditions on one character",
+            evaluate_ms=timeit(evaluate, number) * 1e3,
+            cached_ms=timeit(cached, number) * 1e3,
+            after_write_ms=timeit(after_write, number) * 1e3,
+            after_other_write_ms=timeit(after_other_write, number) * 1e3,
+        )
+
+
+@benchmark("quest_board")
+def bench_quest_board(quests: int = 5000, characters: int = 5):
+    """Startable quest lookup: scanning every trigger's quests against the availability index."""
+    with in_story(locations=100, characters=characters, quests=quests):
+        gobber.preload_story_entities(session)
+        trigger = gobber.EntityID(("character", "char_0"))
+        triggered = session.quest_triggers[str(trigger)]
+        quest = triggered[0]
+
+        # Both ways need every quest's state; the scan below times only the
+        # checks, so load them first
+        start = time.perf_counter()
+        for triggered_quest in triggered:
+            session.entity_states[triggered_quest]
+        materialize_ms = (time.perf_counter() - start) * 1e3
+
+        start = time.perf_counter()
+        available = session.quest_board.startable(trigger)
+        first_ms = (time.perf_counter() - start) * 1e3
+
+        def status_change():
+            # Start a quest and give it up again: two rechecks
+            variables = session.entity_states[quest].variables
+            variables["status"] = "inprogress"
+            session.quest_board.startable(trigger)
+            variables["status"] = "idle"
+            session.quest_board.startable(trigger)
+
+        number = 50
+        rechecks = session.quest_board.rechecks
+        report(
+            f"{len(triggered)} of {quests} quests on {trigger}",
+            available=len(available),
+            scan_ms=timeit(lambda: _legacy_startable_quests(trigger), number) * 1e3,
+            materialize_ms=materialize_ms,
+            first_lookup_ms=first_ms,
+            lookup_ms=timeit(lambda: session.quest_board.startable(trigger), number) * 1e3,
+            status_change_ms=timeit(status_change, number) * 1e3 / 2,
+            rechecks_per_change=(session.quest_board.rechecks - rechecks) / (number * 2),
+        )
+
+
+class _LegacyEntityID(tuple[str, str]):
+    """EntityID as it was: Python-level equality and hashing, never reused."""
+
+    def __new__(cls, tup: tuple[str, str]):
+        return super(_LegacyEntityID, cls).__new__(cls, tup)
+
+    def __eq__(self, other):
+        if not isinstance(other, _LegacyEntityID):
+            return False
+        return self[0] == other[0] and self[1] == other[1]
+
+    def __hash__(self):
+        return hash((self[0], self[1]))
+
+
+class _LegacyEntityState:
+    """EntityState as it was: an instance __dict__ and a plain variables dict."""
+
+    def __init__(self, state: str, variables: dict[str, Any] | None = None):
+        self.state = state
+        self.step = 0
+        self.variables = variables if variables is not None else {}
+
+
+@benchmark("entities")
+def bench_entities(count: int = 100000):
+    """Memory per entity (state plus one index entry) and state lookups on a synthetic world."""
+    names = [("character" if i % 2 else "location", f"thing_{i}") for i in range(count)]
+    rng = random.Random(0)
+    probes = [names[rng.randrange(count)] for _ in range(100000)]
+
+    cases = [
+        ("legacy", _LegacyEntityID, _LegacyEntityState, dict),
+        ("current", gobber.EntityID, gobber.EntityState, gobber.EntityStates),
+    ]
+    for label, id_class, state_class, states_class in cases:
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        states = states_class()
+        # Every entity is also filed in an index, like character_locations
+        located: dict[str, list[Any]] = {}
+        for type_name in names:
+            states[id_class(type_name)] = state_class(
+                "idle", {"health": 100, "location": "loc_0"}
+            )
+            located.setdefault(type_name[1][-2:], []).append(id_class(type_name))
+        size = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+
+        def lookups():
+            # Fresh ids each time, like EntityID(("character", speaker))
+            for type_name in probes:
+                states[id_class(type_name)]
+
+        report(
+            f"{count} entities, {label}",
+            bytes_per_entity=size // count,
+            lookups_per_sec=len(probes) / timeit(lookups, 5),
+        )
+        del states, located
+
+
+@benchmark("story_steps")
+def bench_story_steps(steps: int = 20000, seed: int = 0):
+    """Scripted player driving the real story through the headless renderer."""
+    latencies: list[float] = []
+    last = time.perf_counter()
+
+    def on_step(directive: gobber.Directive):
+        nonlocal last
+        now = time.perf_counter()
+        latencies.append(now - last)
+        last = now
+
+    with tempfile.TemporaryDirectory() as savegames:
+        gobber.SAVEGAME_FOLDER = savegames
+        reset_game()
+        session.renderer = stoick.HeadlessRenderer(stoick.RandomPolicy(seed))
+
+        start = time.perf_counter()
+        last = start
+        asyncio.run(main.render_state(session, max_steps=steps, on_step=on_step))
+        elapsed = time.perf_counter() - start
+
+    report(
+        f"{steps} steps, seed {seed}",
+        steps_per_sec=steps / elapsed,
+        p50_us=percentile(latencies, 50) * 1e6,
+        p99_us=percentile(latencies, 99) * 1e6,
+        peak_rss_mb=peak_rss_mb(),
+    )
+
+
+@benchmark("instrument")
+def bench_instrument(steps: int = 20000, seed: int = 0):
+    """The same scripted run with instrumentation off and on."""
+    with tempfile.TemporaryDirectory() as savegames:
+        gobber.SAVEGAME_FOLDER = savegames
+        for on in [False, True]:
+            reset_game()
+            session.renderer = stoick.HeadlessRenderer(stoick.RandomPolicy(seed))
+            mulch.reset()
+            if on:
+                mulch.enable()
+
+            start = time.perf_counter()
+            asyncio.run(main.render_state(session, max_steps=steps))
+            elapsed = time.perf_counter() - start
+            mulch.disable()
+
+            report(
+                f"{steps} steps, {'on' if on else 'off'}",
+                steps_per_sec=steps / elapsed,
+                timings=len(mulch.timings),
+            )
+
+    for line in mulch.summary(5).splitlines():
+        print(f"  {line}")
+    mulch.reset()
+
+
+@benchmark("sessions")
+def bench_sessions(steps: int = 200):
+    """Many headless players sharing one process and one event loop."""
+
+    def new_sessions(count: int) -> list[gobber.GameSession]:
+        sessions = []
+        for i in range(count):
+            player = gobber.GameSession(stoick.HeadlessRenderer(stoick.RandomPolicy(i)))
+            player.entity_stack = [gobber.EntityID(("init", "start_screen"))]
+            sessions.append(player)
+        return sessions
+
+    async def play(sessions: list[gobber.GameSession]):
+        await asyncio.gather(
+            *(
+                main.render_state(player, max_steps=steps, on_exit=None)
+                for player in sessions
+            )
+        )
+        gothi.flush()
+
+    with tempfile.TemporaryDirectory() as savegames:
+        gobber.SAVEGAME_FOLDER = savegames
+        for count in [1, 10, 100, 300]:
+            sessions = new_sessions(count)
+            cpu_start = time.process_time()
+            start = time.perf_counter()
+            asyncio.run(play(sessions))
+            elapsed = time.perf_counter() - start
+            cpu_s = time.process_time() - cpu_start
+            del sessions
+
+            # Again, traced, for what the sessions hold once they've played.
+            # Story data and compiled effects are shared and already cached.
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            sessions = new_sessions(count)
+            asyncio.run(play(sessions))
+            size = tracemalloc.get_traced_memory()[0] - before
+            tracemalloc.stop()
+            del sessions
+
+            report(
+                f"{count} sessions, {steps} steps each",
+                steps_per_sec=count * steps / elapsed,
+                # Players at one scene a second that one core keeps up with
+                sessions_per_core=count * steps / cpu_s,
+                kb_per_session=size / 1024 / count,
+            )
+
+
+@benchmark("server")
+def bench_server(answers: int = 100):
+    """Simulated players over localhost TCP, server and clients in one process."""
+    with tempfile.TemporaryDirectory() as savegames:
+        gobber.SAVEGAME_FOLDER = savegames
+        for clients in [1, 10, 100]:
+
+            async def play():
+                server = hookfang.GameServer()
+                await server.start(port=0)
+                try:
+                    return await hookfang.load_test(clients, answers, port=server.port())
+                finally:
+                    await server.close()
+
+            stats = asyncio.run(play())
+            report(
+                f"{clients} clients, {answers} answers each",
+                answers_per_sec=stats["answers_per_sec"],
+                p50_ms=stats["p50_ms"],
+                p99_ms=stats["p99_ms"],
+                max_ms=stats["max_ms"],
+            )
+
+
+@benchmark("logging")
+def bench_logging(records: int = 20000):
+    """Time spent in the caller per record, which is what frames wait on."""
+    gobber.preload_story_entities(session)
+    location = gobber.EntityID(("location", "berk_square"))
+    options = astrid._location_world_to_player(session, location)
+    menu = [option["text"] for option in options]
+
+    def pipeline(name: str, handler: logging.Handler) -> logging.Logger:
+        log = logging.Logger(name)
+        log.addHandler(handler)
+        return log
+
+    with tempfile.TemporaryDirectory() as logs:
+        # What every record used to go through
+        plain = logging.FileHandler(f"{logs}/sync.log")
+        plain.setFormatter(logging.Formatter(ruffnut.LOG_FORMAT, ruffnut.LOG_DATEFMT))
+        sync = pipeline("sync", plain)
+
+        log_queue: Any = ruffnut.queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(
+            log_queue, ruffnut.file_handler(f"{logs}/queued.log", False)
+        )
+        listener.start()
+        queued = pipeline("queued", ruffnut.LazyQueueHandler(log_queue))
+
+        json_queue: Any = ruffnut.queue.SimpleQueue()
+        json_listener = logging.handlers.QueueListener(
+            json_queue, ruffnut.file_handler(f"{logs}/queued.jsonl", True)
+        )
+        json_listener.start()
+        json_lines = pipeline("json", ruffnut.LazyQueueHandler(json_queue))
+
+        for label, log in [("sync", sync), ("queued", queued), ("json", json_lines)]:
+            line_s = timeit(
+                lambda: log.info("Saved %d entity states to %s", 42, "hiccup.json"),
+                records,
+            )
+            payload_s = timeit(lambda: log.info(options), records // 10)
+            report(f"{label} file", line_us=line_s * 1e6, payload_us=payload_s * 1e6)
+
+        start = time.perf_counter()
+        listener.stop()
+        json_listener.stop()
+        report("queue drain", ms=(time.perf_counter() - start) * 1e3)
+        plain.close()
+
+        # On a local disk both cost the same per record. The queue pays off
+        # when the disk stalls: a 5 ms write every 50 records, here
+        class StallingHandler(logging.FileHandler):
+            emitted = 0
+
+            def emit(self, record: logging.LogRecord):
+                super().emit(record)
+                self.emitted += 1
+                if self.emitted % 50 == 0:
+                    time.sleep(0.005)
+
+        stalling = StallingHandler(f"{logs}/stalling.log")
+        stall_queue: Any = ruffnut.queue.SimpleQueue()
+        stall_listener = logging.handlers.QueueListener(stall_queue, stalling)
+        stall_listener.start()
+        cases = [
+            ("stalling disk, sync", pipeline("stall_sync", stalling)),
+            (
+                "stalling disk, queued",
+                pipeline("stall_queued", ruffnut.LazyQueueHandler(stall_queue)),
+            ),
+        ]
+        for label, log in cases:
+            samples = []
+            for i in range(records // 10):
+                start = time.perf_counter()
+                log.info("Saved %d entity states to %s", i, "hiccup.json")
+                samples.append(time.perf_counter() - start)
+            report(
+                label,
+                p50_us=percentile(samples, 50) * 1e6,
+                p99_us=percentile(samples, 99) * 1e6,
+                max_us=max(samples) * 1e6,
+            )
+        stall_listener.stop()
+        stalling.close()
+
+    ruffnut.set_payload_sample(0)
+    off_s = timeit(
+        lambda: ruffnut.payload_logger.info("Location options: %s", menu), records
+    )
+    report("payload off", line_us=off_s * 1e6)
+
+
+def _legacy_save_game_state():
+    """save_game_state as it was before delta saves: every entity, every variable."""
+    obj = dict(gobber.get_player_state(session))
+    obj.pop("save_format", None)
+    obj["entity_states"] = [
+        {
+            "type": eid[0],
+            "name": eid[1],
+            "state": est.state,
+            "step": est.step,
+            "variables": est.variables,
+        }
+        for eid, est in session.entity_states.items()
+    ]
+    obj["entity_stack"] = [{"type": e[0], "name": e[1]} for e in session.entity_stack]
+    gobber.set_player_state(session, obj)
+
+
+def _saved_states():
+    """Everything a save holds, to check what loading it gives back."""
+    states = {
+        eid: (est.state, est.step, dict(est.variables))
+        for eid, est in session.entity_states.items()
+    }
+    return states, list(session.entity_stack)
+
+
+def materialize_all():
+    """What preload_story_entities used to do: a state for every entity."""
+    for entity_type, names in gobber.entity_cache.get_bundle().manifest.items():
+        for name in names:
+            session.entity_states[gobber.EntityID((entity_type, name))]
+
+
+@benchmark("save_delta")
+def bench_save_delta():
+    """Save size and save/load time against story size, full dump vs delta."""
+    for locations in [100, 1000, 10000]:
+        with in_story(locations=locations, characters=locations // 10, quests=locations // 10):
+            gobber.set_player_file(session, "viking.json")
+            gobber.set_player_state(session, {"name": "Bench", "fullname": "Bench", "states": {}})
+            gobber.preload_story_entities(session)
+
+            # A player a few scenes in
+            visited = [gobber.EntityID(("location", f"loc_{i}")) for i in range(10)]
+            for i, eid in enumerate(visited):
+                session.entity_states[eid].state = "__menu__"
+                session.entity_states[eid].variables["visited"] = i
+            session.entity_stack = visited[:3]
+            gobber.save_game_state(session)
+            materialize_all()
+            saved = _saved_states()
+
+            def migrated():
+                _legacy_save_game_state()
+                gobber.migrate_savegame(session.viking_file)
+
+            cases = [
+                ("full, eager", _legacy_save_game_state, True),
+                ("full, migrated", migrated, True),
+                ("delta, eager", lambda: gobber.save_game_state(session), True),
+                ("delta, lazy", lambda: gobber.save_game_state(session), False),
+            ]
+            for label, save, eager in cases:
+
+                def load():
+                    gobber.load_game_state(session)
+                    gobber.preload_story_entities(session)
+                    if eager:
+                        materialize_all()
+
+                load()
+                save_s = timeit(save, 5)
+                size = os.path.getsize(session.viking_file)
+                load_s = timeit(load, 5)
+                states = len(session.entity_states)
+                materialize_all()
+                report(
+                    f"{locations} locations, {label}",
+                    states=states,
+                    save_bytes=size,
+                    save_ms=save_s * 1e3,
+                    load_ms=load_s * 1e3,
+                    round_trip=_saved_states() == saved,
+                )
+
+
+def _legacy_location_options(location_entity: gobber.EntityID):
+    """astrid._location_world_to_player as it was, building exec() strings."""
+    options = []
+
+    for i, quest in enumerate(session.quest_triggers.get(str(location_entity), [])):
+        quest_data = gobber.get_entity_data(quest)
+        if (
+            gobber.run_effect(session, quest_data["start_condition"], quest)
+            and session.entity_states[quest].variables.get("status") == "idle"
+        ):
+            options.append(
+                {
+                    "text": quest_data["start_line"],
+                    "effect": (
+                        f"session.entity_states[session.quest_triggers['{str(location_entity)}'][{i}]].variables['status']='inprogress'; "
+                        f"session.entity_states[session.quest_triggers['{str(location_entity)}'][{i}]].state='{quest_data['start_state']}'; "
+                        f"session.entity_states[session.quest_triggers['{str(location_entity)}'][{i}]].step = 0; "
+                        f"session.entity_stack.append(session.quest_triggers['{str(location_entity)}'][{i}])"
+                    ),
+                }
+            )
+
+    for i, character in enumerate(session.character_locations.get(location_entity[1], [])):
+        character_data = gobber.get_entity_data(character)
+        options.append(
+            {
+                "text": random.choice(
+                    gobber.get_player_data()["dialogues"]["characters"]["interact"]
+                    if gobber.run_effect(session, "len(character_death_msg) == 0", character)
+                    else gobber.get_player_data()["dialogues"]["characters"]["find_location"]
+                ).format(character_name=character_data["name"]),
+                "effect": f"introduce_character(session, session.character_locations.get('{location_entity[1]}', [])[{i}])",
+            }
+        )
+
+    for connection in session.travel_paths[location_entity]:
+        options.append(
+            {
+                "text": gobber.get_entity_data(connection)["action"],
+                "effect": f"session.entity_stack.pop(); tread_connection(session, gobber.EntityID(('connection', '{connection[1]}')))",
+            }
+        )
+
+    return options
+
+
+@benchmark("menu_effects")
+def bench_menu_effects():
+    """Location menu construction and option dispatch: exec() strings against effect ops."""
+    reset_game()
+    gobber.preload_story_entities(session)
+    location = gobber.EntityID(("location", "berk_square"))
+    astrid.reveal_location(session, location)
+    stack = list(session.entity_stack)
+
+    def legacy_build():
+        # Same logged run_effect probes the current menu makes
+        for character in session.character_locations.get(location[1], []):
+            for probe in ["character_death_msg", "character_health", "character_name"]:
+                logger.info(gobber.run_effect(session, probe, character))
+        return _legacy_location_options(location)
+
+    def legacy_dispatch(options):
+        for option in options:
+            exec(option["effect"], {**vars(astrid), "session": session})
+            session.entity_stack[:] = stack
+
+    def ops_build():
+        return astrid._location_world_to_player(session, location)
+
+    def ops_dispatch(options):
+        for option in options:
+            gobber.apply_directive(session, option["effect"].apply(session))
+            session.entity_stack[:] = stack
+
+    legacy_options = legacy_build()
+    ops_options = ops_build()
+    number = 2000
+    report(
+        f"build, {len(ops_options)} options",
+        exec_us=timeit(legacy_build, number) * 1e6,
+        ops_us=timeit(ops_build, number) * 1e6,
+    )
+    report(
+        f"dispatch, {len(ops_options)} options",
+        exec_us=timeit(lambda: legacy_dispatch(legacy_options), number) * 1e6,
+        ops_us=timeit(lambda: ops_dispatch(ops_options), number) * 1e6,
+    )
+    reset_game()
+
+
+@benchmark("routes")
+def bench_routes(locations: int = 10000):
+    """Connection graph build and fast travel route queries."""
+    with in_story(locations=locations):
+        gobber.preload_story_entities(session)
+        rng = random.Random(0)
+
+        start = time.perf_counter()
+        graph = skullcrusher.get_graph()
+        build_s = time.perf_counter() - start
+
+        pairs = [
+            (f"loc_{rng.randrange(locations)}", f"loc_{rng.randrange(locations)}")
+            for _ in range(1000)
+        ]
+        first_s = timeit(lambda: graph.route("loc_0", "loc_1"), 1)
+        home = [("loc_0", dst) for _, dst in pairs]
+        i = 0
+
+        def cached_route():
+            nonlocal i
+            graph.route(*home[i % len(home)])
+            i += 1
+
+        lengths = [len(graph.route(*pair) or []) for pair in home]
+        report(
+            f"{locations} locations, {len(graph.targets)} paths",
+            build_ms=build_s * 1e3,
+            first_route_ms=first_s * 1e3,
+            cached_route_us=timeit(cached_route, 10000) * 1e6,
+            mean_hops=sum(lengths) / len(lengths),
+        )
+
+
+@benchmark("story_bundle")
+def bench_story_bundle():
+    """Reading every story file against opening a compiled bundle."""
+    for locations in [1000, 10000]:
+        with in_story(locations=locations, characters=locations, quests=locations):
+
+            def parse_all():
+                for file_path in sorted(os.listdir("story")):
+                    type_dir = os.path.join("story", file_path)
+                    if os.path.isdir(type_dir):
+                        for name in os.listdir(type_dir):
+                            with open(os.path.join(type_dir, name), "r") as f:
+                                json.load(f)
+
+            def open_and_fetch():
+                bundle = bork.load_bundle()
+                for key in list(bundle.entries)[:10]:
+                    bundle.get(key)
+                bundle.close()
+
+            parse_s = timeit(parse_all, 3)
+            compile_s = timeit(bork.compile_story, 3)
+            open_s = timeit(open_and_fetch, 10)
+            report(
+                f"{locations * 2} story files",
+                parse_all_ms=parse_s * 1e3,
+                compile_ms=compile_s * 1e3,
+                open_bundle_ms=open_s * 1e3,
+            )
+
+
+@benchmark("autosave")
+def bench_autosave(requests: int = 2000):
+    """Loop-thread cost of autosave bursts against a synchronous save."""
+    with in_story(locations=1000, characters=100, quests=100):
+        gobber.set_player_file(session, "viking.json")
+        gobber.set_player_state(session, {"name": "Bench", "fullname": "Bench", "states": {}})
+        gobber.preload_story_entities(session)
+        hiccup = gobber.EntityID(("location", "loc_0"))
+
+        sync_s = timeit(lambda: gobber.save_game_state(session), 20)
+
+        autosaver = gothi.Autosaver(debounce=0.05)
+        loop_s = 0.0
+
+        async def burst():
+            nonlocal loop_s
+            for i in range(requests):
+                session.entity_states[hiccup].variables["visited"] = i
+                start = time.perf_counter()
+                autosaver.request(session)
+                loop_s += time.perf_counter() - start
+                await asyncio.sleep(0.0005)
+            depth = autosaver.queue_depth()
+            autosaver.flush()
+            return depth
+
+        depth = asyncio.run(burst())
+        stats = autosaver.stats()
+        report("synchronous save", loop_ms=sync_s * 1e3)
+        report(
+            f"{requests} autosave requests",
+            loop_us=loop_s / requests * 1e6,
+            writes=stats["writes"],
+            depth_before_flush=depth,
+            max_snapshot_ms=stats["max_snapshot_ms"],
+            max_latency_ms=stats["max_latency_ms"],
+        )
+
+
+@benchmark("hot_reload")
+def bench_hot_reload(files: int = 10000):
+    """Picking up one edited quest against re-indexing the whole story, and noticing the edit."""
+    quests = files // 2
+    with in_story(locations=files - quests, characters=100, quests=quests):
+        gobber.preload_story_entities(session)
+        path = "story/quest/quest_0.json"
+        with open(path) as f:
+            quest = json.load(f)
+        i = 0
+
+        def edit():
+            nonlocal i
+            i += 1
+            quest["characters"] = {f"char_{i % 100}": {}}
+            quest["start_entity"] = f"character:char_{i % 100}"
+            with open(path, "w") as f:
+                json.dump(quest, f)
+
+        def full():
+            edit()
+            gobber.entity_cache.invalidate()
+            gobber.preload_story_entities(gobber.GameSession())
+
+        def reload():
+            edit()
+            gobber.reload_story_file(path)
+
+        def edits_seen() -> bool:
+            # As a watcher sees it: every edit to the same file, not just the first
+            gobber.entity_cache.watched = True
+            try:
+                seen = []
+                for _ in range(3):
+                    reload()
+                    data = gobber.get_entity_data(gobber.EntityID(("quest", "quest_0")))
+                    seen.append(data["start_entity"] == quest["start_entity"])
+                return all(seen)
+            finally:
+                gobber.entity_cache.watched = False
+
+        full_s = timeit(full, 3)
+        gobber.preload_story_entities(session)
+        report(
+            f"{files} story files",
+            full_reindex_ms=full_s * 1e3,
+            reload_ms=timeit(reload, 20) * 1e3,
+            refiled=gobber.EntityID(("quest", "quest_0"))
+            in session.quest_triggers.get(quest["start_entity"], []),
+            edits_seen=edits_seen(),
+        )
+
+        for use_inotify in [True, False]:
+            watcher = mildew.StoryWatcher(use_inotify=use_inotify)
+            watcher.start()
+            try:
+                time.sleep(0.01)  # mtimes are coarse on some filesystems
+                edit()
+                # Polling notices on its next scan, so that's all it waits for
+                start = time.perf_counter()
+                changed = watcher.changes(1.0 if watcher.fd is not None else 0.0)
+                noticed_s = time.perf_counter() - start
+            finally:
+                watcher.close()
+            report(
+                "inotify" if use_inotify else f"polling every {watcher.interval}s",
+                noticed_ms=noticed_s * 1e3,
+                changed=len(changed),
+            )
+
+
+@benchmark("validate")
+def bench_validate(files: int = 10000):
+    """Story validation in one process, over a process pool, and again with every file cached."""
+    with in_story(locations=files // 2, characters=files // 4, quests=files // 4):
+        cold_s = timeit(lambda: stormfly.validate_story(jobs=1, use_cache=False), 1)
+        pool_s = timeit(lambda: stormfly.validate_story(use_cache=False), 1)
+        stormfly.validate_story()
+        with open("story/quest/quest_0.json") as f:
+            quest = json.load(f)
+        quest["start_line"] = "Edited."
+        with open("story/quest/quest_0.json", "w") as f:
+            json.dump(quest, f)
+        start = time.perf_counter()
+        result = stormfly.validate_story()
+        edited_s = time.perf_counter() - start
+        report(
+            f"{result.files} story files, {os.cpu_count()} CPUs",
+            one_process_ms=cold_s * 1e3,
+            pool_ms=pool_s * 1e3,
+            one_edited_ms=edited_s * 1e3,
+            checked=result.checked,
+            problems=len(result.problems),
+        )
+
+
+@benchmark("state_tables")
+def bench_state_tables():
+    """Charting quest state machines: time per state should stay flat as quests grow."""
+    for count in [1000, 10000, 100000]:
+        states = {}
+        for i in range(count):
+            # A chain with a branch back, every tenth state also dropping a
+            # transition that can never fire; the last tenth is cut off
+            transitions = [
+                {"condition": f"quest_step == {i}", "target": f"s_{(i + 1) % count}"},
+                {"condition": "False", "target": f"s_{i // 2}"},
+                {"condition": "True", "target": f"s_{i}"},
+            ]
+            if i % 10 == 9:
+                transitions = transitions[:1]
+            states[f"s_{i}"] = {
+                "steps": [{"type": "story", "text": f"Step {i}."}],
+                "transitions": transitions if i != count * 9 // 10 else [],
+            }
+        data = {"start_state": "s_0", "states": states}
+        start = time.perf_counter()
+        charted = eret.analyze("quest", data)
+        analyze_s = time.perf_counter() - start
+        report(
+            f"{count} states",
+            analyze_ms=analyze_s * 1e3,
+            per_state_us=analyze_s / count * 1e6,
+            impossible=len(charted.impossible),
+            unreachable=len(charted.unreachable),
+            dead_ends=len(charted.dead_ends),
+        )
+
+
+def run(names: list[str]):
+    for name in names or list(BENCHMARKS):
+        if name not in BENCHMARKS:
+            raise Exception(f"Unknown benchmark: {name}")
+        print(f"{name}:")
+        reset_game()
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    run(sys.argv[1:])
@@ -1,11 +1,37 @@
 from textual.app import App, ComposeResult
 from textual.containers import VerticalScroll, VerticalGroup, Center, Middle
 from textual.widgets import Static, Button, Input
-from textual.widget import Widget
+from textual.widget import AwaitMount, Widget
+from textual.await_remove import AwaitRemove
 from textual.message import Message
-import pyfiglet
 import asyncio
-from typing import Any
+import json
+import os
+import random
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Iterable
+
+import mulch
+
+# Draw the first screens before loading what they can do without, like
+# figlet fonts, and load those in the background
+FAST_START = os.environ.get("BERK_FAST_START", "1") != "0"
+
+# Rendered banners are kept in memory, up to BANNER_CACHE_SIZE of them, and
+# in BANNER_CACHE_FILE so the next run can draw them without pyfiglet. Set
+# it to None to keep them in memory only, and delete the file after
+# changing fonts.
+BANNER_CACHE_SIZE = 64
+BANNER_CACHE_FILE: str | None = "banner.cache"
+
+# (font, width) -> pyfiglet.Figlet, see figlet()
+_figlets: dict[tuple[str, int], Any] = {}
+# (text, font, width) -> rendered banner, least recently used first
+_banners: OrderedDict[tuple[str, str, int], str] = OrderedDict()
+# BANNER_CACHE_FILE's contents once read, keyed like _banner_key()
+_disk_banners: dict[str, str] | None = None
+_figlets_lock = threading.RLock()
 
 class ScreenRider(Widget):
     class ExitGame(Message):
@@ -13,10 +39,121 @@ class ScreenRider(Widget):
 
     async def mission(self, renderer) -> Any: ...
 
+    def choices(self) -> list[Any]:
+        """Every value mission() can return, for renderers without a screen."""
+        return [None]
+
+    def labels(self) -> list[str]:
+        """What to call each of choices() when it has to be written out."""
+        return ["Continue" if choice is None else str(choice) for choice in self.choices()]
+
+def figlet(font: str = "standard", width: int = 120) -> Any:
+    """
+    A loaded figlet font, kept for every later banner. Imports pyfiglet on
+    first use. Safe to call from a warm-up thread.
+    """
+    with _figlets_lock:
+        loaded = _figlets.get((font, width))
+        if loaded is None:
+            import pyfiglet
+
+            loaded = _figlets[(font, width)] = pyfiglet.Figlet(font=font, width=width)
+        return loaded
+
+
+def _banner_key(text: str, font: str, width: int) -> str:
+    return f"{font}:{width}:{text}"
+
+
+def _read_disk_banners() -> dict[str, str]:
+    global _disk_banners
+    if _disk_banners is None:
+        try:
+            with open(BANNER_CACHE_FILE, "r") as f:  # type: ignore
+                _disk_banners = json.load(f)
+        except (FileNotFoundError, TypeError, ValueError):
+            _disk_banners = {}
+    return _disk_banners  # type: ignore
+
+
+def _write_disk_banners():
+    temp_file = f"{BANNER_CACHE_FILE}.tmp"
+    try:
+        with open(temp_file, "w") as f:
+            json.dump(_disk_banners, f)
+        os.replace(temp_file, BANNER_CACHE_FILE)  # type: ignore
+    except OSError:
+        # Only a cache; the banner is rendered again next run
+        pass
+
+
+def cached_banner(text: str, font: str = "standard", width: int = 120) -> str | None:
+    """A banner from memory or BANNER_CACHE_FILE, or None if neither has it."""
+    key = (text, font, width)
+    with _figlets_lock:
+        ascii_art = _banners.get(key)
+        if ascii_art is not None:
+            _banners.move_to_end(key)
+            return ascii_art
+
+        if BANNER_CACHE_FILE is None:
+            return None
+        ascii_art = _read_disk_banners().get(_banner_key(text, font, width))
+        if ascii_art is not None:
+            _remember_banner(key, ascii_art)
+        return ascii_art
+
+
+def _remember_banner(key: tuple[str, str, int], ascii_art: str):
+    _banners[key] = ascii_art
+    if len(_banners) > BANNER_CACHE_SIZE:
+        _banners.popitem(last=False)
+
+
+def banner(text: str, font: str = "standard", width: int = 120) -> str:
+    """
+    text in a figlet font, rendered once and then cached. Safe to call from
+    a warm-up thread.
+    """
+    with _figlets_lock:
+        ascii_art = cached_banner(text, font, width)
+        if ascii_art is not None:
+            return ascii_art
+
+        ascii_art = figlet(font, width).renderText(text)
+        _remember_banner((text, font, width), ascii_art)
+        if BANNER_CACHE_FILE is not None:
+            _read_disk_banners()[_banner_key(text, font, width)] = ascii_art
+            _write_disk_banners()
+        return ascii_art
+
+
 class BigText(Static):
-    def __init__(self, text: str, font: str = "standard", *args, **kwargs):
-        ascii_art = pyfiglet.figlet_format(text, font=font, width=120)
-        super().__init__(ascii_art, markup=False, *args, **kwargs)
+    """
+    Text drawn in a figlet font. With FAST_START, a banner that has to be
+    rendered with a font that isn't loaded yet shows the plain text until
+    a thread has rendered it.
+    """
+
+    def __init__(
+        self, text: str, font: str = "standard", width: int = 120, *args, **kwargs
+    ):
+        self.text = text
+        self.font = font
+        self.width_chars = width
+        ascii_art = cached_banner(text, font, width)
+        if ascii_art is None and ((font, width) in _figlets or not FAST_START):
+            ascii_art = banner(text, font, width)
+        self.rendered = ascii_art is not None
+        super().__init__(ascii_art or text, markup=False, *args, **kwargs)
+
+    async def on_mount(self):
+        if not self.rendered:
+            ascii_art = await asyncio.to_thread(
+                banner, self.text, self.font, self.width_chars
+            )
+            self.update(ascii_art)
+            self.rendered = True
 
 class TextualRenderer(App):
     CSS_PATH = [
@@ -27,6 +164,7 @@ class TextualRenderer(App):
     ]
 
     bid_scout = {}
+    headless = False
 
     def __init__(self, exit_game, riders):
         super().__init__()
@@ -40,12 +178,29 @@ class TextualRenderer(App):
 
     def on_ready(self):
         # This runs after the UI is ready.
+        mulch.mark("first_frame")
         asyncio.create_task(self.riders())
 
     def compose(self) -> ComposeResult:
         self.app_container = VerticalScroll(id="dialogue")
         yield self.app_container
 
+    def mount_batch(self, parent: Widget, widgets: Iterable[Widget]) -> AwaitMount:
+        """
+        Mounts widgets into parent together, so the scene changes in one
+        layout and repaint rather than one per widget. Await the result to
+        wait until they are all mounted.
+        """
+        with self.batch_update():
+            return parent.mount(*widgets)
+
+    def remove_batch(
+        self, parent: Widget, widgets: Iterable[Widget] | None = None
+    ) -> AwaitRemove:
+        """Removes widgets from parent, or all its children, together."""
+        with self.batch_update():
+            return parent.remove_children("*" if widgets is None else widgets)
+
     async def on_screen_rider_exit_game(self):
         await self.exit_game()
         exit()
@@ -77,12 +232,8 @@ class TextualRenderer(App):
             result = res
             done.set()
 
-        self.app_container.mount(Static("[bold]CREATE VIKING[/bold]"))
-
         fullname = Input(placeholder="Full name")
         name = Input(placeholder="Nickname")
-        self.app_container.mount(fullname)
-        self.app_container.mount(name)
 
         # event handlers: using closures because Textual's handler signature is flexible
         async def on_back():
@@ -98,10 +249,18 @@ class TextualRenderer(App):
         back_btn = Button("Back", id="on_back")
         create_btn = Button("Create Viking", id="on_create")
 
-        self.app_container.mount(back_btn)
-        self.app_container.mount(create_btn)
+        self.mount_batch(
+            self.app_container,
+            [
+                Static("[bold]CREATE VIKING[/bold]"),
+                fullname,
+                name,
+                back_btn,
+                create_btn,
+            ],
+        )
 
-        await done.wait()
+        await mulch.wait("viking_create", done.wait())
 
         del self.bid_scout["on_back"]
         del self.bid_scout["on_create"]
@@ -121,14 +280,107 @@ class TextualRenderer(App):
             next_btn = Button("Continue", id="continue")
             self.bid_scout["continue"] = continue_path
             self.app_container.mount(next_btn)
-            await continue_event.wait()
+            await mulch.wait("continue", continue_event.wait())
+
+        await self.remove_batch(self.app_container)
+
+
+class HeadlessPolicy:
+    """
+    Makes every choice for a HeadlessRenderer. Subclasses pick an index in
+    choose(); every pick is kept in `record` so a run can be replayed.
+    """
+
+    def __init__(self):
+        self.record: list[int] = []
+
+    def pick(self, options: list[Any]) -> int:
+        idx = self.choose(options)
+        self.record.append(idx)
+        return idx
+
+    def choose(self, options: list[Any]) -> int: ...
+
+    def save(self, filename: str):
+        with open(filename, "w") as f:
+            json.dump(self.record, f)
+
+
+class RandomPolicy(HeadlessPolicy):
+    def __init__(self, seed: int | None = None):
+        super().__init__()
+        self.random = random.Random(seed)
 
-        to_remove = []
-        for child in self.app_container.children:
-            to_remove.append(child)
+    def choose(self, options: list[Any]) -> int:
+        return self.random.randrange(len(options))
 
-        for child in to_remove:
-            await child.remove()
+
+class ScriptedPolicy(HeadlessPolicy):
+    """Replays a fixed list of picks, then falls back to another policy."""
+
+    def __init__(self, script: list[int], fallback: HeadlessPolicy | None = None):
+        super().__init__()
+        self.script = list(script)
+        self.position = 0
+        self.fallback = fallback if fallback is not None else RandomPolicy(0)
+
+    def choose(self, options: list[Any]) -> int:
+        if self.position < len(self.script):
+            idx = self.script[self.position]
+            self.position += 1
+            if not 0 <= idx < len(options):
+                raise Exception(f"Scripted choice {idx} out of {len(options)} options")
+            return idx
+        return self.fallback.choose(options)
+
+
+class RecordedPolicy(ScriptedPolicy):
+    """Replays picks saved by HeadlessPolicy.save()."""
+
+    def __init__(self, filename: str, fallback: HeadlessPolicy | None = None):
+        with open(filename, "r") as f:
+            super().__init__(json.load(f), fallback)
+
+
+class HeadlessRenderer:
+    """
+    Renders nothing. Every choice the player would make comes from a policy,
+    so the quest engine can run without a terminal.
+    """
+
+    headless = True
+
+    def __init__(self, policy: HeadlessPolicy, output: Callable[[str], Any] | None = None):
+        self.policy = policy
+        self.output = output
+        self.viking_count = 0
+
+    def _write(self, line: str):
+        if self.output is not None:
+            self.output(line)
+
+    async def send_rider(self, rider: ScreenRider):
+        choices = rider.choices()
+        return choices[self.policy.pick(choices)]
+
+    async def send_viking_create(self):
+        self.viking_count += 1
+        name = f"Viking {self.viking_count}"
+        return (True, name, f"{name} the Headless")
+
+    async def send_story(self, story: str):
+        self._write(story)
+
+    async def send_dialogue(self, speaker: str, text: str):
+        self._write(f"{speaker.upper()}: {text}")
+
+    async def send_option(self, options: list[str]) -> int:
+        for idx, option in enumerate(options):
+            self._write(f"  [{idx}] {option}")
+        return self.policy.pick(options)
+
+    async def clear_screen(self, ask=True):
+        pass
 
 
-renderer: TextualRenderer = None  # type: ignore
+renderer: TextualRenderer | HeadlessRenderer = None  # type: ignore
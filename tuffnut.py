@@ -2,10 +2,14 @@ from typing import NoReturn
 import asyncio
 
 import gobber
+import gothi
+from ruffnut import logger
 
-async def exit_game() -> NoReturn:
-    if gobber.viking_file != "":
-        gobber.save_game_state()
+async def exit_game(session: gobber.GameSession) -> NoReturn:
+    if session.viking_file:
+        gothi.autosave(session)
+        gothi.flush()
+        logger.info("Autosave: %s", gothi.autosaver.stats())
     asyncio.get_event_loop().stop()
     while True:
         await asyncio.sleep(0)
@@ -1,18 +1,797 @@
-# TODO: Schema validator for story entities
+"""
+Stormfly: the story validator. Astrid's Nadder spots a loose scale from
+across the arena, and this spots a broken story file before a player
+walks into it.
 
+validate_story() checks every story/<type>/<name>.json, and player.json:
+
+    schema       each file against SCHEMAS for its type, which grew out of
+                 story_old/quest/schema.json
+    expressions  every condition, effect and update, parsed the way gobber
+                 compiles them and using only syntax asteval can run
+    states       start_state, opening_states, option_menus and transition
+                 targets name a state of the same entity, and eret finds
+                 no dead ends (errors), unreachable states or transitions
+                 that can never fire (warnings)
+    references   start_entity, speaker, connection from/to, characters
+                 keys and starting locations name an entity that exists,
+                 and expressions only use variables in scope
+
+The first three look at one file at a time, so they are spread over a
+ProcessPoolExecutor. Their results are cached in STORMFLY_CACHE_FILE by
+each file's hash, and unchanged files are not checked again. References
+need the whole story and are checked afterwards from every file's cached
+summary, in one pass.
+
+Run `python -m utils.stormfly [story dir]` from the repository root. It
+prints every problem and exits with 1 if any of them is an error.
+"""
+
+import ast
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any
+
+import eret
 import gobber
 
-# def 
+STORMFLY_CACHE_FILE: str | None = "stormfly.cache"
+# Bump whenever a check changes, so results cached by older checks are dropped
+CHECKS_VERSION = 2
+# Below this many files to check, starting processes costs more than it saves
+POOL_MIN_FILES = 200
+POOL_CHUNK = 64
+
+# Variables gobber gives entities besides their story file's
+ENGINE_VARIABLES = {"quest": ["status"], "character": ["death_msg"]}
+
+_NAME = "^[A-Za-z0-9_]+$"
+_STRING = {"type": "string"}
+_TEXT = {"type": "string", "minLength": 1}
+_LINES = {"type": "array", "items": _TEXT, "minItems": 1}
+_VARIABLES = {
+    "type": "object",
+    "patternProperties": {
+        _NAME: {"type": ["string", "boolean", "number", "null", "array"]}
+    },
+    "additionalProperties": False,
+}
+_CHOICE = {
+    "type": "object",
+    "properties": {
+        "text": _TEXT,
+        "effect": _STRING,
+        "retrospective": {
+            "type": "object",
+            "properties": {
+                "type": {"enum": ["story", "dialogue", "skip"]},
+                "line": _STRING,
+            },
+            "required": ["type"],
+            "additionalProperties": False,
+        },
+    },
+    "required": ["text"],
+    "additionalProperties": False,
+}
+_STEP = {
+    "type": "object",
+    "properties": {"type": _STRING},
+    "required": ["type"],
+    "oneOf": [
+        {
+            "properties": {
+                "type": {"const": "dialogue"},
+                "speaker": _TEXT,
+                "text": _STRING,
+                "choices": {"type": "array", "items": _CHOICE, "minItems": 1},
+            },
+            "required": ["speaker", "text"],
+            "additionalProperties": False,
+        },
+        {
+            "properties": {"type": {"const": "story"}, "text": _STRING},
+            "required": ["text"],
+            "additionalProperties": False,
+        },
+        {
+            "properties": {
+                "type": {"const": "task"},
+                "taskId": _STRING,
+                "description": _STRING,
+                "character": _STRING,
+                "choiceText": _STRING,
+            },
+            "required": ["taskId", "description", "character", "choiceText"],
+            "additionalProperties": False,
+        },
+        {
+            "properties": {"type": {"const": "stateUpdate"}, "update": _STRING},
+            "required": ["update"],
+            "additionalProperties": False,
+        },
+        {
+            "properties": {
+                "type": {"const": "teleportCharacter"},
+                "location": _STRING,
+                "character": _STRING,
+            },
+            "required": ["location", "character"],
+            "additionalProperties": False,
+        },
+    ],
+}
+_STATES = {
+    "type": "object",
+    "patternProperties": {
+        _NAME: {
+            "type": "object",
+            "properties": {
+                # draw_this reads the step the entity is on, so never none
+                "steps": {"type": "array", "items": _STEP, "minItems": 1},
+                "transitions": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {"condition": _STRING, "target": _TEXT},
+                        "required": ["condition", "target"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["steps"],
+            "additionalProperties": False,
+        }
+    },
+    "additionalProperties": False,
+}
+_OPENING_STATES = {"type": "array", "items": _TEXT, "minItems": 1}
+
+# Entity type -> JSON schema. Only the parts of JSON Schema used here are
+# supported, see check_schema().
+SCHEMAS: dict[str, dict[str, Any]] = {
+    "quest": {
+        "type": "object",
+        "properties": {
+            "id": {"type": "string", "pattern": _NAME},
+            "title": _TEXT,
+            "description": _STRING,
+            "variables": _VARIABLES,
+            "characters": {
+                "type": "object",
+                "patternProperties": {
+                    _NAME: {
+                        "type": "object",
+                        "properties": {
+                            "name": _STRING,
+                            "acquireLock": {"enum": [0, 1, 2]},
+                        },
+                        "additionalProperties": False,
+                    }
+                },
+                "additionalProperties": False,
+            },
+            "start_entity": {"type": "string", "pattern": "^[a-z]+:[A-Za-z0-9_-]+$"},
+            "start_state": _TEXT,
+            "start_line": _TEXT,
+            "start_condition": _STRING,
+            "states": {**_STATES, "minProperties": 1},
+        },
+        "patternProperties": {
+            "^[A-Za-z0-9_]+_death_msg$": {"type": ["string", "null"]}
+        },
+        "required": [
+            "id",
+            "start_entity",
+            "start_state",
+            "start_line",
+            "start_condition",
+            "states",
+        ],
+        "additionalProperties": False,
+    },
+    "character": {
+        "type": "object",
+        "properties": {
+            "id": {"type": "string", "pattern": _NAME},
+            "name": _TEXT,
+            "fullname": _STRING,
+            "description": _STRING,
+            "interactable": {"type": "boolean"},
+            "opening_states": _OPENING_STATES,
+            "menu_lines": _LINES,
+            "option_menus": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {"state": _TEXT, "text": _TEXT},
+                    "required": ["state", "text"],
+                    "additionalProperties": False,
+                },
+            },
+            "states": _STATES,
+            "variables": _VARIABLES,
+        },
+        "required": ["id", "name", "menu_lines"],
+        "additionalProperties": False,
+    },
+    "location": {
+        "type": "object",
+        "properties": {
+            "id": {"type": "string", "pattern": _NAME},
+            "name": _TEXT,
+            "description": _STRING,
+            "ambient": _LINES,
+            "opening_states": _OPENING_STATES,
+            "states": _STATES,
+            "variables": _VARIABLES,
+        },
+        "required": ["id", "name"],
+        "additionalProperties": False,
+    },
+    "connection": {
+        "type": "object",
+        "properties": {
+            "from": _TEXT,
+            "to": _TEXT,
+            "action": _TEXT,
+            "opening_states": _OPENING_STATES,
+            "states": _STATES,
+            "variables": _VARIABLES,
+        },
+        "required": ["from", "to", "action"],
+        "additionalProperties": False,
+    },
+    "items": {
+        "type": "object",
+        "properties": {"name": _TEXT, "description": _STRING},
+        "required": ["name"],
+        "additionalProperties": False,
+    },
+    "player": {
+        "type": "object",
+        "properties": {
+            "dialogues": {
+                "type": "object",
+                "properties": {
+                    "characters": {
+                        "type": "object",
+                        "properties": {
+                            "farewell": _LINES,
+                            "interact": _LINES,
+                            "find_location": _LINES,
+                        },
+                        "required": ["farewell", "interact"],
+                    },
+                    "travel": {
+                        "type": "object",
+                        "properties": {
+                            "fast_travel": _LINES,
+                            "destination": _LINES,
+                            "stay": _LINES,
+                        },
+                        "required": ["fast_travel", "destination", "stay"],
+                    },
+                },
+                "required": ["characters", "travel"],
+            },
+            "states": _VARIABLES,
+        },
+        "required": ["dialogues", "states"],
+    },
+}
+
+# JSON type -> the exact Python types json.load() gives for it
+_TYPES = {
+    "object": (dict,),
+    "array": (list,),
+    "string": (str,),
+    "boolean": (bool,),
+    "null": (type(None),),
+    "number": (int, float),
+    "integer": (int,),
+}
+# pattern -> compiled pattern, for check_schema()
+_patterns: dict[str, re.Pattern] = {}
+# expression -> compile_expression() result
+_expressions: dict[str, tuple[str | None, list[str], list[str]]] = {}
+
+
+class Problem:
+    __slots__ = ("severity", "file", "where", "message")
+
+    def __init__(self, severity: str, file: str, where: str, message: str):
+        self.severity = severity
+        self.file = file
+        self.where = where
+        self.message = message
+
+    def __str__(self):
+        where = f" {self.where}:" if self.where else ""
+        return f"{self.severity}: {self.file}:{where} {self.message}"
+
+    def __repr__(self):
+        return f"Problem({str(self)!r})"
+
+
+class StoryReport:
+    def __init__(self, problems: list[Problem], files: int, checked: int, seconds: float):
+        self.problems = problems
+        self.files = files
+        # Files checked this time, rather than taken from the cache
+        self.checked = checked
+        self.seconds = seconds
+
+    @property
+    def errors(self) -> list[Problem]:
+        return [p for p in self.problems if p.severity == "error"]
+
+    def summary(self) -> str:
+        return (
+            f"{self.files} story files, {self.checked} checked, "
+            f"{len(self.errors)} errors, "
+            f"{len(self.problems) - len(self.errors)} warnings "
+            f"in {self.seconds * 1e3:.0f} ms"
+        )
+
+
+def _search(pattern: str, text: str) -> bool:
+    compiled = _patterns.get(pattern)
+    if compiled is None:
+        compiled = _patterns[pattern] = re.compile(pattern)
+    return compiled.search(text) is not None
+
+
+def _ruled_out(schema: dict[str, Any], value: Any) -> bool:
+    """Whether a const property, like a step's type, already rules schema out."""
+    if not isinstance(value, dict):
+        return False
+    for key, sub in schema.get("properties", {}).items():
+        if "const" in sub and key in value and value[key] != sub["const"]:
+            return True
+    return False
+
+
+def check_schema(
+    schema: dict[str, Any], value: Any, where: str, problems: list[tuple[str, str]]
+):
+    """
+    Appends (where, message) to problems for every way value breaks schema.
+    Supports type, const, enum, minLength, pattern, properties,
+    patternProperties, additionalProperties, required, minProperties,
+    items, minItems and oneOf.
+    """
+    types = schema.get("type")
+    if types is not None:
+        names = types if isinstance(types, list) else [types]
+        if not any(type(value) in _TYPES[name] for name in names):
+            problems.append((where, f"should be {' or '.join(names)}"))
+            return
+    if "const" in schema and value != schema["const"]:
+        problems.append((where, f"should be {schema['const']!r}"))
+        return
+    if "enum" in schema and value not in schema["enum"]:
+        problems.append((where, f"should be one of {schema['enum']!r}"))
+        return
+
+    if isinstance(value, str):
+        if len(value) < schema.get("minLength", 0):
+            problems.append((where, "should not be empty"))
+        if "pattern" in schema and not _search(schema["pattern"], value):
+            problems.append((where, f"should match {schema['pattern']}"))
+
+    elif isinstance(value, dict):
+        for key in schema.get("required", []):
+            if key not in value:
+                problems.append((where, f"is missing '{key}'"))
+        if len(value) < schema.get("minProperties", 0):
+            problems.append((where, "should not be empty"))
+
+        properties = schema.get("properties", {})
+        patterns = schema.get("patternProperties", {})
+        additional = schema.get("additionalProperties", True)
+        for key, item in value.items():
+            path = f"{where}.{key}" if where else key
+            if key in properties:
+                check_schema(properties[key], item, path, problems)
+                continue
+            matched = False
+            for pattern, sub in patterns.items():
+                if _search(pattern, key):
+                    matched = True
+                    check_schema(sub, item, path, problems)
+            if matched:
+                continue
+            if additional is False:
+                problems.append((path, "is not a known field"))
+            elif isinstance(additional, dict):
+                check_schema(additional, item, path, problems)
+
+    elif isinstance(value, list):
+        if len(value) < schema.get("minItems", 0):
+            problems.append((where, "should not be empty"))
+        if "items" in schema:
+            for idx, item in enumerate(value):
+                check_schema(schema["items"], item, f"{where}[{idx}]", problems)
+
+    if "oneOf" in schema:
+        # Report the alternative that came closest, e.g. the step of the
+        # right type with a field missing
+        closest: list[tuple[str, str]] | None = None
+        matches = 0
+        alternatives = [a for a in schema["oneOf"] if not _ruled_out(a, value)]
+        for alternative in alternatives or schema["oneOf"]:
+            found: list[tuple[str, str]] = []
+            check_schema(alternative, value, where, found)
+            if not found:
+                matches += 1
+            elif closest is None or len(found) < len(closest):
+                closest = found
+        if matches > 1:
+            problems.append((where, "matches more than one alternative"))
+        elif matches == 0 and closest is not None:
+            problems.extend(closest)
+
+
+_asteval_nodes: set[str] | None = None
+
+
+def _asteval_supported() -> set[str]:
+    global _asteval_nodes
+    if _asteval_nodes is None:
+        import asteval
+
+        _asteval_nodes = set(asteval.Interpreter().node_handlers)
+    return _asteval_nodes
+
+
+def compile_expression(text: str) -> tuple[str | None, list[str], list[str]]:
+    """
+    Parses a condition or effect the way gobber does. Returns an error, or
+    None, and the names it reads and writes. Results are kept, as the same
+    conditions turn up all over a story.
+    """
+    result = _expressions.get(text)
+    if result is None:
+        result = _expressions[text] = _compile_expression(text)
+    return result
+
+
+def _compile_expression(text: str) -> tuple[str | None, list[str], list[str]]:
+    try:
+        node = ast.parse(text)
+    except SyntaxError as e:
+        return f"does not parse: {e.msg}", [], []
+
+    supported = _asteval_supported()
+    for sub in ast.walk(node):
+        if isinstance(sub, (ast.stmt, ast.expr)):
+            kind = type(sub).__name__
+            if kind.lower() not in supported:
+                return f"uses {kind}, which asteval can't run", [], []
+
+    compiled = gobber.CompiledEffect(text, node)
+    return None, sorted(compiled.names - compiled.writes), sorted(compiled.writes)
+
+
+def _entity_facts(
+    entity_type: str,
+    name: str,
+    data: Any,
+    where: str,
+    problems: list[tuple[str, str]],
+    warnings: list[tuple[str, str]],
+) -> dict[str, Any]:
+    """
+    Checks one entity's states and expressions, and sums up what the
+    cross-reference pass needs from it.
+    """
+    if not isinstance(data, dict):
+        data = {}
+    prefix = f"{where}." if where else ""
+    states = data.get("states") if isinstance(data.get("states"), dict) else {}
+    variables = data.get("variables") if isinstance(data.get("variables"), dict) else {}
+    characters = data.get("characters") if isinstance(data.get("characters"), dict) else {}
+
+    # [kind, target, where]: kind is an entity type, or "entity" for type:name
+    refs: list[list[str]] = []
+    # [where, error, reads, writes]
+    exprs: list[list[Any]] = []
+
+    def state_ref(target: Any, at: str):
+        if not isinstance(target, str) or target in states:
+            return
+        if target in eret.BUILTIN_STATES and entity_type != "quest":
+            return
+        problems.append((at, f"'{target}' is not a state of this {entity_type}"))
+
+    def expression(text: Any, at: str):
+        if not isinstance(text, str):
+            return
+        error, reads, writes = compile_expression(text)
+        if error is not None:
+            problems.append((at, error))
+        exprs.append([at, reads, writes])
+
+    if entity_type == "quest":
+        refs.append(["entity", data.get("start_entity"), f"{prefix}start_entity"])
+        state_ref(data.get("start_state"), f"{prefix}start_state")
+        expression(data.get("start_condition"), f"{prefix}start_condition")
+    if entity_type == "connection":
+        refs.append(["location", data.get("from"), f"{prefix}from"])
+        refs.append(["location", data.get("to"), f"{prefix}to"])
+    if entity_type == "character" and "location" in variables:
+        refs.append(["location", variables["location"], f"{prefix}variables.location"])
+    if "id" in data and data["id"] != name:
+        problems.append((f"{prefix}id", f"should be '{name}', like the file"))
+    for character in characters:
+        refs.append(["character", character, f"{prefix}characters.{character}"])
+
+    for idx, state in enumerate(data.get("opening_states") or []):
+        state_ref(state, f"{prefix}opening_states[{idx}]")
+    for idx, option in enumerate(data.get("option_menus") or []):
+        if isinstance(option, dict):
+            state_ref(option.get("state"), f"{prefix}option_menus[{idx}].state")
+
+    for state_name, state in states.items():
+        if not isinstance(state, dict):
+            continue
+        at = f"{prefix}states.{state_name}"
+        for idx, step in enumerate(state.get("steps") or []):
+            if not isinstance(step, dict):
+                continue
+            step_at = f"{at}.steps[{idx}]"
+            if step.get("type") == "dialogue":
+                refs.append(["character", step.get("speaker"), f"{step_at}.speaker"])
+            elif step.get("type") == "stateUpdate":
+                expression(step.get("update"), f"{step_at}.update")
+            for choice_idx, choice in enumerate(step.get("choices") or []):
+                if isinstance(choice, dict):
+                    expression(choice.get("effect"), f"{step_at}.choices[{choice_idx}].effect")
+        for idx, transition in enumerate(state.get("transitions") or []):
+            if not isinstance(transition, dict):
+                continue
+            expression(transition.get("condition"), f"{at}.transitions[{idx}].condition")
+
+    charted = eret.analyze(entity_type, data)
+    for state_name, idx, target in charted.missing:
+        problems.append(
+            (
+                f"{prefix}states.{state_name}.transitions[{idx}].target",
+                f"'{target}' is not a state of this {entity_type}",
+            )
+        )
+    for state_name in charted.dead_ends:
+        problems.append(
+            (f"{prefix}states.{state_name}", "is a dead end: no transition can fire")
+        )
+    for state_name in charted.unreachable:
+        warnings.append((f"{prefix}states.{state_name}", "can't be reached"))
+    for state_name, idx in charted.impossible:
+        warnings.append(
+            (f"{prefix}states.{state_name}.transitions[{idx}]", "can never fire")
+        )
+
+    return {
+        "type": entity_type,
+        "name": name,
+        "variables": [*variables, *ENGINE_VARIABLES.get(entity_type, [])],
+        "characters": list(characters),
+        "refs": [ref for ref in refs if isinstance(ref[1], str)],
+        "exprs": exprs,
+    }
+
+
+def check_file(path: str, entity_type: str) -> dict[str, Any]:
+    """
+    Every check that needs only this file. Returns its problems as
+    [severity, where, message] and a summary of each entity in it, all
+    plain JSON so it can be cached.
+    """
+    problems: list[tuple[str, str]] = []
+    warnings: list[tuple[str, str]] = []
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        return {"problems": [["error", "", f"can't be read: {e}"]], "entities": []}
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    entities = []
+    if entity_type == "location" and name == "connections":
+        check_schema({"type": "object"}, data, "", problems)
+        for id, connection in (data if isinstance(data, dict) else {}).items():
+            check_schema(SCHEMAS["connection"], connection, id, problems)
+            entities.append(_entity_facts("connection", id, connection, id, problems, warnings))
+    else:
+        check_schema(SCHEMAS.get(entity_type, {"type": "object"}), data, "", problems)
+        if entity_type != "player":
+            entities.append(_entity_facts(entity_type, name, data, "", problems, warnings))
+
+    return {
+        "problems": [
+            *(["error", where, message] for where, message in problems),
+            *(["warning", where, message] for where, message in warnings),
+        ],
+        "entities": entities,
+    }
+
+
+def _check_files(files: list[tuple[str, str]]) -> list[dict[str, Any]]:
+    """check_file() for a chunk of files, so one task carries many."""
+    return [check_file(path, entity_type) for path, entity_type in files]
+
+
+def story_files(base_path: str = "story") -> list[tuple[str, str]]:
+    """(path, entity type) for every story file, player.json included."""
+    files = []
+    player_file = f"{base_path}/player.json"
+    if os.path.exists(player_file):
+        files.append((player_file, "player"))
+    for type_dir in sorted(os.scandir(base_path), key=lambda e: e.name):
+        if not type_dir.is_dir():
+            continue
+        for entry in sorted(os.scandir(type_dir.path), key=lambda e: e.name):
+            if entry.name.endswith(".json"):
+                files.append((f"{base_path}/{type_dir.name}/{entry.name}", type_dir.name))
+    return files
+
+
+def _read_cache() -> dict[str, list[Any]]:
+    try:
+        with open(STORMFLY_CACHE_FILE, "r") as f:  # type: ignore
+            cache = json.load(f)
+    except (FileNotFoundError, TypeError, ValueError):
+        return {}
+    if cache.get("version") != CHECKS_VERSION:
+        return {}
+    return cache["files"]
+
+
+def _write_cache(files: dict[str, list[Any]]):
+    temp_file = f"{STORMFLY_CACHE_FILE}.tmp"
+    try:
+        with open(temp_file, "w") as f:
+            # dumps() encodes in C; dump() to a file goes piece by piece in Python
+            f.write(json.dumps({"version": CHECKS_VERSION, "files": files}))
+        os.replace(temp_file, STORMFLY_CACHE_FILE)  # type: ignore
+    except (OSError, TypeError):
+        # Only a cache; everything is checked again next run
+        pass
+
+
+def check_references(results: dict[str, dict[str, Any]]) -> list[Problem]:
+    """
+    Checks every file's references against every other file's entities,
+    from check_file() results keyed by path.
+    """
+    import asteval
+
+    builtins = set(asteval.Interpreter().symtable)
+    variables: dict[tuple[str, str], set[str]] = {}
+    for result in results.values():
+        for facts in result["entities"]:
+            variables[(facts["type"], facts["name"])] = set(facts["variables"])
+
+    problems = []
+    for path, result in results.items():
+        for facts in result["entities"]:
+            for kind, target, where in facts["refs"]:
+                if kind == "entity":
+                    entity_type, _, name = target.partition(":")
+                else:
+                    entity_type, name = kind, target
+                if (entity_type, name) not in variables:
+                    problems.append(
+                        Problem("error", path, where, f"no {entity_type} is called '{name}'")
+                    )
+
+            scopes = [(facts["type"], variables[(facts["type"], facts["name"])])]
+            for character in facts["characters"]:
+                scopes.append((character, variables.get(("character", character), set())))
+
+            def in_scope(symbol: str) -> bool:
+                for prefix, names in scopes:
+                    if symbol.startswith(prefix + "_") and symbol[len(prefix) + 1 :] in names:
+                        return True
+                return False
+
+            for where, reads, writes in facts["exprs"]:
+                for symbol in writes:
+                    if not in_scope(symbol):
+                        problems.append(
+                            Problem(
+                                "warning",
+                                path,
+                                where,
+                                f"assigns '{symbol}', which is no variable in scope, "
+                                "so the value is lost",
+                            )
+                        )
+                for symbol in reads:
+                    if symbol not in builtins and not in_scope(symbol):
+                        problems.append(
+                            Problem(
+                                "warning",
+                                path,
+                                where,
+                                f"reads '{symbol}', which is no variable in scope",
+                            )
+                        )
+    return problems
+
+
+def validate_story(
+    base_path: str = "story",
+    jobs: int | None = None,
+    use_cache: bool = True,
+) -> StoryReport:
+    """
+    Validates the whole story, checking only the files that changed since
+    the last run. jobs is the number of worker processes; None uses every
+    CPU, 1 checks in this process.
+    """
+    start = time.perf_counter()
+    files = story_files(base_path)
+    cached = _read_cache() if use_cache and STORMFLY_CACHE_FILE else {}
+
+    results: dict[str, dict[str, Any]] = {}
+    hashes: dict[str, str] = {}
+    stale: list[tuple[str, str]] = []
+    for path, entity_type in files:
+        with open(path, "rb") as f:
+            digest = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+        hashes[path] = digest
+        entry = cached.get(path)
+        if entry is not None and entry[0] == digest:
+            results[path] = entry[1]
+        else:
+            stale.append((path, entity_type))
+
+    if jobs == 1 or len(stale) < POOL_MIN_FILES:
+        checked = [check_file(path, entity_type) for path, entity_type in stale]
+    else:
+        chunks = [stale[i : i + POOL_CHUNK] for i in range(0, len(stale), POOL_CHUNK)]
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            checked = [
+                result for chunk in executor.map(_check_files, chunks) for result in chunk
+            ]
+    for (path, _), result in zip(stale, checked):
+        results[path] = result
+
+    if use_cache and STORMFLY_CACHE_FILE and (stale or len(cached) != len(results)):
+        _write_cache({path: [hashes[path], results[path]] for path, _ in files})
+
+    problems = [
+        Problem(severity, path, where, message)
+        for path, _ in files
+        for severity, where, message in results[path]["problems"]
+    ]
+    problems += check_references(results)
+    return StoryReport(problems, len(files), len(stale), time.perf_counter() - start)
+
+
+def validate(entity: gobber.EntityID) -> list[Problem]:
+    """Schema, state and expression problems in one loaded entity."""
+    found: list[tuple[str, str]] = []
+    warnings: list[tuple[str, str]] = []
+    data = gobber.get_entity_data(entity)
+    check_schema(SCHEMAS.get(entity[0], {"type": "object"}), data, "", found)
+    _entity_facts(entity[0], entity[1], data, "", found, warnings)
+    return [
+        *(Problem("error", str(entity), where, message) for where, message in found),
+        *(Problem("warning", str(entity), where, message) for where, message in warnings),
+    ]
 
-def fetch_key(entity: gobber.EntityID, keys: list[str]):
-  dct = gobber.get_entity_data(entity.get_file())
-  for key in keys:
-    if key not in dct:
-      return None
-    dct = dct[key]
-  
-  return dct
 
-def validate(entity: gobber.EntityID):
-  if entity[0] == "character":
-    pass
\ No newline at end of file
+if __name__ == "__main__":
+    report = validate_story(sys.argv[1] if len(sys.argv) > 1 else "story")
+    for problem in report.problems:
+        print(problem)
+    print(report.summary())
+    sys.exit(1 if report.errors else 0)